@@ -0,0 +1,357 @@
+"""
+Stand-in for the parts of the Nginx Proxy Manager REST API used by `NginxProxyManagerClient`.
+
+Runs as its own process so serving requests does not compete with the plugin for the GIL:
+
+    python -m benchmarks.fake_npm --port 0
+
+The port is printed on the first line of stdout once the server is listening. Besides the NPM endpoints, the server
+answers a few `/_bench/` endpoints used by the benchmark driver to seed data and read call counts.
+
+The tests run the same server in-process with `serve()`, and make endpoints fail on purpose with `FakeNPM.fail`.
+"""
+import argparse
+import base64
+import datetime
+import email.parser
+import email.policy
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from cryptography import x509
+
+
+ROUTES = (
+    ('POST', re.compile(r'^/api/tokens$'), 'tokens'),
+    ('GET', re.compile(r'^/api/tokens$'), 'tokens'),
+    ('GET', re.compile(r'^/api/nginx/proxy-hosts$'), 'list_hosts'),
+    ('GET', re.compile(r'^/api/nginx/proxy-hosts/(\d+)$'), 'get_host'),
+    ('PUT', re.compile(r'^/api/nginx/proxy-hosts/(\d+)$'), 'update_host'),
+    ('GET', re.compile(r'^/api/nginx/certificates$'), 'list_certs'),
+    ('POST', re.compile(r'^/api/nginx/certificates$'), 'create_cert'),
+    ('POST', re.compile(r'^/api/nginx/certificates/(\d+)/upload$'), 'upload_cert'),
+    ('DELETE', re.compile(r'^/api/nginx/certificates/(\d+)$'), 'delete_cert'),
+    ('GET', re.compile(r'^/_bench/stats$'), 'stats'),
+    ('POST', re.compile(r'^/_bench/seed$'), 'seed'),
+    ('POST', re.compile(r'^/_bench/reset$'), 'reset'),
+)
+
+# Calls are counted per endpoint, with IDs in the path replaced by `{id}`.
+ID_PATTERN = re.compile(r'(?<=/)\d+(?=/|$)')
+
+# Hosts and certificates that already exist were created well before any grace period.
+SEED_CREATED_ON = '2022-01-01 00:00:00'
+# Certificates that already exist were uploaded this long before they expire. Those that are not due yet have more
+# than a third of it left, so they are not due under the default renewal fraction either.
+SEED_LIFETIME = datetime.timedelta(days=90)
+
+
+def npm_time(dt: datetime.datetime) -> str:
+    return dt.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def npm_expiry(dt: datetime.datetime) -> str:
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+class FakeNPM:
+    """
+    In-memory proxy hosts and certificates, with a count of the calls made to each endpoint.
+    """
+    hosts: dict = None
+    certs: dict = None
+    calls: dict = None
+    failures: dict = None
+    latency: float = 0
+    token_lifetime: datetime.timedelta = datetime.timedelta(days=1)
+
+    _next_id: int = 1
+    _lock: threading.Lock = None
+
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self._lock = threading.Lock()
+        self.reset(clear=True)
+
+    def reset(self, clear: bool = False) -> None:
+        with self._lock:
+            self.calls = {}
+            self.failures = {}
+
+            if clear:
+                self.hosts = {}
+                self.certs = {}
+                self._next_id = 1
+
+    def count(self, route: str) -> None:
+        with self._lock:
+            self.calls[route] = self.calls.get(route, 0) + 1
+
+    def fail(self, route: str, status: int, times: int = 1) -> None:
+        """
+        Answers the next `times` calls to `route`, e.g. `GET /api/nginx/certificates`, with `status` instead.
+        """
+        with self._lock:
+            self.failures.setdefault(route, []).extend([status] * times)
+
+    def failure(self, route: str) -> int or None:
+        with self._lock:
+            statuses = self.failures.get(route, None)
+            return statuses.pop(0) if statuses else None
+
+    def _new_id(self) -> int:
+        with self._lock:
+            new_id = self._next_id
+            self._next_id += 1
+
+        return new_id
+
+    def add_cert(self, domain_names: list, expires: datetime.datetime or None, created_on: str = None) -> dict:
+        cert_id = self._new_id()
+        created_on = created_on or npm_time(datetime.datetime.utcnow())
+
+        self.certs[cert_id] = {
+            'id': cert_id,
+            'created_on': created_on,
+            'modified_on': created_on,
+            'owner_user_id': 1,
+            'provider': 'other',
+            'nice_name': domain_names[0] if domain_names else '',
+            'domain_names': domain_names,
+            'expires_on': npm_expiry(expires) if expires else None,
+            'meta': {},
+        }
+
+        return self.certs[cert_id]
+
+    def add_host(self, domain_names: list, certificate_id: int = 0, created_on: str = None) -> dict:
+        host_id = self._new_id()
+        created_on = created_on or npm_time(datetime.datetime.utcnow())
+
+        self.hosts[host_id] = {
+            'id': host_id,
+            'created_on': created_on,
+            'modified_on': created_on,
+            'owner_user_id': 1,
+            'domain_names': domain_names,
+            'forward_scheme': 'http',
+            'forward_host': '10.0.0.1',
+            'forward_port': 8080,
+            'access_list_id': 0,
+            'certificate_id': certificate_id,
+            'ssl_forced': certificate_id != 0,
+            'caching_enabled': False,
+            'block_exploits': True,
+            'advanced_config': '',
+            'meta': {'letsencrypt_agree': False, 'dns_challenge': False},
+            'allow_websocket_upgrade': True,
+            'http2_support': False,
+            'enabled': True,
+            'locations': [],
+            'hsts_enabled': certificate_id != 0,
+            'hsts_subdomains': False,
+        }
+
+        return self.hosts[host_id]
+
+    def seed(self, hosts: int, https_ratio: float, due_ratio: float, sans: int = 0, seed: int = 0) -> None:
+        """
+        Replaces all data with `hosts` proxy hosts.
+
+        :param int hosts: Number of proxy hosts.
+        :param float https_ratio: Fraction of hosts that already have a certificate.
+        :param float due_ratio: Fraction of those certificates that are already due for renewal.
+        :param int sans: Number of extra domain names on each host.
+        :param int seed: Seed for picking which hosts get a certificate and which certificates are due.
+        """
+        self.reset(clear=True)
+        rng = random.Random(seed)
+        now = datetime.datetime.utcnow()
+
+        for i in range(hosts):
+            domain_names = [f'host{i}.bench.test', *(f'alt{j}.host{i}.bench.test' for j in range(sans))]
+            certificate_id = 0
+
+            if rng.random() < https_ratio:
+                expires = now - datetime.timedelta(hours=1) if rng.random() < due_ratio else now + datetime.timedelta(
+                    days=31 + rng.random() * 59
+                )
+                certificate_id = self.add_cert(domain_names, expires, npm_time(expires - SEED_LIFETIME))['id']
+
+            self.add_host(domain_names, certificate_id, SEED_CREATED_ON)
+
+    def upload(self, cert_id: int, certificate: bytes) -> dict:
+        # NPM reads the expiry and common name back out of the uploaded certificate.
+        cert = x509.load_pem_x509_certificate(certificate)
+        common_name = cert.subject.get_attributes_for_oid(x509.NameOID.COMMON_NAME)[0].value
+
+        self.certs[cert_id].update({
+            'domain_names': [common_name],
+            'expires_on': npm_expiry(cert.not_valid_after),
+            'modified_on': npm_time(datetime.datetime.utcnow()),
+        })
+
+        return self.certs[cert_id]
+
+    def update_host(self, host_id: int, data: dict) -> dict:
+        self.hosts[host_id].update(data)
+        self.hosts[host_id]['modified_on'] = npm_time(datetime.datetime.utcnow())
+
+        return self.hosts[host_id]
+
+
+def multipart_files(content_type: str, body: bytes) -> dict:
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body
+    )
+
+    return {
+        part.get_param('name', header='content-disposition'): part.get_payload(decode=True)
+        for part in message.iter_parts()
+    }
+
+
+def make_handler(npm: FakeNPM):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status: int, body) -> None:
+            data = json.dumps(body).encode()
+
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _handle(self, method: str) -> None:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            path = self.path.split('?', 1)[0]
+
+            for route_method, pattern, name in ROUTES:
+                match = pattern.match(path)
+                if route_method == method and match:
+                    break
+            else:
+                return self._send(404, {'error': {'message': 'Not Found'}})
+
+            if path.startswith('/api/'):
+                route = f'{method} {ID_PATTERN.sub("{id}", path)}'
+                npm.count(route)
+
+                if npm.latency:
+                    time.sleep(npm.latency)
+
+                status = npm.failure(route)
+                if status is not None:
+                    return self._send(status, {'error': {'message': f'Failed on purpose with {status}.'}})
+
+                if name != 'tokens' and not self.headers.get('Authorization', '').startswith('Bearer '):
+                    return self._send(401, {'error': {'message': 'Unauthorized'}})
+
+            return getattr(self, f'_{name}')(*(int(group) for group in match.groups()), body=body)
+
+        def _tokens(self, body: bytes):
+            expires = datetime.datetime.now(datetime.timezone.utc) + npm.token_lifetime
+            payload = base64.urlsafe_b64encode(json.dumps({'exp': int(expires.timestamp())}).encode()).rstrip(b'=')
+
+            return self._send(200, {'token': f'bench.{payload.decode()}.bench', 'expires': npm_expiry(expires)})
+
+        def _list_hosts(self, body: bytes):
+            if 'expand=certificate' not in self.path:
+                return self._send(200, list(npm.hosts.values()))
+
+            return self._send(200, [
+                {**host, 'certificate': npm.certs.get(host['certificate_id'], None)} for host in npm.hosts.values()
+            ])
+
+        def _get_host(self, host_id: int, body: bytes):
+            if host_id not in npm.hosts:
+                return self._send(404, {'error': {'message': 'Not Found'}})
+            return self._send(200, npm.hosts[host_id])
+
+        def _update_host(self, host_id: int, body: bytes):
+            if host_id not in npm.hosts:
+                return self._send(404, {'error': {'message': 'Not Found'}})
+            return self._send(200, npm.update_host(host_id, json.loads(body)))
+
+        def _list_certs(self, body: bytes):
+            return self._send(200, list(npm.certs.values()))
+
+        def _create_cert(self, body: bytes):
+            data = json.loads(body)
+            cert = npm.add_cert([], None)
+            cert['nice_name'] = data.get('nice_name', '')
+            return self._send(201, cert)
+
+        def _upload_cert(self, cert_id: int, body: bytes):
+            if cert_id not in npm.certs:
+                return self._send(404, {'error': {'message': 'Not Found'}})
+
+            files = multipart_files(self.headers['Content-Type'], body)
+            return self._send(200, npm.upload(cert_id, files['certificate']))
+
+        def _delete_cert(self, cert_id: int, body: bytes):
+            return self._send(200, npm.certs.pop(cert_id, None) is not None)
+
+        def _stats(self, body: bytes):
+            return self._send(200, {'calls': npm.calls, 'hosts': len(npm.hosts), 'certificates': len(npm.certs)})
+
+        def _seed(self, body: bytes):
+            npm.seed(**json.loads(body))
+            return self._send(200, {'hosts': len(npm.hosts), 'certificates': len(npm.certs)})
+
+        def _reset(self, body: bytes):
+            npm.reset()
+            return self._send(200, True)
+
+        def do_GET(self):
+            self._handle('GET')
+
+        def do_POST(self):
+            self._handle('POST')
+
+        def do_PUT(self):
+            self._handle('PUT')
+
+        def do_DELETE(self):
+            self._handle('DELETE')
+
+    return Handler
+
+
+def serve(npm: FakeNPM, host: str = '127.0.0.1', port: int = 0) -> ThreadingHTTPServer:
+    """
+    Starts a server for `npm` on a background thread. Stop it with `shutdown()` and `server_close()`.
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(npm))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, args=(0.05,), name='fake-npm', daemon=True).start()
+
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake Nginx Proxy Manager API for benchmarks.')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--latency-ms', type=float, default=0, help='Added to every NPM API call.')
+    options = parser.parse_args()
+
+    server = ThreadingHTTPServer((options.host, options.port), make_handler(FakeNPM(options.latency_ms / 1000)))
+    server.daemon_threads = True
+
+    print(server.server_address[1], flush=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
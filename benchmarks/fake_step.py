@@ -0,0 +1,149 @@
+"""
+Stub of the `step` CLI, covering the commands `StepClient` runs.
+
+Certificates are signed by a throwaway CA kept in `$STEP_STUB_DIR`, created with `python -m benchmarks.fake_step init`.
+Every invocation is appended to `$STEP_STUB_DIR/calls.log` so the benchmark driver can count subprocesses. Set
+`STEP_STUB_LIFETIME` to the lifetime of issued certificates in seconds (default 1 day) and `STEP_STUB_DELAY` to a
+number of seconds to sleep per invocation, to stand in for the round trip to a real CA.
+"""
+import datetime
+import ipaddress
+import os
+import pathlib
+import sys
+import time
+
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.serialization import (
+    load_pem_private_key, Encoding, PrivateFormat, NoEncryption
+)
+
+
+# Options of `step ca ...` that take a value. Anything else starting with `--` is a flag.
+VALUE_OPTIONS = {
+    '--san', '--not-before', '--not-after', '--provisioner-password-file', '--ca-url', '--fingerprint',
+    '--provisioner', '--kty', '--curve', '--size',
+}
+
+
+def stub_dir() -> pathlib.Path:
+    return pathlib.Path(os.environ['STEP_STUB_DIR'])
+
+
+def init(directory: pathlib.Path) -> None:
+    """
+    Creates the throwaway CA used to sign certificates.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'Benchmark Intermediate CA')])
+    now = datetime.datetime.utcnow()
+
+    certificate = x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(
+        key.public_key()
+    ).serial_number(x509.random_serial_number()).not_valid_before(now).not_valid_after(
+        now + datetime.timedelta(days=3650)
+    ).add_extension(x509.BasicConstraints(ca=True, path_length=0), critical=True).sign(key, hashes.SHA256())
+
+    (directory / 'ca.crt').write_bytes(certificate.public_bytes(Encoding.PEM))
+    (directory / 'ca.key').write_bytes(key.private_bytes(Encoding.PEM, PrivateFormat.PKCS8, NoEncryption()))
+
+
+def parse(argv: list) -> tuple[list, dict]:
+    positional = []
+    options = {}
+    arguments = iter(argv)
+
+    for argument in arguments:
+        if argument in VALUE_OPTIONS:
+            options.setdefault(argument, []).append(next(arguments))
+        elif argument.startswith('--'):
+            options[argument] = [True]
+        else:
+            positional.append(argument)
+
+    return positional, options
+
+
+def sign(public_key, common_name: str, sans: list) -> bytes:
+    directory = stub_dir()
+    ca_certificate = x509.load_pem_x509_certificate((directory / 'ca.crt').read_bytes())
+    ca_key = load_pem_private_key((directory / 'ca.key').read_bytes(), None)
+    now = datetime.datetime.utcnow()
+    names = []
+
+    for san in dict.fromkeys([common_name, *sans]):
+        try:
+            names.append(x509.IPAddress(ipaddress.ip_address(san)))
+        except ValueError:
+            names.append(x509.DNSName(san))
+
+    certificate = x509.CertificateBuilder().subject_name(
+        x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    ).issuer_name(ca_certificate.subject).public_key(public_key).serial_number(
+        x509.random_serial_number()
+    ).not_valid_before(now - datetime.timedelta(minutes=1)).not_valid_after(
+        now + datetime.timedelta(seconds=int(os.environ.get('STEP_STUB_LIFETIME', 86400)))
+    ).add_extension(x509.SubjectAlternativeName(names), critical=False).sign(ca_key, hashes.SHA256())
+
+    return certificate.public_bytes(Encoding.PEM) + ca_certificate.public_bytes(Encoding.PEM)
+
+
+def certificate(positional: list, options: dict) -> None:
+    common_name, crt_file, key_file = positional
+    key = ec.generate_private_key(ec.SECP256R1())
+
+    pathlib.Path(crt_file).write_bytes(sign(key.public_key(), common_name, options.get('--san', [])))
+    pathlib.Path(key_file).write_bytes(key.private_bytes(Encoding.PEM, PrivateFormat.PKCS8, NoEncryption()))
+
+
+def sign_request(positional: list, options: dict) -> None:
+    csr_file, crt_file = positional
+    csr = x509.load_pem_x509_csr(pathlib.Path(csr_file).read_bytes())
+    common_name = csr.subject.get_attributes_for_oid(NameOID.COMMON_NAME)[0].value
+
+    try:
+        sans = csr.extensions.get_extension_for_class(x509.SubjectAlternativeName).value
+        sans = [str(name) for name in sans.get_values_for_type(x509.DNSName)] + [
+            str(address) for address in sans.get_values_for_type(x509.IPAddress)
+        ]
+    except x509.ExtensionNotFound:
+        sans = []
+
+    pathlib.Path(crt_file).write_bytes(sign(csr.public_key(), common_name, sans))
+
+
+def main(argv: list) -> int:
+    if argv[:1] == ['init']:
+        init(pathlib.Path(argv[1]) if len(argv) > 1 else stub_dir())
+        return 0
+
+    with (stub_dir() / 'calls.log').open('a') as log:
+        log.write(' '.join(argv[:2]) + '\n')
+
+    time.sleep(float(os.environ.get('STEP_STUB_DELAY', 0)))
+
+    if argv[:1] != ['ca'] or len(argv) < 2:
+        print(f'step stub does not support: {" ".join(argv)}', file=sys.stderr)
+        return 1
+
+    positional, options = parse(argv[2:])
+
+    if argv[1] in ('bootstrap', 'health'):
+        print('ok')
+    elif argv[1] == 'certificate':
+        certificate(positional, options)
+    elif argv[1] == 'sign':
+        sign_request(positional, options)
+    else:
+        print(f'step stub does not support: ca {argv[1]}', file=sys.stderr)
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
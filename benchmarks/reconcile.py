@@ -0,0 +1,285 @@
+"""
+Reconcile cycle benchmark.
+
+Seeds a fake NPM (`benchmarks.fake_npm`) with proxy hosts and certificates, puts a stub `step` CLI
+(`benchmarks.fake_step`) on the PATH, then sets up the plugin exactly as `core.app.run` does and drives the
+`Reconciler` for a number of cycles. Each scenario runs in a fresh process, so peak memory is per scenario.
+
+    python -m benchmarks.reconcile --hosts 10 1000 10000 --cycles 3 --output results.json
+
+For every cycle the results hold the wall time of each reconcile phase, the NPM API calls made per endpoint and the
+number of step-cli subprocesses run. Results are written as JSON so runs of different versions can be compared.
+"""
+import argparse
+import asyncio
+import importlib.metadata
+import json
+import multiprocessing
+import os
+import pathlib
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+
+from step_npm_plugin.core import app, args, settings
+from step_npm_plugin.core.reconciler import Reconciler
+from step_npm_plugin.core.store import StateStore
+
+
+ROOT = pathlib.Path(__file__).absolute().parent.parent
+
+DEFAULT_HOSTS = (10, 1000, 10000)
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmark reconcile cycles against a fake NPM and step-cli.')
+    parser.add_argument('--hosts', type=int, nargs='+', default=DEFAULT_HOSTS, help='Proxy hosts per scenario.')
+    parser.add_argument('--cycles', type=int, default=3, help='Reconcile cycles to run per scenario.')
+    parser.add_argument('--https-ratio', type=float, default=0.9, help='Fraction of hosts that have a certificate.')
+    parser.add_argument('--due-ratio', type=float, default=0.01, help='Fraction of certificates due for renewal.')
+    parser.add_argument('--sans', type=int, default=0, help='Extra domain names per host.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=4, help='STEP_WORKERS')
+    parser.add_argument('--pool-size', type=int, default=8, help='NPM_POOL_SIZE')
+    parser.add_argument('--key-pool', type=int, default=0, help='STEP_KEY_POOL_SIZE')
+    parser.add_argument('--latency-ms', type=float, default=0, help='Latency added to every NPM API call.')
+    parser.add_argument('--step-delay', type=float, default=0, help='Seconds each step-cli call takes.')
+    parser.add_argument('--consolidate', type=str, default='none', help='CONSOLIDATE')
+    parser.add_argument('--state', action='store_true', help='Keep state in a StateStore, as the plugin does.')
+    parser.add_argument('--tracemalloc', action='store_true', help='Trace Python allocations, slows every phase.')
+    parser.add_argument('--log-level', type=str, default='CRITICAL')
+    parser.add_argument('--output', type=str, default='benchmark-results.json', help='JSON results, - for stdout.')
+
+    return parser.parse_args(argv)
+
+
+def environment() -> dict:
+    try:
+        version = importlib.metadata.version('step_npm_plugin')
+    except importlib.metadata.PackageNotFoundError:
+        version = None
+
+    try:
+        revision = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+
+    return {
+        'version': version,
+        'revision': revision,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+class FakeNPMProcess:
+    """
+    Runs `benchmarks.fake_npm` in a child process.
+    """
+    port: int = None
+    process: subprocess.Popen = None
+
+    def __init__(self, latency_ms: float = 0):
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.fake_npm', '--latency-ms', str(latency_ms)],
+            cwd=ROOT, stdout=subprocess.PIPE, text=True
+        )
+        self.port = int(self.process.stdout.readline())
+
+    def _call(self, method: str, path: str, data: dict = None):
+        request = urllib.request.Request(
+            f'http://127.0.0.1:{self.port}{path}', method=method,
+            data=json.dumps(data).encode() if data is not None else None,
+            headers={'Content-Type': 'application/json'}
+        )
+
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+
+    def seed(self, **kwargs) -> dict:
+        return self._call('POST', '/_bench/seed', kwargs)
+
+    def stats(self) -> dict:
+        return self._call('GET', '/_bench/stats')
+
+    def stop(self) -> None:
+        self.process.terminate()
+        self.process.wait()
+
+
+class FakeStep:
+    """
+    Puts the `benchmarks.fake_step` stub on the PATH as `step`, with its own throwaway CA.
+    """
+    directory: pathlib.Path = None
+
+    def __init__(self, directory: pathlib.Path, delay: float = 0):
+        self.directory = directory
+        bin_dir = directory / 'bin'
+        bin_dir.mkdir(parents=True)
+
+        step = bin_dir / 'step'
+        step.write_text(f'#!/bin/sh\nexec "{sys.executable}" -m benchmarks.fake_step "$@"\n')
+        step.chmod(0o755)
+
+        os.environ['PATH'] = f'{bin_dir}{os.pathsep}{os.environ.get("PATH", "")}'
+        os.environ['PYTHONPATH'] = f'{ROOT}{os.pathsep}{os.environ.get("PYTHONPATH", "")}'
+        os.environ['STEP_STUB_DIR'] = str(directory)
+        os.environ['STEP_STUB_DELAY'] = str(delay)
+
+        subprocess.run([str(step), 'init', str(directory)], check=True)
+        (directory / 'calls.log').touch()
+
+    @property
+    def calls(self) -> int:
+        with (self.directory / 'calls.log').open() as log:
+            return sum(1 for _ in log)
+
+
+def build_config(options: dict, npm_port: int, state_file: pathlib.Path or None) -> settings.AppConfig:
+    return settings.AppConfig(args.parser.parse_args([
+        '--npm-scheme', 'http', '--npm-host', '127.0.0.1', '--npm-port', str(npm_port),
+        '--npm-user', 'bench@example.com', '--npm-pass', 'bench', '--npm-proxy-host-grace-period', '1',
+        '--npm-pool-size', str(options['pool_size']),
+        '--step-ca-scheme', 'https', '--step-ca-domain', 'localhost', '--step-ca-port', '9000',
+        '--step-ca-fingerprint', '0' * 64, '--step-ca-provisioner-pass', 'bench', '--step-issuer', 'cli',
+        '--step-workers', str(options['workers']), '--step-key-pool-size', str(options['key_pool']),
+        '--consolidate', options['consolidate'],
+        '--log-level', options['log_level'], '--state-file', str(state_file) if state_file else 'none',
+    ]))
+
+
+def call_delta(before: dict, after: dict) -> dict:
+    return {
+        endpoint: count - before.get(endpoint, 0)
+        for endpoint, count in sorted(after.items()) if count - before.get(endpoint, 0)
+    }
+
+
+async def run_cycles(config: settings.AppConfig, cycles: int, npm: FakeNPMProcess, step: FakeStep) -> dict:
+    started = time.perf_counter()
+    step_client, (npm_client,) = await app.setup(config)
+
+    store = None
+    if config.STATE_FILE.lower() != 'none':
+        store = StateStore(pathlib.Path(config.STATE_FILE), npm_client.uri)
+
+    reconciler = Reconciler(config, step_client, npm_client, store, app.issuance_pool(config, step_client))
+    cache = reconciler.issuance_pool.cache
+    reconciler.restore()
+    setup_time = time.perf_counter() - started
+
+    results = []
+
+    for cycle in range(1, cycles + 1):
+        npm_calls = npm.stats()['calls']
+        step_calls = step.calls
+        cache_hits = cache.hits if cache is not None else 0
+
+        started = time.perf_counter()
+        await reconciler.reconcile()
+        wall_time = time.perf_counter() - started
+
+        results.append({
+            'cycle': cycle,
+            'wall_time': wall_time,
+            'phases': dict(reconciler.timings),
+            'api_calls': call_delta(npm_calls, npm.stats()['calls']),
+            'subprocesses': step.calls - step_calls,
+            'cache_hits': (cache.hits if cache is not None else 0) - cache_hits,
+        })
+
+    reconciler.issuance_pool.shutdown()
+    npm_client.close()
+    if step_client.key_pool is not None:
+        step_client.key_pool.shutdown()
+    if store is not None:
+        store.close()
+
+    return {'setup_time': setup_time, 'cycles': results}
+
+
+def run_scenario(hosts: int, options: dict) -> dict:
+    """
+    Runs one scenario from a fresh process.
+    """
+    with tempfile.TemporaryDirectory(prefix='step-npm-bench-') as directory:
+        directory = pathlib.Path(directory)
+        # Setup writes the provisioner password to ./.secrets, keep it inside the throwaway directory.
+        os.chdir(directory)
+
+        npm = FakeNPMProcess(options['latency_ms'])
+        try:
+            seeded = npm.seed(
+                hosts=hosts, https_ratio=options['https_ratio'], due_ratio=options['due_ratio'], sans=options['sans'],
+                seed=options['seed']
+            )
+            step = FakeStep(directory / 'step', options['step_delay'])
+            config = build_config(options, npm.port, directory / 'state.db' if options['state'] else None)
+
+            if options['tracemalloc']:
+                tracemalloc.start()
+
+            result = asyncio.run(run_cycles(config, options['cycles'], npm, step))
+
+            if options['tracemalloc']:
+                result['traced_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+        finally:
+            npm.stop()
+
+    return {
+        'hosts': hosts,
+        'certificates': seeded['certificates'],
+        **result,
+        'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+
+def summary_line(scenario: dict) -> str:
+    cycles = scenario['cycles']
+    first = cycles[0]
+    steady = cycles[1:] or cycles
+
+    return (
+        f'{scenario["hosts"]:>6} hosts: first cycle {first["wall_time"]:.3f}s'
+        f' ({sum(first["api_calls"].values())} API calls, {first["subprocesses"]} subprocesses),'
+        f' later cycles {sum(cycle["wall_time"] for cycle in steady) / len(steady):.3f}s avg,'
+        f' peak RSS {scenario["peak_rss_bytes"] / 2 ** 20:.1f} MiB'
+    )
+
+
+def main(argv: list = None) -> int:
+    options = parse_args(argv)
+    results = {'environment': environment(), 'options': vars(options), 'scenarios': []}
+
+    for hosts in options.hosts:
+        # A new process per scenario keeps peak memory and caches from leaking between scenarios.
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            scenario = executor.submit(run_scenario, hosts, vars(options)).result()
+
+        results['scenarios'].append(scenario)
+        print(summary_line(scenario), file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+
+    if options.output == '-':
+        print(output)
+    else:
+        pathlib.Path(options.output).write_text(output)
+        print(f'Results written to {pathlib.Path(options.output).absolute()}', file=sys.stderr)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,51 +1,24 @@
-import datetime
+import asyncio
 import logging
-import random
-from logging.config import dictConfig
 import pathlib
-import time
+import signal
 
-from step_npm_plugin.npm import (
-    NginxProxyManagerClient, FailedToLogin, parse_http_hosts,
-    parse_certificates
-)
-from step_npm_plugin.step import StepClient, StepCertificate
-from step_npm_plugin.schedule import Timer
+from step_npm_plugin.metrics import REGISTRY
+from step_npm_plugin.npm import AsyncNginxProxyManagerClient, FailedToLogin, GenericNPMError
+from step_npm_plugin.step import StepClient, NativeStepClient, KeyPool, IssuancePool, CertificateCache, CAHealth
+from step_npm_plugin.schedule import Scheduler
 
 from . import settings
+from .coordination import Lease, LeaseKeeper, Shard, default_replica_id
+from .fleet import Fleet
+from .logs import configure_logging
+from .profiling import CycleProfiler
+from .reconciler import Reconciler
+from .store import StateStore
 
 
-def setup(config: settings.AppConfig):
-    # Configure Logging
-    dictConfig({
-        'version': 1,
-        'disable_existing_loggers': True,
-        'formatters': {
-            'standard': {
-                'format': '%(asctime)s [%(levelname)s %(filename)s:%(lineno)d] %(funcName)s(): %(message)s'
-            }
-        },
-        'handlers': {
-            'default': {
-                'class': 'logging.StreamHandler',
-                'formatter': 'standard',
-                'level': config.LOG_LEVEL,
-                'stream': 'ext://sys.stdout'
-            }
-        },
-        'loggers': {
-            '': {
-                'handlers': ['default'],
-                'level': 'WARNING',
-                'propagate': False
-            },
-            'console': {
-                'level': config.LOG_LEVEL,
-                'handlers': ['default'],
-                'propagate': False
-            }
-        }
-    })
+async def setup(config: settings.AppConfig):
+    configure_logging(config)
 
     logger = logging.getLogger('console')
     logger.debug('Logging initialised.')
@@ -57,140 +30,191 @@ def setup(config: settings.AppConfig):
         secrets_dir.mkdir(parents=True, exist_ok=True)
         logger.debug(f'Secrets dir created: {secrets_dir.absolute()}')
 
-    provisioner_pass_file = secrets_dir / 'provisioner_pass'
+    key_pool = None
+    if config.STEP_KEY_POOL_SIZE > 0:
+        key_pool = KeyPool(config.STEP_KEY_TYPE, config.STEP_KEY_POOL_SIZE, config.STEP_KEY_POOL_LOW)
+        key_pool.start()
+        logger.debug('Key pool of %s %s keys started.', config.STEP_KEY_POOL_SIZE, config.STEP_KEY_TYPE)
+
+    if config.STEP_ISSUER == 'native':
+        # Issues through step-ca's API, the provisioner password stays in memory.
+        step_client = NativeStepClient(
+            config.STEP_CA_SCHEME, config.STEP_CA_DOMAIN, config.STEP_CA_PORT, config.STEP_CA_FINGERPRINT.to_string(),
+            config.STEP_CA_PROVISIONER_PASS, config.STEP_CA_PROVISIONER, secrets_dir / 'root_ca.crt',
+            config.STEP_KEY_TYPE, key_pool
+        )
+    else:
+        provisioner_pass_file = secrets_dir / 'provisioner_pass'
+
+        with provisioner_pass_file.open('w') as pf:
+            pf.write(config.STEP_CA_PROVISIONER_PASS.to_string())
+        logger.debug(f"Written provisioner pass to: {provisioner_pass_file.absolute()}")
+
+        step_client = StepClient(
+            config.STEP_CA_SCHEME, config.STEP_CA_DOMAIN, config.STEP_CA_PORT, config.STEP_CA_FINGERPRINT.to_string(),
+            provisioner_pass_file, key_pool
+        )
+
+    npm_clients = [
+        AsyncNginxProxyManagerClient(
+            target.host, target.port, (config.NPM_USER, config.NPM_PASS), target.scheme,
+            pool_size=config.NPM_POOL_SIZE
+        )
+        for target in settings.npm_targets(config)
+    ]
+
+    try:
+        # Neither depends on the other, so the CA and NPM are waited on at the same time.
+        await asyncio.gather(
+            asyncio.to_thread(step_client.bootstrap), *(npm_client.login() for npm_client in npm_clients)
+        )
+    except BaseException:
+        shutdown(step_client, npm_clients)
+        raise
 
-    with provisioner_pass_file.open('w') as pf:
-        pf.write(config.STEP_CA_PROVISIONER_PASS.to_string())
-    logger.debug(f"Written provisioner pass to: {provisioner_pass_file.absolute()}")
+    logger.info("Step Client bootstrapped.")
+    logger.info(f"NPM Client logged in to {', '.join(npm_client.uri for npm_client in npm_clients)}.")
+    logger.info("Setup complete.")
 
-    step_client = StepClient(
-        config.STEP_CA_SCHEME, config.STEP_CA_DOMAIN, config.STEP_CA_PORT, config.STEP_CA_FINGERPRINT.to_string(),
-        provisioner_pass_file
-    )
-    step_client.bootstrap()
+    return step_client, npm_clients
 
-    logger.info("Step Client bootstrapped.")
 
-    npm_client = NginxProxyManagerClient(
-        config.NPM_HOST, config.NPM_PORT, (config.NPM_USER, config.NPM_PASS), config.NPM_SCHEME
+def issuance_pool(config: settings.AppConfig, step_client: StepClient) -> IssuancePool:
+    cache = CertificateCache(config.STEP_CACHE_SIZE) if config.STEP_CACHE_SIZE > 0 else None
+    health = CAHealth(step_client, config.STEP_HEALTH_INTERVAL, config.STEP_HEALTH_MAX_BACKOFF)
+    return IssuancePool(
+        step_client, config.STEP_WORKERS, config.STEP_TIMEOUT, cache, health, config.STEP_RENEW_MODE
     )
 
-    npm_client.login()
 
-    logger.info("NPM Client logged in.")
-    logger.info("Setup complete.")
+def state_file(config: settings.AppConfig, target: settings.NPMTarget, targets: list) -> pathlib.Path or None:
+    """
+    Where the state of an NPM instance is kept. With more than one instance, each gets a file of its own next to
+    `STATE_FILE`.
+    """
+    if config.STATE_FILE.lower() == 'none':
+        return None
+
+    path = pathlib.Path(config.STATE_FILE)
+
+    if len(targets) == 1:
+        return path
+
+    return path.with_name(f'{path.stem}-{target.host}-{target.port}{path.suffix}')
+
+
+def shutdown(
+        step_client: StepClient, npm_clients: list, pool: IssuancePool = None, stores: list = (),
+        lease_keeper: LeaseKeeper = None, metrics_server=None
+) -> None:
+    """
+    Stops whatever `setup` and `run_async` started: the lease is released, in-flight issuance is waited on, and the
+    key pool process, NPM connections, state stores and metrics server are closed.
+    """
+    if lease_keeper is not None:
+        lease_keeper.stop()
+        lease_keeper.lease.close()
+
+    if pool is not None:
+        pool.shutdown()
+
+    if step_client.key_pool is not None:
+        step_client.key_pool.shutdown()
 
-    return step_client, npm_client
+    for npm_client in npm_clients:
+        npm_client.close()
+
+    for store in stores:
+        store.close()
+
+    if metrics_server is not None:
+        metrics_server.stop()
 
 
 def run(config: settings.AppConfig):
+    try:
+        asyncio.run(run_async(config))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        logging.getLogger('console').info('Stopped.')
+
+
+async def run_async(config: settings.AppConfig):
     logger = logging.getLogger('console')
-    step_client, npm_client = setup(config)
+    step_client, npm_clients = await setup(config)
+
+    metrics_server = None
+    pool = None
+    stores = []
+    lease_keeper = None
+
+    try:
+        if config.METRICS_PORT > 0:
+            # http.server is only imported once metrics are served.
+            from step_npm_plugin.metrics.server import MetricsServer
+
+            metrics_server = MetricsServer(REGISTRY, config.METRICS_HOST, config.METRICS_PORT)
+            metrics_server.start()
+
+        targets = settings.npm_targets(config)
+        pool = issuance_pool(config, step_client)
+        reconcilers = []
+
+        for target, npm_client in zip(targets, npm_clients):
+            path = state_file(config, target, targets)
+            store = StateStore(path, npm_client.uri) if path is not None else None
+            if store is not None:
+                stores.append(store)
+            reconcilers.append(Reconciler(config, step_client, npm_client, store, pool))
+
+        # A single instance is reconciled directly, several share their certificates through a fleet.
+        reconciler = reconcilers[0] if len(reconcilers) == 1 else Fleet(reconcilers, pool)
+        reconciler.restore()
+
+        scheduler = Scheduler(config.SCHEDULE)
+        profiler = CycleProfiler.from_config(config)
 
-    timer = Timer(sync_clock=False)
-    timer.set_schedule(config.SCHEDULE)
+        if profiler.enabled:
+            logger.info(f'Profiling one in every {profiler.every} cycle(s) to {profiler.directory.absolute()}.')
 
-    while True:
         try:
-            if timer.breached:
-                hosts = parse_http_hosts(npm_client.get_proxy_hosts())
-                http_hosts = []
-                for host in hosts:
-                    grace_delta = datetime.timedelta(seconds=config.NPM_PROXY_HOST_GRACE_PERIOD)
-                    grace_expired = host['created_on'] + grace_delta < datetime.datetime.now(datetime.timezone.utc)
-
-                    if host['is_https'] is False and host['created_on'] and grace_expired:
-                        http_hosts.append(host)
-                    elif not grace_expired:
-                        logger.warning(
-                            f"Host {host['primary_domain']} is new and was created on {host['created_on'].isoformat()}."
-                            f" Awaiting grace period of {config.NPM_PROXY_HOST_GRACE_PERIOD} seconds to allow for"
-                            f" LetsEncrypt certificates to apply, in case it was requested."
-                        )
-
-                certs = parse_certificates(npm_client.get_certificates())
-
-                mapper = []
-
-                # Phase 1 - Add new certificates
-                if len(http_hosts) > 0:
-                    domains = [host["primary_domain"] for host in http_hosts]
-                    logger.info(f'New hosts found that are currently HTTP Only: {", ".join(domains)}')
-
-                    for host in http_hosts:
-                        existing_cert = next(
-                            (cert for cert in certs if cert['primary_domain'] == host['primary_domain']), None
-                        )
-
-                        if existing_cert:
-                            # Cert exists, use it.
-                            logger.info(f'Existing certificate for {host["primary_domain"]} already on NPM.')
-                            mapper.append({
-                                'proxy_host': host['id'],
-                                'certificate': existing_cert['id'],
-                                'force': False
-                            })
-                        else:
-                            # No existing cert, create a new one...
-                            logger.info(f'No existing cert for {host["primary_domain"]}, need to generate one.')
-                            crt_key_pair = step_client.create_certificate(host['primary_domain'], *host['sans'])
-                            logger.debug(f'Certificate & Key created in the working directory: {crt_key_pair}')
-
-                            step_cert = StepCertificate.from_file(*crt_key_pair)
-
-                            cert_id = npm_client.create_certificate(step_cert, host['primary_domain'])
-
-                            mapper.append({
-                                'proxy_host': host['id'],
-                                'certificate': cert_id,
-                                'force': False
-                            })
-
-                # Phase 2 - Renew old ones
-                for cert in certs:
-                    rand_jitter = random.randrange(1, 10)
-                    if (cert['expires'] - datetime.timedelta(minutes=rand_jitter)) < datetime.datetime.now():
-                        logger.info(
-                            f'Certificate {cert.get("primary_domain", None)} expires at'
-                            f' {cert["expires"].strftime("%Y-%m-%d %H:%M:%S")}. Starting renewal.'
-                        )
-
-                        existing_host = next(
-                            (host for host in hosts if host['primary_domain'] == cert['primary_domain']), None
-                        )
-                        if existing_host is None:
-                            logger.debug(f'No matching host found for {cert["primary_domain"]}.')
-                            continue
-                        is_letsencrypt = existing_host.get('certificate', {}).get('provider', None) == 'letsencrypt'
-
-                        if existing_host and not is_letsencrypt:
-                            crt_key_pair = step_client.create_certificate(
-                                existing_host['primary_domain'], *existing_host['sans']
-                            )
-                            logger.debug(f'Certificate & Key created in the working directory: {crt_key_pair}')
-
-                            step_cert = StepCertificate.from_file(*crt_key_pair)
-                            npm_client.delete_certificate(cert['id'])
-                            new_cert_id = npm_client.create_certificate(step_cert, existing_host['primary_domain'])
-
-                            mapper.append({
-                                'proxy_host': existing_host['id'],
-                                'certificate': new_cert_id,
-                                'force': True
-                            })
-                        else:
-                            logger.info(f'Cert not assigned to a host, or the host uses a letsencrypt certificate'
-                                        f'... skipping.')
-
-                for cert_map in mapper:
-                    npm_client.update_proxy_host_certificate(
-                        cert_map['proxy_host'], cert_map['certificate'], cert_map['force']
-                    )
-
-            time.sleep(1)
-
-        except FailedToLogin as exc:
-            # An attempt to re-login has failed. Something may have changed server-side.
-            logger.error("An attempt to re login to NPM has failed, did the users credentials change?")
-            logger.debug(f"{exc}")
-            raise exc
+            # SIGHUP triggers a sync straight away.
+            asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, scheduler.wake)
+        except (NotImplementedError, AttributeError):
+            logger.debug('Signal handlers are not supported on this platform.')
+
+        lease = None
+        if config.LEASE_FILE:
+            # Replicas of the same shard share a lease, only the one holding it reconciles.
+            lease = Lease(
+                pathlib.Path(config.LEASE_FILE), Shard.from_config(config).name,
+                config.REPLICA_ID or default_replica_id(), config.LEASE_TTL
+            )
+            lease_keeper = LeaseKeeper(lease, on_acquired=scheduler.wake)
+            lease_keeper.start()
+            logger.info(f'Waiting for lease {lease.name} in {lease.path} as {lease.holder}.')
+
+        while True:
+            try:
+                await scheduler.wait()
+
+                if lease is not None and not lease.held:
+                    logger.debug('On standby, lease %s is held by another replica.', lease.name)
+                    continue
+
+                with profiler.cycle():
+                    await reconciler.reconcile()
+
+                scheduler.set_deadline('renewal', reconciler.next_renewal)
+                scheduler.set_deadline('grace_period', reconciler.next_grace_expiry)
+
+            except FailedToLogin as exc:
+                # An attempt to re-login has failed. Something may have changed server-side.
+                logger.error("An attempt to re login to NPM has failed, did the users credentials change?")
+                logger.debug(f"{exc}")
+                raise exc
+
+            except GenericNPMError as exc:
+                # NPM is unreachable or struggling. Retries have already backed off, try again on the next cycle.
+                logger.error(f"Reconcile cycle failed communicating with NPM: {exc}")
+    finally:
+        shutdown(step_client, npm_clients, pool, stores, lease_keeper, metrics_server)
@@ -15,6 +15,7 @@ npm.add_argument('-np', '--npm-port', type=int)
 npm.add_argument('-nu', '--npm-user', type=str)
 npm.add_argument('-npw', '--npm-pass', type=str)
 npm.add_argument('-ngp', '--npm-proxy-host-grace-period', type=int)
+npm.add_argument('-nps', '--npm-pool-size', type=int)
 
 
 step = parser.add_argument_group('Smallstep CA')
@@ -23,7 +24,48 @@ step.add_argument('-sd', '--step-ca-domain', type=str)
 step.add_argument('-sp', '--step-ca-port', type=int)
 step.add_argument('-sf', '--step-ca-fingerprint', type=str)
 step.add_argument('-spw', '--step-ca-provisioner-pass', type=str)
+step.add_argument('-spn', '--step-ca-provisioner', type=str)
+step.add_argument('-si', '--step-issuer', type=str, choices=('cli', 'native'))
+step.add_argument(
+    '-skt', '--step-key-type', type=str, choices=('EC-P256', 'EC-P384', 'RSA-2048', 'RSA-3072', 'RSA-4096', 'ED25519')
+)
+step.add_argument('-skp', '--step-key-pool-size', type=int)
+step.add_argument('-skl', '--step-key-pool-low', type=int)
+step.add_argument('-sw', '--step-workers', type=int)
+step.add_argument('-st', '--step-timeout', type=int)
+step.add_argument('-sc', '--step-cache-size', type=int)
+step.add_argument('-shi', '--step-health-interval', type=int)
+step.add_argument('-shb', '--step-health-max-backoff', type=int)
+step.add_argument('-srm', '--step-renew-mode', type=str, choices=('off', 'rekey', 'reuse-key'))
 
 plugin = parser.add_argument_group('Plugin Config')
 plugin.add_argument('--schedule', type=str)
 plugin.add_argument('--log-level', type=str, choices=('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'))
+plugin.add_argument('--log-format', type=str, choices=('text', 'json'))
+plugin.add_argument('--log-queue-size', type=int)
+plugin.add_argument('--state-file', type=str)
+plugin.add_argument('--metrics-host', type=str)
+plugin.add_argument('--metrics-port', type=int)
+plugin.add_argument('--lease-file', type=str)
+plugin.add_argument('--lease-ttl', type=int)
+plugin.add_argument('--replica-id', type=str)
+plugin.add_argument('--shard-count', type=int)
+plugin.add_argument('--shard-index', type=int)
+
+consolidate = parser.add_argument_group('Certificate Consolidation')
+consolidate.add_argument('--consolidate', type=str, choices=('none', 'domain', 'groups'))
+consolidate.add_argument('--consolidate-groups', type=str)
+consolidate.add_argument('--consolidate-wildcard', type=int, choices=(0, 1))
+consolidate.add_argument('--consolidate-max-names', type=int)
+
+renewal = parser.add_argument_group('Certificate Renewal')
+renewal.add_argument('--renewal-fraction', type=float)
+renewal.add_argument('--renewal-window', type=int)
+renewal.add_argument('--renewal-rate-limit', type=int)
+
+profiling = parser.add_argument_group('Profiling')
+profiling.add_argument('--profile', type=int)
+profiling.add_argument('--profile-dir', type=str)
+profiling.add_argument('--profile-keep', type=int)
+profiling.add_argument('--profile-top', type=int)
+profiling.add_argument('--profile-tracemalloc', type=int, choices=(0, 1))
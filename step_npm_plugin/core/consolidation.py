@@ -0,0 +1,138 @@
+import collections
+import fnmatch
+import logging
+
+from step_npm_plugin.npm import ProxyHost, Certificate, normalise_domain, wildcard_for, registrable_domain
+
+from . import settings
+
+
+logger = logging.getLogger('console')
+
+# NPM nice name prefix of certificates shared by a consolidation group, followed by the group.
+GROUP_NICE_NAME_PREFIX = 'step-npm-group:'
+
+CONSOLIDATE_MODES = ('none', 'domain', 'groups')
+
+
+def parse_groups(value: str or None) -> list:
+    """
+    Parses explicit consolidation groups, e.g. `media=plex.example.com,*.media.example.com;lab=*.lab.example.net`.
+
+    :param str value: Groups separated by `;`, each a name and a comma separated list of domain patterns.
+    :return: List of (name, patterns) in the order given.
+    """
+    groups = []
+
+    for group in (value or '').split(';'):
+        if not group.strip():
+            continue
+
+        name, separator, patterns = group.partition('=')
+        patterns = [normalise_domain(pattern) for pattern in patterns.split(',') if pattern.strip()]
+
+        if not separator or not name.strip() or not patterns:
+            raise ValueError(f'Invalid consolidation group "{group}", expected name=pattern[,pattern...].')
+
+        groups.append((name.strip(), patterns))
+
+    return groups
+
+
+class Consolidator:
+    """
+    Decides which HTTP only hosts share a certificate.
+
+    In `domain` mode, hosts are grouped by their registrable domain. In `groups` mode, only hosts whose primary domain
+    matches one of the explicit `groups` are grouped. Explicit groups take precedence in `domain` mode too. Hosts that
+    are not in a group get a certificate of their own, as without consolidation.
+
+    Each group has one certificate in NPM, found by its nice name. New hosts in a group are added to it by reissuing
+    the certificate with the extra SANs. With `wildcard`, names that share a parent under the registrable domain are
+    covered by a single wildcard, so further hosts under that parent need no reissue at all.
+    """
+    mode: str = 'none'
+    groups: list = None
+    wildcard: bool = False
+    max_names: int = 100
+
+    def __init__(self, mode: str = 'none', groups: list = None, wildcard: bool = False, max_names: int = 100):
+        if mode not in CONSOLIDATE_MODES:
+            raise ValueError(f'Unknown consolidation mode {mode}, expected one of {", ".join(CONSOLIDATE_MODES)}.')
+
+        self.mode = mode
+        self.groups = groups or []
+        self.wildcard = wildcard
+        self.max_names = max_names
+
+    @classmethod
+    def from_config(cls, config: settings.AppConfig):
+        return cls(
+            config.CONSOLIDATE, parse_groups(config.CONSOLIDATE_GROUPS), config.CONSOLIDATE_WILDCARD > 0,
+            config.CONSOLIDATE_MAX_NAMES
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != 'none'
+
+    @staticmethod
+    def nice_name(group: str) -> str:
+        return f'{GROUP_NICE_NAME_PREFIX}{group}'
+
+    @staticmethod
+    def is_group_certificate(cert: Certificate) -> bool:
+        return bool(cert.nice_name) and cert.nice_name.startswith(GROUP_NICE_NAME_PREFIX)
+
+    def group_of_certificate(self, cert: Certificate) -> str or None:
+        return cert.nice_name.removeprefix(GROUP_NICE_NAME_PREFIX) if self.is_group_certificate(cert) else None
+
+    def group_of(self, host: ProxyHost) -> str or None:
+        """
+        The group a host belongs to, or None if it gets a certificate of its own.
+        """
+        if not self.enabled or not host.primary_domain:
+            return None
+
+        domain = normalise_domain(host.primary_domain)
+
+        for name, patterns in self.groups:
+            if any(fnmatch.fnmatchcase(domain, pattern) for pattern in patterns):
+                return name
+
+        if self.mode == 'domain':
+            return registrable_domain(domain)
+
+        return None
+
+    def _wildcard_allowed(self, domain: str) -> bool:
+        wildcard = wildcard_for(domain)
+        registrable = registrable_domain(domain)
+
+        if wildcard is None or registrable is None:
+            return False
+
+        # Never wildcard a public suffix, e.g. *.co.uk.
+        parent = wildcard[2:]
+        return parent == registrable or parent.endswith('.' + registrable)
+
+    def names(self, domains) -> list:
+        """
+        The names a group certificate covering `domains` is issued for, wildcards first and then sorted.
+
+        Wildcards already in `domains` are kept. With `wildcard`, two or more names under the same parent are
+        replaced by a wildcard for that parent.
+        """
+        domains = sorted({normalise_domain(domain) for domain in domains if domain})
+        wildcards = {domain for domain in domains if domain.startswith('*.')}
+
+        if self.wildcard:
+            siblings = collections.Counter(
+                wildcard_for(domain) for domain in domains
+                if not domain.startswith('*.') and self._wildcard_allowed(domain)
+            )
+            wildcards.update(wildcard for wildcard, count in siblings.items() if count > 1)
+
+        return sorted(wildcards) + [
+            domain for domain in domains if domain not in wildcards and wildcard_for(domain) not in wildcards
+        ]
@@ -0,0 +1,189 @@
+import asyncio
+import hashlib
+import logging
+import os
+import pathlib
+import socket
+import sqlite3
+import threading
+import time
+
+from step_npm_plugin.npm import normalise_domain
+
+from . import settings
+
+
+logger = logging.getLogger('console')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lease (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+"""
+
+
+def default_replica_id() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+class Lease:
+    """
+    A named lease in an SQLite file, held by at most one replica at a time.
+
+    Replicas that share the file, on a shared volume, take turns at the lease. Whoever holds it keeps it by renewing
+    it before `ttl` seconds pass, otherwise any other replica may take it over. Expiry is wall clock time, so the
+    clocks of the replicas should be in sync to well within `ttl`.
+    """
+    path: pathlib.Path = None
+    name: str = None
+    holder: str = None
+    ttl: float = 30
+
+    _expires: float = 0
+    _connection: sqlite3.Connection = None
+    _lock: threading.Lock = None
+
+    def __init__(self, path: pathlib.Path, name: str, holder: str, ttl: float = 30):
+        self.path = path
+        self.name = name
+        self.holder = holder
+        self.ttl = ttl
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path.__str__(), check_same_thread=False, isolation_level=None, timeout=ttl / 3
+        )
+        self._connection.executescript(SCHEMA)
+
+    @property
+    def held(self) -> bool:
+        """
+        Whether this replica holds the lease, as of its last renewal.
+        """
+        return time.time() < self._expires
+
+    def acquire(self) -> bool:
+        """
+        Takes the lease if it is free or expired, or renews it if already held.
+
+        :return: Whether this replica holds the lease.
+        """
+        now = time.time()
+
+        with self._lock:
+            try:
+                # IMMEDIATE takes the write lock up front, so two replicas cannot both see the lease as free.
+                self._connection.execute('BEGIN IMMEDIATE')
+            except sqlite3.OperationalError as exc:
+                logger.warning(f'Unable to lock lease file {self.path}: {exc}')
+                self._expires = 0
+                return False
+
+            try:
+                row = self._connection.execute(
+                    'SELECT holder, expires FROM lease WHERE name = ?', (self.name,)
+                ).fetchone()
+
+                if row is None or row[0] == self.holder or row[1] <= now:
+                    self._connection.execute(
+                        'INSERT OR REPLACE INTO lease (name, holder, expires) VALUES (?, ?, ?)',
+                        (self.name, self.holder, now + self.ttl)
+                    )
+                    self._expires = now + self.ttl
+                else:
+                    self._expires = 0
+            except Exception:
+                self._connection.execute('ROLLBACK')
+                raise
+
+            self._connection.execute('COMMIT')
+
+        return self.held
+
+    def release(self) -> None:
+        with self._lock:
+            self._connection.execute('DELETE FROM lease WHERE name = ? AND holder = ?', (self.name, self.holder))
+            self._expires = 0
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+class LeaseKeeper:
+    """
+    Keeps a `Lease` renewed in the background, several times per `ttl`.
+
+    Standby replicas try to take the lease on the same interval, and `on_acquired` is called as soon as one does, so
+    it can start work straight away rather than on its next scheduled run.
+    """
+    lease: Lease = None
+    on_acquired = None
+
+    _task: asyncio.Task = None
+
+    def __init__(self, lease: Lease, on_acquired=None):
+        self.lease = lease
+        self.on_acquired = on_acquired
+
+    async def _keep(self) -> None:
+        while True:
+            was_held = self.lease.held
+
+            try:
+                held = await asyncio.to_thread(self.lease.acquire)
+            except sqlite3.Error as exc:
+                logger.error(f'Unable to renew lease {self.lease.name} in {self.lease.path}: {exc}')
+                held = self.lease.held
+
+            if held and not was_held:
+                logger.info(f'Took lease {self.lease.name} as {self.lease.holder}, this replica is now active.')
+                if self.on_acquired is not None:
+                    self.on_acquired()
+            elif was_held and not held:
+                logger.warning(f'Lost lease {self.lease.name}, this replica is now on standby.')
+
+            await asyncio.sleep(self.lease.ttl / 3)
+
+    def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._keep())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        self.lease.release()
+
+
+class Shard:
+    """
+    The share of proxy hosts and certificates this replica looks after, by a stable hash of the domain.
+
+    Every replica must use the same `count`, each with its own `index`. Hashing the normalised domain with SHA-256
+    keeps the split the same across restarts and Python versions.
+    """
+    index: int = 0
+    count: int = 1
+
+    def __init__(self, index: int = 0, count: int = 1):
+        if count < 1 or not 0 <= index < count:
+            raise ValueError(f'Invalid shard {index} of {count}, SHARD_INDEX must be from 0 to SHARD_COUNT - 1.')
+
+        self.index = index
+        self.count = count
+
+    @classmethod
+    def from_config(cls, config: settings.AppConfig):
+        return cls(config.SHARD_INDEX, config.SHARD_COUNT)
+
+    @property
+    def name(self) -> str:
+        return f'shard-{self.index}-of-{self.count}'
+
+    def owns(self, key: str or None) -> bool:
+        if self.count == 1:
+            return True
+
+        digest = hashlib.sha256((normalise_domain(key) or '').encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], 'big') % self.count == self.index
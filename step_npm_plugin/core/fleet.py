@@ -0,0 +1,131 @@
+import asyncio
+import datetime
+import logging
+import time
+
+from step_npm_plugin.metrics import RECONCILE_PHASE_SECONDS, RECONCILE_CYCLES
+from step_npm_plugin.npm import FailedToLogin, GenericNPMError
+from step_npm_plugin.step import IssuancePool, IssuanceResult
+
+from .reconciler import Reconciler, record_expiry
+
+
+logger = logging.getLogger('console')
+
+# Outcome of a call to an NPM instance that failed.
+FAILED = object()
+
+
+class Fleet:
+    """
+    Reconciles several NPM instances against one CA.
+
+    Each instance has a `Reconciler` of its own, and they all plan concurrently. The certificates they need are then
+    issued on one shared `IssuancePool`. Jobs that ask for the same certificate, by `IssuanceJob.key`, are issued once,
+    and the certificate is uploaded to every instance that asked for it.
+
+    An instance that cannot be reached is logged and left for the next cycle, the others carry on without it. A failed
+    login is still fatal, as with a single instance.
+    """
+    reconcilers: list = None
+    issuance_pool: IssuancePool = None
+    timings: dict = None
+
+    def __init__(self, reconcilers: list, issuance_pool: IssuancePool):
+        self.reconcilers = reconcilers
+        self.issuance_pool = issuance_pool
+        self.timings = {}
+
+    @property
+    def next_renewal(self) -> datetime.datetime or None:
+        return min((r.next_renewal for r in self.reconcilers if r.next_renewal is not None), default=None)
+
+    @property
+    def next_grace_expiry(self) -> datetime.datetime or None:
+        return min((r.next_grace_expiry for r in self.reconcilers if r.next_grace_expiry is not None), default=None)
+
+    def restore(self) -> None:
+        for reconciler in self.reconcilers:
+            reconciler.restore()
+
+    @staticmethod
+    async def _guard(reconciler: Reconciler, coroutine):
+        """
+        Awaits a call to one NPM instance, returning `FAILED` rather than raising if the instance could not be reached.
+        """
+        try:
+            return await coroutine
+        except FailedToLogin:
+            raise
+        except GenericNPMError as exc:
+            logger.error(f'Reconcile of NPM {reconciler.npm_client.uri} failed, skipping it this cycle: {exc}')
+            return FAILED
+
+    async def reconcile(self) -> None:
+        """
+        Runs a single reconcile cycle against every NPM instance.
+        """
+        started = time.perf_counter()
+
+        try:
+            ok = await self._reconcile()
+        except Exception:
+            RECONCILE_CYCLES.labels('failure').inc()
+            raise
+        finally:
+            self.timings['total'] = time.perf_counter() - started
+            RECONCILE_PHASE_SECONDS.labels('total').observe(self.timings['total'])
+
+        RECONCILE_CYCLES.labels('success' if ok else 'failure').inc()
+
+        counts = {}
+        for reconciler in self.reconcilers:
+            for label, count in reconciler.expiry_counts().items():
+                counts[label] = counts.get(label, 0) + count
+        record_expiry(counts)
+
+    async def _reconcile(self) -> bool:
+        self.timings = {}
+
+        plans = await asyncio.gather(*(self._guard(reconciler, reconciler.plan()) for reconciler in self.reconcilers))
+        planned = [(reconciler, *plan) for reconciler, plan in zip(self.reconcilers, plans) if plan is not FAILED]
+
+        # Every job that asked for a certificate, by the certificate asked for. Jobs of the same instance asking for the
+        # same certificate, such as renewals of two certificates for the same names, each get it as well.
+        requests = {}
+        for reconciler, mapper, jobs in planned:
+            for job in jobs:
+                requests.setdefault(job.key, []).append((reconciler, mapper, job))
+
+        started = time.perf_counter()
+        uploads = []
+
+        if requests:
+            logger.info(
+                f'Issuing {len(requests)} certificate(s) for {len(planned)} NPM instance(s) with up to'
+                f' {self.issuance_pool.max_workers} workers.'
+            )
+            issued = [
+                asyncio.wrap_future(future)
+                for future in self.issuance_pool.submit([wanted[0][2] for wanted in requests.values()])
+            ]
+
+            for future in asyncio.as_completed(issued):
+                result = await future
+
+                for reconciler, mapper, job in requests[result.job.key]:
+                    upload = reconciler.accept(
+                        IssuanceResult(job, result.certificate, result.error, result.duration), mapper
+                    )
+                    if upload is not None:
+                        uploads.append(asyncio.create_task(self._guard(reconciler, upload)))
+
+        uploaded = await asyncio.gather(*uploads)
+        self.timings['issue'] = time.perf_counter() - started
+        RECONCILE_PHASE_SECONDS.labels('issue').observe(self.timings['issue'])
+
+        applied = await asyncio.gather(*(
+            self._guard(reconciler, reconciler.apply(mapper)) for reconciler, mapper, _ in planned
+        ))
+
+        return len(planned) == len(self.reconcilers) and FAILED not in uploaded and FAILED not in applied
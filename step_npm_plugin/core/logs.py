@@ -0,0 +1,129 @@
+import atexit
+import copy
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+from step_npm_plugin.metrics import LOG_RECORDS_DROPPED
+
+from . import settings
+
+
+TEXT_FORMAT = '%(asctime)s [%(levelname)s %(filename)s:%(lineno)d] %(funcName)s(): %(message)s'
+LOG_FORMATS = ('text', 'json')
+
+_listener: logging.handlers.QueueListener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats each record as a single line JSON object, for log collectors that parse structured logs.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'file': record.filename,
+            'line': record.lineno,
+            'function': record.funcName,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that drops records rather than block once the queue is full, counting them in
+    `step_npm_log_records_dropped_total`.
+    """
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only the arguments are merged into the message here, as they may change once the record is queued. The rest
+        # of the formatting is left to the listener thread. The traceback is rendered now, while it is still around.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+
+def configure_logging(config: settings.AppConfig) -> None:
+    """
+    Sets up the `console` logger.
+
+    With a `LOG_QUEUE_SIZE`, records are put on a bounded queue and written to stdout by a listener thread, so a slow
+    stdout never holds up the reconcile loop. Records that do not fit on a full queue are dropped. Without one, records
+    are written to stdout as they are logged.
+    """
+    global _listener
+
+    if config.LOG_FORMAT not in LOG_FORMATS:
+        raise ValueError(f'Unknown log format {config.LOG_FORMAT}, expected one of {", ".join(LOG_FORMATS)}.')
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter() if config.LOG_FORMAT == 'json' else logging.Formatter(TEXT_FORMAT))
+    stream.setLevel(config.LOG_LEVEL)
+
+    handler = stream
+    if config.LOG_QUEUE_SIZE > 0:
+        records = queue.Queue(config.LOG_QUEUE_SIZE)
+        handler = DroppingQueueHandler(records)
+        handler.setLevel(config.LOG_LEVEL)
+
+        _listener = logging.handlers.QueueListener(records, stream, respect_handler_level=True)
+        _listener.start()
+
+    # Same as before: the root logger only passes on warnings, and the `console` logger is the plugin's own.
+    for name, level in (('', 'WARNING'), ('console', config.LOG_LEVEL)):
+        target = logging.getLogger(name)
+
+        for existing in list(target.handlers):
+            target.removeHandler(existing)
+
+        target.addHandler(handler)
+        target.setLevel(level)
+        target.propagate = False
+
+    for name, existing in logging.root.manager.loggerDict.items():
+        if isinstance(existing, logging.Logger) and name != 'console':
+            existing.disabled = True
+
+
+def stop_logging() -> None:
+    """
+    Writes out any records still queued and stops the listener thread.
+    """
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,138 @@
+import contextlib
+import cProfile
+import datetime
+import io
+import logging
+import pathlib
+import pstats
+import tracemalloc
+
+from . import settings
+
+
+logger = logging.getLogger('console')
+
+# Number of frames kept per traced allocation. More frames give better tracebacks at a higher cost per allocation.
+TRACEMALLOC_FRAMES = 10
+
+
+class CycleProfiler:
+    """
+    Profiles one in every `every` reconcile cycles with cProfile, and optionally traces their allocations.
+
+    Each sampled cycle writes a `.prof` file, and with `trace_memory` a tracemalloc `.snapshot` of the allocations it
+    left behind, to `directory`. Only the files of the last `keep` sampled cycles are kept. A summary of the `top`
+    functions by cumulative time, and the `top` lines by allocated memory, is logged after each sampled cycle.
+
+    cProfile only sees the thread it runs on, the event loop. Time spent in worker threads, on NPM requests and step
+    subprocesses, shows up as time the loop waited for them. The `.prof` files can be opened with `pstats` or
+    snakeviz, and the snapshots with `tracemalloc.Snapshot.load`.
+
+    Cycles that are not sampled run without any profiling overhead.
+    """
+    every: int = 0
+    directory: pathlib.Path = None
+    keep: int = 10
+    top: int = 15
+    trace_memory: bool = False
+
+    _cycles: int = 0
+
+    def __init__(
+            self, every: int = 0, directory: pathlib.Path = None, keep: int = 10, top: int = 15,
+            trace_memory: bool = False
+    ):
+        self.every = every
+        self.directory = directory
+        self.keep = max(keep, 1)
+        self.top = top
+        self.trace_memory = trace_memory
+        self._cycles = 0
+
+    @classmethod
+    def from_config(cls, config: settings.AppConfig):
+        return cls(
+            config.PROFILE, pathlib.Path(config.PROFILE_DIR), config.PROFILE_KEEP, config.PROFILE_TOP,
+            config.PROFILE_TRACEMALLOC > 0
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.every > 0
+
+    def cycle(self):
+        """
+        Context manager around a reconcile cycle, that profiles it if it is one of the sampled cycles.
+        """
+        self._cycles += 1
+
+        if not self.enabled or (self._cycles - 1) % self.every:
+            return contextlib.nullcontext()
+
+        return self._profile(self._cycles)
+
+    @contextlib.contextmanager
+    def _profile(self, cycle: int):
+        tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+
+        profile = cProfile.Profile()
+        profile.enable()
+
+        try:
+            yield
+        finally:
+            profile.disable()
+
+            snapshot = None
+            peak = 0
+            if tracing:
+                snapshot = tracemalloc.take_snapshot()
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+            self._save(cycle, profile, snapshot)
+            self._summarise(cycle, profile, snapshot, peak)
+
+    def _save(self, cycle: int, profile: cProfile.Profile, snapshot: tracemalloc.Snapshot or None) -> None:
+        stem = f'{datetime.datetime.now().strftime("%Y%m%d-%H%M%S")}-cycle-{cycle:06d}'
+
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+            profile.dump_stats(self.directory / f'{stem}.prof')
+            if snapshot is not None:
+                snapshot.dump((self.directory / f'{stem}.snapshot').__str__())
+
+            self._rotate()
+        except OSError as exc:
+            logger.warning(f'Unable to write the profile of cycle {cycle} to {self.directory.absolute()}: {exc}')
+            return
+
+        logger.info(f'Profile of cycle {cycle} written to {(self.directory / stem).absolute()}.prof.')
+
+    def _rotate(self) -> None:
+        # File names start with the time, so the oldest sort first, across restarts too.
+        for pattern in ('*-cycle-*.prof', '*-cycle-*.snapshot'):
+            for path in sorted(self.directory.glob(pattern))[:-self.keep or None]:
+                path.unlink(missing_ok=True)
+
+    def _summarise(
+            self, cycle: int, profile: cProfile.Profile, snapshot: tracemalloc.Snapshot or None, peak: int
+    ) -> None:
+        output = io.StringIO()
+        stats = pstats.Stats(profile, stream=output)
+        stats.strip_dirs().sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+
+        logger.info(f'Top {self.top} functions of cycle {cycle} by cumulative time:\n{output.getvalue().strip()}')
+
+        if snapshot is not None:
+            lines = '\n'.join(
+                f'  {stat.size / 1024:10.1f} KiB {stat.count:8d} blocks  {stat.traceback[0]}'
+                for stat in snapshot.statistics('lineno')[:self.top]
+            )
+            logger.info(
+                f'Top {self.top} lines of cycle {cycle} by memory still allocated, peak traced {peak / 1024:.1f} KiB:'
+                f'\n{lines}'
+            )
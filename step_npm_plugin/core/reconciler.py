@@ -0,0 +1,701 @@
+import asyncio
+import contextlib
+import datetime
+import logging
+import time
+
+from step_npm_plugin.metrics import (
+    RECONCILE_PHASE_SECONDS, RECONCILE_CYCLES, CERTIFICATES_BY_EXPIRY, HOST_HTTPS_SECONDS, EXPIRY_BUCKETS, expiry_bucket
+)
+from step_npm_plugin.npm import (
+    AsyncNginxProxyManagerClient, ChangeTracker, CertificateIndex, HostIndex, RecordCache, ProxyHost, Certificate,
+    parse_http_hosts, parse_certificates
+)
+from step_npm_plugin.step import StepClient, StepCertificate, IssuancePool, IssuanceJob, IssuanceResult, CAUnavailable
+from step_npm_plugin.schedule import RenewalQueue, RenewalPolicy
+
+from . import settings
+from .consolidation import Consolidator
+from .coordination import Shard
+from .store import StateStore
+
+
+logger = logging.getLogger('console')
+
+# Renewals that failed to issue are tried again after this long.
+RENEWAL_RETRY_DELAY = datetime.timedelta(minutes=1)
+# Plans older than this many seconds by the time they are applied are checked against a fresh proxy host listing.
+PLAN_MAX_AGE = 5
+# Largest difference between the expiry NPM reports and that of a certificate held in memory, for them to be the same.
+EXPIRY_TOLERANCE = datetime.timedelta(seconds=1)
+
+
+def record_expiry(counts: dict) -> None:
+    for label, count in counts.items():
+        CERTIFICATES_BY_EXPIRY.labels(label).set(count)
+
+
+class Reconciler:
+    """
+    Reconciles NPM proxy hosts with certificates issued by Smallstep CA.
+
+    The reconciler remembers what it saw in NPM on previous cycles. Only new or changed hosts and certificates are
+    parsed again, Phase 1 only looks at hosts that are still HTTP only, and Phase 2 only pops the certificates that
+    are due off a `RenewalQueue`. A cycle where nothing changed does close to no work beyond fetching the two
+    listings.
+
+    Hosts and certificates are matched through a `CertificateIndex` and a `HostIndex`, so matching is a lookup per
+    host rather than a scan of the other list.
+
+    Certificates needed by Phase 1 and Phase 2 are issued together on an `IssuancePool` and uploaded as they finish.
+    Calls to NPM that do not depend on each other are made concurrently through an `AsyncNginxProxyManagerClient`.
+
+    With consolidation enabled, Phase 1 issues one certificate per group of new hosts through a `Consolidator`
+    rather than one per host.
+
+    With more than one `Shard`, only the hosts and certificates of this replica's shard are looked after. Hosts of a
+    consolidation group are sharded by the group, so the group's certificate is only ever issued by one replica.
+
+    With a `StateStore`, the observed NPM state and renewal deadlines are saved as they change, and `restore()` picks
+    them back up after a restart without waiting on NPM.
+
+    Certificates issued by this process are held in memory, with their keys, for as long as they are in NPM. Phase 2
+    hands them to the `IssuancePool` to be renewed with, rather than issued anew. Keys are never written to the
+    `StateStore`, so after a restart each certificate's first renewal is a full issuance.
+
+    `reconcile()` runs a whole cycle. A `Fleet` of reconcilers instead calls `plan()`, `accept()` and `apply()` itself,
+    so that a certificate several NPM instances need is only issued once.
+
+    The wall time of each phase of the last cycle is kept in `timings`, in seconds.
+    """
+    config: settings.AppConfig = None
+    step_client: StepClient = None
+    npm_client: AsyncNginxProxyManagerClient = None
+    issuance_pool: IssuancePool = None
+    consolidator: Consolidator = None
+    shard: Shard = None
+    renewal_policy: RenewalPolicy = None
+    store: StateStore = None
+
+    hosts: dict = None
+    cert_index: CertificateIndex = None
+    host_index: HostIndex = None
+    timings: dict = None
+
+    _host_tracker: ChangeTracker = None
+    _cert_tracker: ChangeTracker = None
+    _host_records: RecordCache = None
+    _cert_records: RecordCache = None
+    _pending_hosts: set = None
+    _renewal_queue: RenewalQueue = None
+    _parked_renewals: set = None
+    _planned_at: float = 0
+    _issued: dict = None
+
+    def __init__(
+            self, config: settings.AppConfig, step_client: StepClient, npm_client: AsyncNginxProxyManagerClient,
+            store: StateStore = None, issuance_pool: IssuancePool = None
+    ):
+        self.config = config
+        self.step_client = step_client
+        self.npm_client = npm_client
+        self.store = store
+        self.issuance_pool = issuance_pool or IssuancePool(
+            step_client, config.STEP_WORKERS, config.STEP_TIMEOUT, renew_mode=config.STEP_RENEW_MODE
+        )
+        self.consolidator = Consolidator.from_config(config)
+        self.shard = Shard.from_config(config)
+        self.renewal_policy = RenewalPolicy(
+            config.RENEWAL_FRACTION, datetime.timedelta(seconds=config.RENEWAL_WINDOW), config.RENEWAL_RATE_LIMIT
+        )
+
+        self.hosts = {}
+        self.cert_index = CertificateIndex()
+        self.host_index = HostIndex()
+        self.timings = {}
+
+        self._host_tracker = ChangeTracker('modified_on', 'certificate_id')
+        self._cert_tracker = ChangeTracker('modified_on', 'expires_on')
+        self._host_records = RecordCache('certificate_id')
+        self._cert_records = RecordCache('expires_on')
+        self._pending_hosts = set()
+        self._renewal_queue = RenewalQueue()
+        self._parked_renewals = set()
+        self._issued = {}
+
+    @property
+    def next_renewal(self) -> datetime.datetime or None:
+        """
+        When the next certificate falls due for renewal, as an aware UTC datetime.
+        """
+        return self._renewal_queue.peek()
+
+    @property
+    def next_grace_expiry(self) -> datetime.datetime or None:
+        """
+        When the grace period of the next new HTTP only host runs out.
+        """
+        grace_delta = datetime.timedelta(seconds=self.config.NPM_PROXY_HOST_GRACE_PERIOD)
+        now = datetime.datetime.now(datetime.timezone.utc)
+
+        return min((
+            self.hosts[host_id].created_on + grace_delta for host_id in self._pending_hosts
+            if self.hosts[host_id].created_on and self.hosts[host_id].created_on + grace_delta > now
+        ), default=None)
+
+    def restore(self) -> None:
+        """
+        Loads the state saved by a previous run, so the first cycle only has to deal with what changed since.
+        """
+        if self.store is None:
+            return
+
+        proxy_hosts = self.store.load_entries('proxy_host')
+        certificates = self.store.load_entries('certificate')
+
+        if not proxy_hosts and not certificates:
+            return
+
+        self._observe(proxy_hosts, certificates, save=False)
+
+        for cert_id, deadline in self.store.load_renewals().items():
+            if cert_id in self.cert_index:
+                self._renewal_queue.push(cert_id, deadline)
+
+        logger.info(
+            f'Restored state of {len(self.hosts)} proxy hosts and {len(self.cert_index)} certificates from'
+            f' {self.store.path.absolute()}.'
+        )
+
+    def _observe(self, proxy_hosts: list, certificates: list, save: bool = True) -> None:
+        host_changes = self._host_tracker.diff(proxy_hosts)
+        cert_changes = self._cert_tracker.diff(certificates)
+
+        if host_changes.has_changes:
+            logger.debug('Proxy host changes since last cycle: %s', host_changes)
+            self._update_hosts(host_changes)
+
+        if cert_changes.has_changes:
+            logger.debug('Certificate changes since last cycle: %s', cert_changes)
+            self._update_certs(cert_changes)
+
+        if save and self.store is not None:
+            self.store.save_changes('proxy_host', host_changes)
+            self.store.save_changes('certificate', cert_changes, renewals={
+                **{cert_id: None for cert_id in cert_changes.removed},
+                **{entry['id']: self._renewal_queue.deadline(entry['id']) for entry in cert_changes.updated},
+            })
+
+    @contextlib.contextmanager
+    def _timed(self, phase: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[phase] = time.perf_counter() - started
+            RECONCILE_PHASE_SECONDS.labels(phase).observe(self.timings[phase])
+
+    async def reconcile(self) -> None:
+        """
+        Runs a single reconcile cycle against NPM.
+        """
+        started = time.perf_counter()
+
+        try:
+            mapper, jobs = await self.plan()
+            errors = []
+
+            with self._timed('issue'):
+                if jobs:
+                    errors = await self._issue_certificates(jobs, mapper)
+
+            # Certificates that were uploaded are applied even if others failed to upload.
+            await self.apply(mapper)
+
+            if errors:
+                raise errors[0]
+        except Exception:
+            RECONCILE_CYCLES.labels('failure').inc()
+            raise
+        finally:
+            self.timings['total'] = time.perf_counter() - started
+            RECONCILE_PHASE_SECONDS.labels('total').observe(self.timings['total'])
+
+        RECONCILE_CYCLES.labels('success').inc()
+        record_expiry(self.expiry_counts())
+
+    async def plan(self) -> tuple[list, list]:
+        """
+        Fetches the current state of NPM and works out what it needs, without changing anything yet.
+
+        :return: Mappings of hosts to certificates that already exist, and the `IssuanceJob` of each certificate that
+            needs issuing.
+        """
+        self.timings = {}
+        self._planned_at = time.monotonic()
+
+        with self._timed('fetch'):
+            proxy_hosts, certificates = await asyncio.gather(
+                self.npm_client.get_proxy_hosts(), self.npm_client.get_certificates()
+            )
+
+        with self._timed('parse'):
+            self._observe(proxy_hosts, certificates)
+
+        mapper = []
+        jobs = []
+
+        with self._timed('phase1'):
+            self._add_certificates(mapper, jobs)
+
+        with self._timed('phase2'):
+            self._renew_certificates(jobs)
+
+        return mapper, jobs
+
+    async def apply(self, mapper: list) -> None:
+        """
+        Points proxy hosts at their certificates, once every certificate they need has been uploaded, and then deletes
+        the certificates that were replaced. A replaced certificate is only deleted once every host using it has moved
+        on, so no host is ever left on a deleted certificate.
+
+        Hosts are not fetched one by one before they are updated. Each mapping carries the `modified_on` the host had
+        in the listing the plan was made from, and is only applied if the host still has it. That listing is trusted
+        for `PLAN_MAX_AGE` seconds; a plan that issuing took past it is checked against one fresh listing of every host.
+        A host changed in the short window between that check and its update is caught by the next cycle's diff.
+
+        A renewal that does not go through is queued again after `RENEWAL_RETRY_DELAY`, keeping the certificate it
+        replaces, and a certificate uploaded this cycle that no host ended up using is deleted again.
+        """
+        errors = []
+
+        with self._timed('apply'):
+            checked, stale = await self._recheck(mapper)
+            applied = []
+            kept = {mapping['replaces'] for mapping in stale}
+
+            for mapping in stale:
+                self._retry_renewal(mapping['replaces'])
+
+            for mapping, outcome in zip(checked, await self.npm_client.update_proxy_host_certificates(checked)):
+                if isinstance(outcome, Exception):
+                    logger.error(f'Failed to update proxy host {mapping["proxy_host"]}: {outcome}')
+                    errors.append(outcome)
+                    kept.add(mapping['replaces'])
+                    self._retry_renewal(mapping['replaces'])
+                else:
+                    applied.append(mapping)
+
+            replaced = [
+                cert_id for cert_id in dict.fromkeys(mapping['replaces'] for mapping in checked)
+                if cert_id is not None and cert_id not in kept
+            ]
+            used = {mapping['certificate'] for mapping in applied}
+            uploaded = dict.fromkeys(mapping['certificate'] for mapping in mapper if mapping['uploaded'])
+            unused = [cert_id for cert_id in uploaded if cert_id not in used]
+
+            for cert_id, outcome in zip(
+                    replaced + unused, await self.npm_client.delete_certificates(replaced + unused)
+            ):
+                if isinstance(outcome, Exception):
+                    kind = 'replaced' if cert_id in replaced else 'unused'
+                    logger.error(f'Failed to delete {kind} certificate {cert_id}: {outcome}')
+                    errors.append(outcome)
+                else:
+                    self._issued.pop(cert_id, None)
+
+        self._record_https_latency(applied)
+
+        if errors:
+            raise errors[0]
+
+    async def _recheck(self, mapper: list) -> tuple[list, list]:
+        """
+        Splits the mappings into those whose host still has the `modified_on` it was planned with, and those whose
+        host was changed or deleted since. The listing the plan was made from is used unless it is older than
+        `PLAN_MAX_AGE`, in which case the proxy hosts are listed once more.
+        """
+        if not mapper or time.monotonic() - self._planned_at < PLAN_MAX_AGE:
+            return mapper, []
+
+        current = {entry.get('id', None): entry for entry in await self.npm_client.get_proxy_hosts()}
+        checked = []
+        stale = []
+
+        for mapping in mapper:
+            entry = current.get(mapping['proxy_host'], None)
+
+            if entry is None:
+                logger.info(f'Proxy host {mapping["proxy_host"]} was deleted before its certificate was applied.')
+                stale.append(mapping)
+            elif entry.get('modified_on', None) != mapping['modified_on']:
+                logger.info(
+                    f'Proxy host {mapping["proxy_host"]} was changed while its certificate was being issued,'
+                    f' leaving it as is until it is planned again.'
+                )
+                stale.append(mapping)
+            else:
+                checked.append(mapping)
+
+        return checked, stale
+
+    def _retry_renewal(self, cert_id: int or None) -> None:
+        """
+        Queues a renewal that was taken off the queue but did not go through to be tried again later.
+        """
+        if cert_id is not None and cert_id in self.cert_index and cert_id not in self._renewal_queue:
+            self._renewal_queue.push(cert_id, datetime.datetime.now(datetime.timezone.utc) + RENEWAL_RETRY_DELAY)
+
+    def expiry_counts(self) -> dict:
+        """
+        Number of certificates in NPM by time left until expiry, keyed by the `expires_within` label.
+        """
+        counts = dict.fromkeys([label for _, label in EXPIRY_BUCKETS] + ['+Inf'], 0)
+        now = datetime.datetime.now(datetime.timezone.utc)
+
+        for cert in self.cert_index:
+            if cert.expires is None:
+                continue
+            counts[expiry_bucket((cert.expires - now).total_seconds() / 86400)] += 1
+
+        return counts
+
+    def _record_https_latency(self, mapper: list) -> None:
+        # Only Phase 1 mappings take a host from HTTP to HTTPS, renewals are forced on to hosts that already had one.
+        now = datetime.datetime.now(datetime.timezone.utc)
+
+        for mapping in mapper:
+            host = self.hosts.get(mapping['proxy_host'], None)
+
+            if not mapping['force'] and host is not None and host.created_on:
+                HOST_HTTPS_SECONDS.observe((now - host.created_on).total_seconds())
+
+    def _update_hosts(self, changes) -> None:
+        for host_id in changes.removed:
+            self.hosts.pop(host_id, None)
+            self._pending_hosts.discard(host_id)
+
+        self._host_records.forget(changes.removed)
+
+        for host in parse_http_hosts(changes.updated, self._host_records):
+            self.hosts[host.id] = host
+
+            if not host.is_https and self.shard.owns(self.consolidator.group_of(host) or host.primary_domain):
+                self._pending_hosts.add(host.id)
+            else:
+                self._pending_hosts.discard(host.id)
+
+        self.host_index = HostIndex(self.hosts.values())
+
+        # Hosts may have been added for due certificates that had none, so have another look at those.
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for cert_id in self._parked_renewals:
+            self._renewal_queue.push(cert_id, now)
+        self._parked_renewals.clear()
+
+    def _update_certs(self, changes) -> None:
+        for cert_id in changes.removed:
+            self.cert_index.remove(cert_id)
+            self._renewal_queue.remove(cert_id)
+            self._parked_renewals.discard(cert_id)
+            self._issued.pop(cert_id, None)
+
+        self._cert_records.forget(changes.removed)
+
+        for cert in parse_certificates(changes.updated, self._cert_records):
+            self.cert_index.add(cert)
+            self._parked_renewals.discard(cert.id)
+
+            if cert.expires is None or not self.shard.owns(
+                    self.consolidator.group_of_certificate(cert) or cert.primary_domain
+            ):
+                # Created but nothing uploaded yet, or renewed by another replica.
+                self._renewal_queue.remove(cert.id)
+                continue
+
+            self._renewal_queue.push(cert.id, self._renewal_deadline(cert))
+
+    def _renewal_deadline(self, cert: Certificate) -> datetime.datetime:
+        return self.renewal_policy.deadline(cert.issued, cert.expires)
+
+    def _add_certificates(self, mapper: list, jobs: list) -> None:
+        """
+        Phase 1 - Add new certificates to hosts that are HTTP only.
+        """
+        grace_delta = datetime.timedelta(seconds=self.config.NPM_PROXY_HOST_GRACE_PERIOD)
+        http_hosts = []
+
+        for host_id in self._pending_hosts:
+            host = self.hosts[host_id]
+
+            if host.created_on is None or not host.primary_domain:
+                # No certificate can be issued for a host without domain names.
+                continue
+
+            grace_expired = host.created_on + grace_delta < datetime.datetime.now(datetime.timezone.utc)
+
+            if grace_expired:
+                http_hosts.append(host)
+            else:
+                logger.warning(
+                    f"Host {host.primary_domain} is new and was created on {host.created_on.isoformat()}."
+                    f" Awaiting grace period of {self.config.NPM_PROXY_HOST_GRACE_PERIOD} seconds to allow for"
+                    f" LetsEncrypt certificates to apply, in case it was requested."
+                )
+
+        if len(http_hosts) == 0:
+            return
+
+        domains = [host.primary_domain for host in http_hosts]
+        logger.info(f'New hosts found that are currently HTTP Only: {", ".join(domains)}')
+
+        groups = {}
+
+        for host in http_hosts:
+            existing_cert = self.cert_index.find(host.primary_domain, *host.sans)
+
+            if existing_cert:
+                # Cert exists, use it.
+                logger.info(
+                    f'Existing certificate {existing_cert.primary_domain} already on NPM covers'
+                    f' {host.primary_domain}.'
+                )
+                mapper.append({
+                    'proxy_host': host.id,
+                    'certificate': existing_cert.id,
+                    'force': False,
+                    'modified_on': host.modified_on,
+                    'replaces': None,
+                    'uploaded': False,
+                })
+            elif self.consolidator.group_of(host) is not None:
+                groups.setdefault(self.consolidator.group_of(host), []).append(host)
+            else:
+                # No existing cert, create a new one...
+                logger.info(f'No existing cert for {host.primary_domain}, need to generate one.')
+                jobs.append(self._host_job(host))
+
+        for group, hosts in groups.items():
+            self._add_group_certificate(group, hosts, jobs)
+
+    @staticmethod
+    def _host_job(host: ProxyHost) -> IssuanceJob:
+        return IssuanceJob(host.primary_domain, *host.sans, context={'hosts': [host], 'replaces': None})
+
+    def _add_group_certificate(self, group: str, hosts: list, jobs: list) -> None:
+        """
+        Issues one certificate for the new hosts of a consolidation group.
+
+        If the group already has a certificate, it is reissued with the names of the new hosts added, and replaces
+        the old one on every host that used it. Names of hosts that no longer use it are dropped, making room for
+        the new hosts. Hosts that would take the certificate over `max_names` get a certificate of their own instead.
+        """
+        nice_name = self.consolidator.nice_name(group)
+        current = next(iter(self.cert_index.named(nice_name)), None)
+        current_hosts = self.host_index.using_certificate(current.id) if current is not None else []
+
+        # Taken from the hosts rather than the certificate, as NPM does not list every name of an uploaded one.
+        domains = [domain for host in current_hosts for domain in host.domains]
+        domains = self.consolidator.names(domains) if domains else []
+        members = []
+
+        for host in hosts:
+            names = self.consolidator.names([*domains, *host.domains])
+
+            if domains and len(names) > self.consolidator.max_names:
+                logger.info(f'Certificate of group {group} is full, {host.primary_domain} gets one of its own.')
+                jobs.append(self._host_job(host))
+                continue
+
+            members.append(host)
+            domains = names
+
+        if not members:
+            return
+
+        names = self.consolidator.names(domains)
+        # Keep the common name of the certificate being replaced, so it reads the same in NPM.
+        common_name = current.primary_domain if current is not None and current.primary_domain in names else names[0]
+
+        logger.info(
+            f'Issuing the certificate of group {group} for {", ".join(host.primary_domain for host in members)}'
+            f' ({len(names)} names).'
+        )
+        jobs.append(IssuanceJob(
+            common_name, *[name for name in names if name != common_name], context={
+                'hosts': members + current_hosts,
+                'replaces': current.id if current is not None else None,
+                'nice_name': nice_name,
+            }
+        ))
+
+    def _renew_certificates(self, jobs: list) -> None:
+        """
+        Phase 2 - Renew old ones.
+
+        Only certificates whose renewal deadline has passed are taken off the queue. Due certificates that cannot be
+        renewed (no matching host, or the host uses LetsEncrypt) are parked until the proxy hosts change, and
+        renewals that fail to issue are queued again after `RENEWAL_RETRY_DELAY`. Certificates that Phase 1 is
+        already reissuing for a consolidation group are renewed by that. Renewals over the rate limit of the
+        `RenewalPolicy` are queued again for when a slot frees up, unless the certificate is close to expiry.
+        """
+        replacing = {job.context['replaces'] for job in jobs}
+        now = datetime.datetime.now(datetime.timezone.utc)
+        deferred = 0
+
+        for cert_id in self._renewal_queue.pop_due(now):
+            cert = self.cert_index.get(cert_id)
+
+            if cert is None or cert_id in replacing:
+                continue
+
+            # Hosts that use the certificate get the renewed one. Hosts that match on primary domain are a fallback
+            # for certificates that are not attached to anything yet.
+            existing_hosts = (
+                self.host_index.using_certificate(cert.id) or self.host_index.by_domain(cert.primary_domain)
+            )
+            if not existing_hosts:
+                logger.debug('No matching host found for %s.', cert.primary_domain)
+                self._parked_renewals.add(cert.id)
+                continue
+            is_letsencrypt = any(self._certificate_provider(host) == 'letsencrypt' for host in existing_hosts)
+
+            if existing_hosts and not is_letsencrypt:
+                emergency = self.renewal_policy.is_emergency(cert.issued, cert.expires, now)
+                if not self.renewal_policy.admit(now, emergency):
+                    self._renewal_queue.push(cert.id, self.renewal_policy.next_slot(now))
+                    deferred += 1
+                    continue
+
+                logger.info(
+                    f'Certificate {cert.primary_domain} expires at'
+                    f' {cert.expires.strftime("%Y-%m-%d %H:%M:%S")}. Starting renewal.'
+                )
+
+                job = IssuanceJob(
+                    cert.primary_domain, *self._renewal_sans(cert, existing_hosts), context={
+                        'hosts': existing_hosts,
+                        'replaces': cert.id,
+                        'nice_name': cert.nice_name if self.consolidator.is_group_certificate(cert) else None,
+                    }, reuse=False
+                )
+                job.renews = self._renewable(cert, job)
+                jobs.append(job)
+            else:
+                logger.info('Cert not assigned to a host, or the host uses a letsencrypt certificate... skipping.')
+                self._parked_renewals.add(cert.id)
+
+        if deferred:
+            logger.info(
+                f'Deferred {deferred} renewal(s) past the limit of {self.renewal_policy.rate_limit} per minute.'
+            )
+
+    def _renewable(self, cert: Certificate, job: IssuanceJob) -> StepCertificate or None:
+        """
+        The certificate held in memory for `cert`, if the renewal `job` can renew it. A renewed certificate covers the
+        same names, so one whose hosts now need other names is issued anew, as is one replaced in NPM by someone else.
+        """
+        key, certificate = self._issued.get(cert.id, (None, None))
+
+        if certificate is None or key != job.key or cert.expires is None:
+            return None
+
+        if abs(certificate.not_after - cert.expires) > EXPIRY_TOLERANCE:
+            return None
+
+        return certificate
+
+    def _certificate_provider(self, host: ProxyHost) -> str or None:
+        """
+        Provider of the certificate a host uses, from the expanded listing or else the certificate index.
+        """
+        if host.certificate_provider is not None:
+            return host.certificate_provider
+
+        cert = self.cert_index.get(host.certificate_id)
+        return cert.provider if cert is not None else None
+
+    async def _issue_certificates(self, jobs: list, mapper: list) -> list:
+        """
+        Issues the certificates for Phase 1 and Phase 2 and uploads each one to NPM as soon as it is ready.
+
+        :return: Exceptions that uploads failed with.
+        """
+        logger.info(f'Issuing {len(jobs)} certificate(s) with up to {self.issuance_pool.max_workers} workers.')
+
+        uploads = []
+        issued = [asyncio.wrap_future(future) for future in self.issuance_pool.submit(jobs)]
+
+        for future in asyncio.as_completed(issued):
+            upload = self.accept(await future, mapper)
+
+            if upload is not None:
+                uploads.append(asyncio.create_task(upload))
+
+        return [outcome for outcome in await asyncio.gather(*uploads, return_exceptions=True) if outcome is not None]
+
+    def accept(self, result: IssuanceResult, mapper: list):
+        """
+        Takes the outcome of one of the jobs from `plan()`.
+
+        :param IssuanceResult result: Outcome of the job.
+        :param list mapper: Mappings from `plan()`, the hosts of the job are added once the certificate is uploaded.
+        :return: Coroutine uploading the certificate to NPM, or None if issuing it failed.
+        """
+        job = result.job
+
+        if isinstance(result.error, CAUnavailable):
+            # Logged once by `CAHealth` when the CA went down, rather than for every job.
+            logger.debug('Holding back the certificate for %s until Step CA is up.', job.common_name)
+        elif not result.ok:
+            logger.error(f'Failed to issue a certificate for {job.common_name}: {result.error}')
+
+        if not result.ok:
+            # Group certificates that were only being extended are still queued for their own renewal.
+            self._retry_renewal(job.context['replaces'])
+            return None
+
+        logger.debug('Certificate for %s issued in %.2f seconds.', job.common_name, result.duration)
+        return self._upload_certificate(result, mapper)
+
+    async def _upload_certificate(self, result: IssuanceResult, mapper: list) -> None:
+        """
+        Creates the certificate in NPM. The certificate it replaces is deleted by `apply()`, once its hosts moved over.
+        """
+        job = result.job
+        replaces = job.context['replaces']
+
+        try:
+            new_cert_id = await self.npm_client.create_certificate(
+                result.certificate, job.context.get('nice_name', None) or job.common_name
+            )
+        except Exception as exc:
+            logger.error(f'Failed to upload the certificate for {job.common_name}: {exc}')
+            self._retry_renewal(replaces)
+            raise
+        self._issued[new_cert_id] = (job.key, result.certificate)
+
+        for host in job.context['hosts']:
+            mapper.append({
+                'proxy_host': host.id,
+                'certificate': new_cert_id,
+                # Hosts moving over from the certificate being replaced already have one.
+                'force': replaces is not None and host.is_https,
+                'modified_on': host.modified_on,
+                'replaces': replaces,
+                # Uploaded this cycle, so deleted again if no host ends up using it.
+                'uploaded': True,
+            })
+
+    def _renewal_sans(self, cert: Certificate, hosts: list) -> list:
+        """
+        SANs for a renewed certificate, so it keeps covering every host that uses it. Host names the certificate
+        already covers through a wildcard are not added again.
+        """
+        sans = list(dict.fromkeys(name for name in cert.sans if name and name != cert.primary_domain))
+
+        for name in (domain for host in hosts for domain in host.domains):
+            if name and name != cert.primary_domain and name not in sans and not self.cert_index.covers(cert, name):
+                sans.append(name)
+
+        return sans
@@ -1,5 +1,7 @@
 import argparse
+import dataclasses
 import os
+import urllib.parse
 
 from step_npm_plugin.core.data_types import SecureString
 
@@ -10,12 +12,33 @@ class AppConfig:
     """
     SCHEDULE: str = "10s"
     LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: str = "text"
+    LOG_QUEUE_SIZE: int = 10000
+    STATE_FILE: str = "./.state/state.db"
+    METRICS_HOST: str = "127.0.0.1"
+    METRICS_PORT: int = 0
+    LEASE_FILE: str = None
+    LEASE_TTL: int = 30
+    REPLICA_ID: str = None
+    SHARD_COUNT: int = 1
+    SHARD_INDEX: int = 0
 
     STEP_CA_SCHEME: str = "https"
     STEP_CA_DOMAIN: str = None
     STEP_CA_PORT: int = 9000
     STEP_CA_FINGERPRINT: SecureString = None
     STEP_CA_PROVISIONER_PASS: SecureString = None
+    STEP_CA_PROVISIONER: str = None
+    STEP_ISSUER: str = "cli"
+    STEP_KEY_TYPE: str = "EC-P256"
+    STEP_KEY_POOL_SIZE: int = 0
+    STEP_KEY_POOL_LOW: int = None
+    STEP_WORKERS: int = 4
+    STEP_TIMEOUT: int = 60
+    STEP_CACHE_SIZE: int = 0
+    STEP_HEALTH_INTERVAL: int = 60
+    STEP_HEALTH_MAX_BACKOFF: int = 300
+    STEP_RENEW_MODE: str = "rekey"
 
     NPM_SCHEME: str = "http"
     NPM_HOST: str = None
@@ -23,6 +46,22 @@ class AppConfig:
     NPM_USER: str = None
     NPM_PASS: SecureString = None
     NPM_PROXY_HOST_GRACE_PERIOD: int = 10
+    NPM_POOL_SIZE: int = 8
+
+    CONSOLIDATE: str = "none"
+    CONSOLIDATE_GROUPS: str = None
+    CONSOLIDATE_WILDCARD: int = 0
+    CONSOLIDATE_MAX_NAMES: int = 100
+
+    RENEWAL_FRACTION: float = 2 / 3
+    RENEWAL_WINDOW: int = 3600
+    RENEWAL_RATE_LIMIT: int = 0
+
+    PROFILE: int = 0
+    PROFILE_DIR: str = "./.profiles"
+    PROFILE_KEEP: int = 10
+    PROFILE_TOP: int = 15
+    PROFILE_TRACEMALLOC: int = 0
 
     __REQUIRED_ATTRS: list = [
         'STEP_CA_DOMAIN', 'STEP_CA_FINGERPRINT', 'STEP_CA_PROVISIONER_PASS', 'NPM_HOST', 'NPM_USER', 'NPM_PASS'
@@ -34,7 +73,8 @@ class AppConfig:
             if key.startswith('_'):
                 continue
             var_type = self.__annotations__.get(key.upper(), None)
-            if getattr(args, key.lower()):
+            # A value given on the command line wins even when falsy, so `0` can switch a feature off.
+            if getattr(args, key.lower()) is not None:
                 setattr(self, key.upper(), var_type(getattr(args, key.lower())))
             elif os.environ.get(key.upper(), None):
                 setattr(self, key.upper(), var_type(os.environ.get(key.upper())))
@@ -46,3 +86,46 @@ class AppConfig:
 
         if missing_args:
             raise ValueError(f'Missing required configuration in either Env or CLI command: {", ".join(missing_args)}')
+
+
+@dataclasses.dataclass(frozen=True)
+class NPMTarget:
+    """
+    An NPM instance to manage.
+    """
+    scheme: str
+    host: str
+    port: int
+
+    @property
+    def name(self) -> str:
+        return f'{self.host}:{self.port}'
+
+
+def npm_targets(config: AppConfig) -> list[NPMTarget]:
+    """
+    The NPM instances in `NPM_HOST`, a comma separated list of `[scheme://]host[:port]`. `NPM_SCHEME` and `NPM_PORT`
+    apply where the scheme or port is left out. Every instance is logged in to with `NPM_USER` and `NPM_PASS`.
+    """
+    targets = []
+
+    for entry in config.NPM_HOST.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+
+        parts = urllib.parse.urlsplit(entry if '://' in entry else f'{config.NPM_SCHEME}://{entry}')
+
+        try:
+            port = parts.port or config.NPM_PORT
+        except ValueError:
+            raise ValueError(f'Invalid port in NPM_HOST entry "{entry}".')
+
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError(f'Invalid NPM_HOST entry "{entry}", expected [http(s)://]host[:port].')
+
+        target = NPMTarget(parts.scheme, parts.hostname, port)
+        if target not in targets:
+            targets.append(target)
+
+    return targets
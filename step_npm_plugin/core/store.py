@@ -0,0 +1,127 @@
+import datetime
+import json
+import logging
+import pathlib
+import sqlite3
+import threading
+
+
+logger = logging.getLogger('console')
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS npm_entries (
+    kind TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (kind, id)
+);
+CREATE TABLE IF NOT EXISTS renewals (
+    cert_id INTEGER PRIMARY KEY,
+    deadline REAL NOT NULL
+);
+-- Issued certificates used to be recorded here, but were never read back.
+DROP TABLE IF EXISTS issued;
+"""
+
+
+class StateStore:
+    """
+    Local SQLite store for state that should survive a restart.
+
+    Keeps the last observed NPM proxy hosts and certificates, and certificate renewal deadlines. State belongs to a
+    single NPM instance, it is discarded if the store is opened for a different one.
+    """
+    path: pathlib.Path = None
+
+    _connection: sqlite3.Connection = None
+    _lock: threading.Lock = None
+
+    def __init__(self, path: pathlib.Path, instance: str):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path.__str__(), check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(SCHEMA)
+
+        if self.get_meta('schema_version') != str(SCHEMA_VERSION) or self.get_meta('instance') != instance:
+            logger.info(f'State in {path.absolute()} is for another NPM instance or version, starting afresh.')
+            self.clear()
+            self.set_meta('schema_version', str(SCHEMA_VERSION))
+            self.set_meta('instance', instance)
+
+    def _execute(self, sql: str, parameters=()) -> list:
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def _transaction(self, statements: list) -> None:
+        with self._lock:
+            self._connection.execute('BEGIN')
+            try:
+                for sql, parameters in statements:
+                    self._connection.executemany(sql, parameters)
+            except Exception:
+                self._connection.execute('ROLLBACK')
+                raise
+            self._connection.execute('COMMIT')
+
+    def clear(self) -> None:
+        self._transaction([
+            ('DELETE FROM meta', [()]),
+            ('DELETE FROM npm_entries', [()]),
+            ('DELETE FROM renewals', [()]),
+        ])
+
+    def get_meta(self, key: str) -> str or None:
+        rows = self._execute('SELECT value FROM meta WHERE key = ?', (key,))
+        return rows[0][0] if rows else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        self._execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def load_entries(self, kind: str) -> list:
+        """
+        Raw NPM entries of a kind (`proxy_host` or `certificate`) as last observed.
+        """
+        return [json.loads(data) for data, in self._execute('SELECT data FROM npm_entries WHERE kind = ?', (kind,))]
+
+    def load_renewals(self) -> dict:
+        return {
+            cert_id: datetime.datetime.fromtimestamp(deadline, datetime.timezone.utc)
+            for cert_id, deadline in self._execute('SELECT cert_id, deadline FROM renewals')
+        }
+
+    def save_changes(self, kind: str, changes, renewals: dict = None) -> None:
+        """
+        Records a `ChangeSet` of raw NPM entries, and any renewal deadlines, in one transaction.
+
+        :param str kind: `proxy_host` or `certificate`.
+        :param ChangeSet changes: Changes since the last cycle.
+        :param dict renewals: Certificate ID to renewal deadline (aware UTC), None to forget a deadline.
+        :return:
+        """
+        renewals = renewals or {}
+        removed = [(cert_id,) for cert_id, deadline in renewals.items() if deadline is None]
+
+        self._transaction([
+            ('DELETE FROM npm_entries WHERE kind = ? AND id = ?', [(kind, entry_id) for entry_id in changes.removed]),
+            ('INSERT OR REPLACE INTO npm_entries (kind, id, data) VALUES (?, ?, ?)', [
+                (kind, entry['id'], json.dumps(entry)) for entry in changes.updated
+            ]),
+            ('DELETE FROM renewals WHERE cert_id = ?', removed),
+            ('INSERT OR REPLACE INTO renewals (cert_id, deadline) VALUES (?, ?)', [
+                (cert_id, deadline.timestamp()) for cert_id, deadline in renewals.items() if deadline is not None
+            ]),
+        ])
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
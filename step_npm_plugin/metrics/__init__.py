@@ -0,0 +1,16 @@
+from .instruments import (
+    REGISTRY, RECONCILE_PHASE_SECONDS, RECONCILE_CYCLES, NPM_REQUEST_SECONDS, NPM_RETRIES, NPM_CIRCUIT_OPEN,
+    STEP_SUBPROCESS_SECONDS, STEP_SUBPROCESS_FAILURES, ISSUANCE_SECONDS, STEP_CA_UP, STEP_RENEWALS,
+    CERTIFICATE_CACHE, CERTIFICATES_BY_EXPIRY,
+    HOST_HTTPS_SECONDS, LOG_RECORDS_DROPPED, EXPIRY_BUCKETS, endpoint_label, expiry_bucket
+)
+from .registry import Registry, Counter, Gauge, Histogram
+
+
+def __getattr__(name: str):
+    # The HTTP server, and http.server with it, is only imported once metrics are served.
+    if name == 'MetricsServer':
+        from .server import MetricsServer
+        return MetricsServer
+
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
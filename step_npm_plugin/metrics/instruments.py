@@ -0,0 +1,78 @@
+import re
+import urllib.parse
+
+from .registry import Registry
+
+
+# Numeric path segments, such as the IDs in /api/nginx/proxy-hosts/12.
+ID_SEGMENT = re.compile(r'(?<=/)\d+(?=/|$)')
+
+# Upper bounds of the time to expiry buckets, in days.
+EXPIRY_BUCKETS = ((0, 'expired'), (1, '1d'), (7, '7d'), (30, '30d'), (90, '90d'))
+
+REGISTRY = Registry()
+
+RECONCILE_PHASE_SECONDS = REGISTRY.histogram(
+    'step_npm_reconcile_phase_seconds', 'Wall time of each phase of a reconcile cycle.', ('phase',),
+    buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 300)
+)
+RECONCILE_CYCLES = REGISTRY.counter(
+    'step_npm_reconcile_cycles', 'Reconcile cycles run, by outcome.', ('outcome',)
+)
+NPM_REQUEST_SECONDS = REGISTRY.histogram(
+    'step_npm_npm_request_seconds', 'Latency of requests to the NPM API.', ('method', 'endpoint', 'status')
+)
+NPM_RETRIES = REGISTRY.counter(
+    'step_npm_npm_retries', 'Failed attempts at NPM API requests, retried or given up on.',
+    ('method', 'endpoint', 'reason')
+)
+NPM_CIRCUIT_OPEN = REGISTRY.gauge(
+    'step_npm_npm_circuit_open', 'Whether requests to an NPM endpoint are held back after repeated failures.',
+    ('method', 'endpoint')
+)
+STEP_SUBPROCESS_SECONDS = REGISTRY.histogram(
+    'step_npm_step_subprocess_seconds', 'Run time of step-cli subprocesses.', ('command',),
+    buckets=(.05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+STEP_SUBPROCESS_FAILURES = REGISTRY.counter(
+    'step_npm_step_subprocess_failures', 'step-cli subprocesses that failed or timed out.', ('command', 'reason')
+)
+ISSUANCE_SECONDS = REGISTRY.histogram(
+    'step_npm_issuance_seconds', 'Time taken to issue a certificate, by outcome.', ('outcome',),
+    buckets=(.05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+STEP_CA_UP = REGISTRY.gauge(
+    'step_npm_step_ca_up', '1 while Step CA is considered up, 0 while issuance is held back.'
+)
+STEP_RENEWALS = REGISTRY.counter(
+    'step_npm_step_renewals', 'Certificates renewed, by whether they were renewed, rekeyed or issued anew.', ('method',)
+)
+CERTIFICATE_CACHE = REGISTRY.counter(
+    'step_npm_certificate_cache', 'Lookups of recently issued certificates before asking the CA, by result.',
+    ('result',)
+)
+CERTIFICATES_BY_EXPIRY = REGISTRY.gauge(
+    'step_npm_certificates', 'Certificates in NPM by time left until they expire.', ('expires_within',)
+)
+LOG_RECORDS_DROPPED = REGISTRY.counter(
+    'step_npm_log_records_dropped', 'Log records dropped because the log queue was full.'
+)
+HOST_HTTPS_SECONDS = REGISTRY.histogram(
+    'step_npm_host_https_seconds', 'Time from a proxy host being created in NPM to it being given a certificate.',
+    buckets=(10, 30, 60, 120, 300, 600, 1800, 3600, 21600, 86400)
+)
+
+
+def endpoint_label(uri: str) -> str:
+    """
+    Path of a request URI with IDs replaced by `{id}`, so requests to the same endpoint share a label.
+    """
+    return ID_SEGMENT.sub('{id}', urllib.parse.urlsplit(uri).path)
+
+
+def expiry_bucket(days_left: float) -> str:
+    for bound, label in EXPIRY_BUCKETS:
+        if days_left < bound:
+            return label
+
+    return '+Inf'
@@ -0,0 +1,242 @@
+import bisect
+import math
+import threading
+
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    return repr(float(value))
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(names: tuple, values: tuple, extra: str = None) -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    """
+    Base for a named metric with a fixed set of label names.
+
+    Each distinct combination of label values is a separate series. Metrics without labels are used directly, metrics
+    with labels through `labels(...)`.
+    """
+    type: str = None
+    name: str = None
+    help: str = None
+    label_names: tuple = ()
+
+    _series: dict = None
+    _lock: threading.Lock = None
+
+    def __init__(self, name: str, help: str, label_names: tuple = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """
+        The series for a combination of label values, created on first use.
+        """
+        if len(values) != len(self.label_names):
+            raise ValueError(f'{self.name} expects labels {self.label_names}, received {values}.')
+
+        values = tuple(str(value) for value in values)
+        series = self._series.get(values, None)
+
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(values, self._new_series())
+
+        return series
+
+    def _new_series(self):
+        raise NotImplementedError
+
+    def _default(self):
+        if self.label_names:
+            raise ValueError(f'{self.name} has labels {self.label_names}, use labels(...).')
+
+        return self.labels()
+
+    def samples(self) -> list:
+        """
+        Every sample of the metric as (suffix, label string, value).
+        """
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        lines.extend(f'{self.name}{suffix}{labels} {format_value(value)}' for suffix, labels, value in self.samples())
+
+        return '\n'.join(lines)
+
+
+class _Value:
+    value: float = 0
+
+    _lock: threading.Lock = None
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self.value = value
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def _new_series(self):
+        return _Value()
+
+    def inc(self, amount: float = 1) -> None:
+        if amount < 0:
+            raise ValueError('Counters can only go up.')
+        self._default().inc(amount)
+
+    def samples(self) -> list:
+        return [
+            ('_total', format_labels(self.label_names, values), series.value)
+            for values, series in list(self._series.items())
+        ]
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def _new_series(self):
+        return _Value()
+
+    def inc(self, amount: float = 1) -> None:
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1) -> None:
+        self._default().dec(amount)
+
+    def set(self, value: float) -> None:
+        self._default().set(value)
+
+    def samples(self) -> list:
+        return [
+            ('', format_labels(self.label_names, values), series.value) for values, series in list(self._series.items())
+        ]
+
+
+class _Histogram:
+    buckets: tuple = None
+    counts: list = None
+    sum: float = 0
+    count: int = 0
+
+    _lock: threading.Lock = None
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Histogram(Metric):
+    type = 'histogram'
+    buckets: tuple = DEFAULT_BUCKETS
+
+    def __init__(self, name: str, help: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(sorted(buckets)) + ((math.inf,) if buckets[-1] != math.inf else ())
+
+    def _new_series(self):
+        return _Histogram(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default().observe(value)
+
+    def samples(self) -> list:
+        samples = []
+
+        for values, series in list(self._series.items()):
+            with series._lock:
+                counts, total, count = list(series.counts), series.sum, series.count
+
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append((
+                    '_bucket', format_labels(self.label_names, values, f'le="{format_value(bound)}"'), cumulative
+                ))
+
+            samples.append(('_sum', format_labels(self.label_names, values), total))
+            samples.append(('_count', format_labels(self.label_names, values), count))
+
+        return samples
+
+
+class Registry:
+    """
+    In-process collection of metrics, rendered in the Prometheus text exposition format.
+    """
+    _metrics: dict = None
+    _lock: threading.Lock = None
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'Metric {metric.name} is already registered.')
+            self._metrics[metric.name] = metric
+
+        return metric
+
+    def counter(self, name: str, help: str, label_names: tuple = ()) -> Counter:
+        return self.register(Counter(name, help, label_names))
+
+    def gauge(self, name: str, help: str, label_names: tuple = ()) -> Gauge:
+        return self.register(Gauge(name, help, label_names))
+
+    def histogram(self, name: str, help: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, label_names, buckets))
+
+    def get(self, name: str) -> Metric or None:
+        return self._metrics.get(name, None)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
@@ -0,0 +1,67 @@
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from .registry import Registry
+
+
+logger = logging.getLogger('console')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class MetricsServer:
+    """
+    Serves a `Registry` on `/metrics` for Prometheus to scrape, from a daemon thread.
+    """
+    host: str = '127.0.0.1'
+    port: int = 9120
+    registry: Registry = None
+
+    _server: ThreadingHTTPServer = None
+    _thread: threading.Thread = None
+
+    def __init__(self, registry: Registry, host: str = '127.0.0.1', port: int = 9120):
+        self.registry = registry
+        self.host = host
+        self.port = port
+
+    def _handler(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                logger.debug('Metrics request from %s: ' + format, self.address_string(), *args)
+
+            def do_GET(self):
+                if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+
+                body = registry.render().encode('utf-8')
+
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def start(self) -> None:
+        self._server = ThreadingHTTPServer((self.host, self.port), self._handler())
+        self._server.daemon_threads = True
+        # Port 0 picks a free port, report the one actually in use.
+        self.port = self._server.server_address[1]
+
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics-server', daemon=True)
+        self._thread.start()
+
+        logger.info(f'Serving metrics on http://{self.host}:{self.port}/metrics')
+
+    def stop(self) -> None:
+        if self._server is None:
+            return
+
+        self._server.shutdown()
+        self._server.server_close()
@@ -1,3 +1,10 @@
+from .async_client import AsyncNginxProxyManagerClient
+from .changes import ChangeTracker, ChangeSet
+from .circuit import CircuitBreaker
 from .client import NginxProxyManagerClient
-from .exceptions import GenericNPMError, FailedToLogin, NotLoggedIn, CommunicationError
-from .parsers import parse_http_hosts, parse_certificates
+from .exceptions import GenericNPMError, FailedToLogin, NotLoggedIn, CommunicationError, BadRequest, CircuitOpen
+from .index import CertificateIndex, HostIndex, normalise_domain, wildcard_for, registrable_domain
+from .parsers import (
+    RecordCache, parse_http_host, parse_http_hosts, parse_certificate, parse_certificates, iter_json_array
+)
+from .records import ProxyHost, Certificate
@@ -0,0 +1,90 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from step_npm_plugin.core.data_types import SecureString
+from step_npm_plugin.step.certificate import StepCertificate
+
+from .client import NginxProxyManagerClient
+
+
+logger = logging.getLogger('console')
+
+
+class AsyncNginxProxyManagerClient:
+    """
+    Asyncio counterpart to `NginxProxyManagerClient`, with the same API surface.
+
+    Calls are run by a `NginxProxyManagerClient` on a bounded pool of worker threads. Its session keeps a connection
+    pool of the same size, so up to `pool_size` requests are in flight at once over kept-alive connections, and any
+    further calls wait for a free slot. The retry and re-login handling of the synchronous client is kept as is.
+    """
+    client: NginxProxyManagerClient = None
+    pool_size: int = 8
+
+    _executor: ThreadPoolExecutor = None
+
+    def __init__(
+            self, host: str, port: int, auth: tuple[str, SecureString], scheme: str = "http", pool_size: int = 8
+    ):
+        self.pool_size = pool_size
+        self.client = NginxProxyManagerClient(host, port, auth, scheme, pool_size=pool_size)
+
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='npm-client')
+
+    @property
+    def uri(self) -> str:
+        return self.client.uri
+
+    async def _call(self, f, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(f, *args, **kwargs))
+
+    async def login(self) -> None:
+        return await self._call(self.client.login)
+
+    async def get_proxy_hosts(self) -> list:
+        return await self._call(self.client.get_proxy_hosts)
+
+    async def get_certificates(self) -> list:
+        return await self._call(self.client.get_certificates)
+
+    async def create_certificate(self, step_cert: StepCertificate, common_name: str) -> int:
+        """
+        Create a new certificate in Nginx Proxy Manager. See `NginxProxyManagerClient.create_certificate`.
+
+        :param StepCertificate step_cert: Smallstep CA generated certificate and key pair.
+        :param str common_name: Common name for the certificate being added to NPM.
+        :return: New Certificate ID
+        """
+        return await self._call(self.client.create_certificate, step_cert, common_name)
+
+    async def delete_certificate(self, cert_id: int) -> None:
+        return await self._call(self.client.delete_certificate, cert_id)
+
+    async def update_proxy_host_certificate(self, proxy_host_id: int, certificate_id: int) -> dict:
+        return await self._call(self.client.update_proxy_host_certificate, proxy_host_id, certificate_id)
+
+    async def update_proxy_host_certificates(self, mapper: list) -> list:
+        """
+        Applies a list of proxy host to certificate mappings concurrently, up to `pool_size` at a time.
+
+        :param list mapper: Dicts of at least `proxy_host` and `certificate`, as built by the reconciler.
+        :return: The outcome of each mapping in order, the updated proxy host or the exception it failed with.
+        """
+        return await asyncio.gather(*(
+            self.update_proxy_host_certificate(cert_map['proxy_host'], cert_map['certificate']) for cert_map in mapper
+        ), return_exceptions=True)
+
+    async def delete_certificates(self, cert_ids) -> list:
+        """
+        Deletes certificates concurrently, up to `pool_size` at a time.
+
+        :return: The outcome of each deletion in order, None or the exception it failed with.
+        """
+        return await asyncio.gather(*(self.delete_certificate(cert_id) for cert_id in cert_ids), return_exceptions=True)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        self.client.session.close()
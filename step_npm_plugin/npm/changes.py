@@ -0,0 +1,80 @@
+
+
+class ChangeSet:
+    """
+    Result of comparing an NPM listing against the listing observed on the previous cycle.
+    """
+    added: list = None
+    changed: list = None
+    removed: list = None
+
+    def __init__(self, added: list = None, changed: list = None, removed: list = None):
+        self.added = added or []
+        self.changed = changed or []
+        self.removed = removed or []
+
+    @property
+    def updated(self) -> list:
+        """
+        Raw entries that are either new or have changed since the last cycle.
+        """
+        return self.added + self.changed
+
+    @property
+    def has_changes(self) -> bool:
+        return True if self.added or self.changed or self.removed else False
+
+    def __repr__(self):
+        return f"<ChangeSet added={len(self.added)}, changed={len(self.changed)}, removed={len(self.removed)}>"
+
+
+class ChangeTracker:
+    """
+    Fingerprints raw NPM entries between cycles, so only new or changed entries need to be parsed and processed.
+
+    An entry's fingerprint is the tuple of its `id` and the extra fields given to the tracker. NPM bumps
+    `modified_on` on every update, so this is usually enough to tell whether an entry needs another look.
+    """
+    _fields: tuple = None
+    _fingerprints: dict = None
+
+    def __init__(self, *fields: str):
+        self._fields = ('id',) + fields
+        self._fingerprints = {}
+
+    def fingerprint(self, entry: dict) -> tuple:
+        return tuple(entry.get(field, None) for field in self._fields)
+
+    def diff(self, data: list) -> ChangeSet:
+        """
+        Compares a raw NPM listing with the previously seen listing and records it as the new baseline.
+
+        :param list data: Raw list response from the NPM API.
+        :return: Entries that were added, changed or removed since the last call.
+        """
+        fingerprints = {entry.get('id', None): self.fingerprint(entry) for entry in data}
+
+        if fingerprints == self._fingerprints:
+            return ChangeSet()
+
+        changes = ChangeSet()
+
+        for entry in data:
+            previous = self._fingerprints.get(entry.get('id', None), None)
+
+            if previous is None:
+                changes.added.append(entry)
+            elif previous != fingerprints[entry.get('id', None)]:
+                changes.changed.append(entry)
+
+        changes.removed = [entry_id for entry_id in self._fingerprints if entry_id not in fingerprints]
+
+        self._fingerprints = fingerprints
+
+        return changes
+
+    def reset(self) -> None:
+        """
+        Forgets all fingerprints, so the next listing is treated as entirely new.
+        """
+        self._fingerprints = {}
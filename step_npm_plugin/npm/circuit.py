@@ -0,0 +1,92 @@
+import threading
+import time
+
+
+# Consecutive failures of an endpoint before its circuit opens.
+FAILURE_THRESHOLD = 5
+# Seconds an open circuit waits before letting a single trial request through.
+RESET_TIMEOUT = 30
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for a single NPM endpoint.
+
+    The circuit is closed while requests succeed. After `failure_threshold` consecutive failures it opens and requests
+    are refused straight away, rather than adding load to an NPM that is already struggling. Once `reset_timeout`
+    seconds have passed one trial request is let through (half open), and its outcome closes or re-opens the circuit.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    name: str = None
+    failure_threshold: int = FAILURE_THRESHOLD
+    reset_timeout: float = RESET_TIMEOUT
+
+    _state: str = CLOSED
+    _failures: int = 0
+    _opened_at: float = None
+    _trial_running: bool = False
+    _lock: threading.Lock = None
+
+    def __init__(self, name: str, failure_threshold: int = FAILURE_THRESHOLD, reset_timeout: float = RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """
+        Whether a request may be made now. In the half open state only the first caller is allowed through.
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+
+            if self._state == self.OPEN and time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+
+            if self._trial_running:
+                return False
+
+            self._state = self.HALF_OPEN
+            self._trial_running = True
+            return True
+
+    def end_trial(self) -> None:
+        """
+        Lets another trial request through if the last one ended without an outcome, such as a failed login.
+        """
+        with self._lock:
+            self._trial_running = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_running = False
+
+    def record_failure(self) -> bool:
+        """
+        Records a failed request.
+
+        :return: True if the circuit is now open.
+        """
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+            return self._state == self.OPEN
@@ -1,15 +1,48 @@
+import base64
+import datetime
+import json
 import logging
+import threading
+import time
+
 import requests
+from requests.adapters import HTTPAdapter
 
 from step_npm_plugin.core.data_types import SecureString
+from step_npm_plugin.metrics import NPM_REQUEST_SECONDS, endpoint_label
 from step_npm_plugin.step.certificate import StepCertificate
 
+from .circuit import CircuitBreaker
 from .decorators import retry_handler
-from .exceptions import GenericNPMError, FailedToLogin, NotLoggedIn, CommunicationError
+from .exceptions import GenericNPMError, FailedToLogin, NotLoggedIn, CommunicationError, BadRequest
+from .parsers import CHUNK_SIZE, iter_json_array
 
 
 logger = logging.getLogger('console')
 
+# Tokens are renewed this long before NPM says they expire, so requests never go out with an expired one.
+TOKEN_REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+
+def token_expiry(data: dict) -> datetime.datetime or None:
+    """
+    When a token returned by `/api/tokens` expires, from its `expires` field or else the `exp` claim of the JWT.
+
+    :param dict data: Response of `/api/tokens`, `{"token": "...", "expires": "..."}`.
+    :return: Expiry as an aware datetime, or None if it cannot be read.
+    """
+    try:
+        return datetime.datetime.fromisoformat(data['expires'].replace('Z', '+00:00')).astimezone(datetime.timezone.utc)
+    except (KeyError, AttributeError, ValueError):
+        pass
+
+    try:
+        payload = data['token'].split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        return datetime.datetime.fromtimestamp(claims['exp'], datetime.timezone.utc)
+    except (KeyError, IndexError, AttributeError, TypeError, ValueError):
+        return None
+
 
 class NginxProxyManagerClient:
     host: str = None
@@ -19,57 +52,158 @@ class NginxProxyManagerClient:
     session: requests.Session = None
 
     __auth: tuple = None
-
-    def __init__(self, host: str, port: int, auth: tuple[str, SecureString], scheme: str = "http"):
+    __login_lock: threading.Lock = None
+    __token_expires: datetime.datetime = None
+    __breakers: dict = None
+    __breakers_lock: threading.Lock = None
+
+    def __init__(
+            self, host: str, port: int, auth: tuple[str, SecureString], scheme: str = "http", pool_size: int = None
+    ):
         self.host = host
         self.port = port
         self.scheme = scheme    # NPM defaults to HTTP
 
         self.__auth = auth
+        self.__login_lock = threading.Lock()
+        self.__breakers = {}
+        self.__breakers_lock = threading.Lock()
 
         self.session = requests.Session()
+        if pool_size:
+            # Block rather than open extra connections when every pooled connection is in use.
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+
         self.__build_uri()
 
     def __build_uri(self):
         self.uri = f"{self.scheme}://{self.host}:{self.port}"
 
+    def circuit_breaker(self, method: str, endpoint: str) -> CircuitBreaker:
+        """
+        The circuit breaker of an endpoint, such as `GET /api/nginx/proxy-hosts/{id}`.
+        """
+        name = f'{method} {endpoint}'
+        breaker = self.__breakers.get(name, None)
+
+        if breaker is None:
+            with self.__breakers_lock:
+                breaker = self.__breakers.setdefault(name, CircuitBreaker(name))
+
+        return breaker
+
     @staticmethod
     def _response_parse(r: requests.Response):
         if r.status_code in (200, 201):
             data = r.json()
-        elif r.status_code in (400, 401, 403):
+        elif r.status_code in (401, 403):
             logger.debug('Token has timed out. Need to login and retry.')
             raise NotLoggedIn("Token timed out.")
+        elif r.status_code == 400:
+            raise BadRequest(f"NPM rejected the request to {r.request.path_url}: {r.text}")
+        elif r.status_code >= 500:
+            raise CommunicationError(f"NPM responded with {r.status_code} to {r.request.path_url}.")
         else:
             data = {}
 
         return data
 
+    def _request(self, method: str, uri: str, **kwargs) -> requests.Response:
+        started = time.perf_counter()
+        status = 'error'
+
+        try:
+            r = self.session.request(method, uri, **kwargs)
+            status = r.status_code
+            return r
+        finally:
+            NPM_REQUEST_SECONDS.labels(method, endpoint_label(uri), status).observe(time.perf_counter() - started)
+
     @retry_handler
     def _get(self, uri: str, **kwargs):
-        logger.debug(f"GET issued to: {uri}")
-        r = self.session.get(uri, timeout=5, **kwargs)
+        logger.debug("GET issued to: %s", uri)
+        r = self._request('GET', uri, timeout=5, **kwargs)
         return self._response_parse(r)
 
+    @retry_handler
+    def _get_list(self, uri: str, **kwargs) -> list:
+        """
+        GETs a list endpoint, decoding the entries from the response stream as they arrive.
+        """
+        logger.debug("GET issued to: %s", uri)
+
+        with self._request('GET', uri, timeout=5, stream=True, **kwargs) as r:
+            if r.status_code != 200:
+                return self._response_parse(r)
+
+            return list(iter_json_array(r.iter_content(CHUNK_SIZE), r.encoding or 'utf-8'))
+
     @retry_handler
     def _post(self, uri: str, data: dict = None, **kwargs):
-        logger.debug(f'POST issued to: {uri}')
-        r = self.session.post(uri, json=data, timeout=5, **kwargs)
+        logger.debug('POST issued to: %s', uri)
+        r = self._request('POST', uri, json=data, timeout=5, **kwargs)
         return self._response_parse(r)
 
     @retry_handler
     def _put(self, uri: str, data: dict = None, **kwargs):
-        logger.debug(f'PUT issued to: {uri}')
-        r = self.session.put(uri, json=data, timeout=5, **kwargs)
+        logger.debug('PUT issued to: %s', uri)
+        r = self._request('PUT', uri, json=data, timeout=5, **kwargs)
         return self._response_parse(r)
 
     @retry_handler
     def _delete(self, uri: str, **kwargs):
-        logger.debug(f'DELETE issued to: {uri}')
-        r = self.session.delete(uri, timeout=5, **kwargs)
+        logger.debug('DELETE issued to: %s', uri)
+        r = self._request('DELETE', uri, timeout=5, **kwargs)
         return self._response_parse(r)
 
     def login(self) -> None:
+        # Requests on other threads may all find the token expired at once. Only the first of them logs in again,
+        # the others pick up the token it received.
+        token = self.session.headers.get('Authorization', None)
+
+        with self.__login_lock:
+            if token is not None and token != self.session.headers.get('Authorization', None):
+                logger.debug('Token already refreshed by another request.')
+                return
+
+            self.__login()
+
+    def refresh_token(self) -> None:
+        """
+        Renews the token if it is about to expire, so requests do not have to fail and log in again.
+
+        NPM hands out a new token for a valid one on `GET /api/tokens`. If that fails, the client logs in again.
+        """
+        expires = self.__token_expires
+
+        if expires is None or datetime.datetime.now(datetime.timezone.utc) < expires - TOKEN_REFRESH_MARGIN:
+            return
+
+        with self.__login_lock:
+            if expires != self.__token_expires:
+                logger.debug('Token already refreshed by another request.')
+                return
+
+            logger.debug('Token expires at %s, refreshing it.', expires.isoformat())
+
+            try:
+                r = self._request('GET', f"{self.uri}/api/tokens", timeout=5)
+            except requests.RequestException as exc:
+                logger.debug('Failed to refresh the token: %s', exc)
+                r = None
+
+            if r is not None and r.status_code in (200, 201):
+                self.__set_token(r.json())
+            else:
+                self.__login()
+
+    def __set_token(self, data: dict) -> None:
+        self.session.headers.update({"Authorization": f"Bearer {data['token']}"})
+        self.__token_expires = token_expiry(data)
+
+    def __login(self) -> None:
         token_uri = f"{self.uri}/api/tokens"
 
         post = {
@@ -77,13 +211,13 @@ class NginxProxyManagerClient:
             "secret": self.__auth[1].to_string()
         }
 
-        logger.debug(f'Login to proxy initiated to {token_uri}')
+        logger.debug('Login to proxy initiated to %s', token_uri)
 
-        r = self.session.post(token_uri, json=post)
+        r = self._request('POST', token_uri, json=post, timeout=5)
 
         if r.status_code in (200, 201):
             logger.debug('Login success, received token from NPM.')
-            self.session.headers.update({"Authorization": f"Bearer {r.json()['token']}"})
+            self.__set_token(r.json())
         elif r.status_code == 401 or r.status_code == 403:
             # Wrong login credentials {"error":{"message": "..."}}
             logger.critical("Incorrect login credentials provided for NPM.")
@@ -91,18 +225,28 @@ class NginxProxyManagerClient:
         else:
             # Random error. Report it. {"error":{"message": "..."}}
             logger.warning("Communication error occurred, will retry later.")
-            logger.debug(f"{r}")
+            logger.debug("%s", r)
             raise GenericNPMError(f"Unknown error occurred communicating with NPM. Received: {r.json()}")
 
     def get_proxy_hosts(self) -> list:
-        url = f"{self.uri}/api/nginx/proxy-hosts"
-        data = self._get(url)
+        """
+        Lists every proxy host, with the provider of the certificate attached to it.
+
+        The listing is requested with `?expand=certificate`, so whether a host uses a LetsEncrypt certificate is known
+        without a request per host. Only the provider is kept of the expanded certificate.
+        """
+        url = f"{self.uri}/api/nginx/proxy-hosts?expand=certificate"
+        data = self._get_list(url)
+
+        for proxy_host in data:
+            if proxy_host.get('certificate', None):
+                proxy_host['certificate'] = {'provider': proxy_host['certificate'].get('provider', None)}
 
         return data
 
     def get_certificates(self) -> list:
         url = f"{self.uri}/api/nginx/certificates"
-        data = self._get(url)
+        data = self._get_list(url)
 
         return data
 
@@ -125,12 +269,12 @@ class NginxProxyManagerClient:
         create_url = f"{self.uri}/api/nginx/certificates"
         new_cert_id = self._post(create_url, {"nice_name": common_name, "provider": "other"})['id']
 
-        logger.debug(f'New Certificate with created with ID: {new_cert_id}')
+        logger.debug('New Certificate with created with ID: %s', new_cert_id)
 
         upload_url = f"{create_url}/{new_cert_id}/upload"
         cert_upload = self._post(
             upload_url, files={
-                'certificate': step_cert.certificate_bytes + step_cert.intermediate_bytes,
+                'certificate': step_cert.chain_bytes,
                 'certificate_key': step_cert.private_key_bytes
             }
         )
@@ -154,32 +298,25 @@ class NginxProxyManagerClient:
 
         return
 
-    def update_proxy_host_certificate(self, proxy_host_id: int, certificate_id: int, force: bool = False) -> None:
+    def update_proxy_host_certificate(self, proxy_host_id: int, certificate_id: int) -> dict:
         """
-        Updates a proxy host with a certificate to use.
+        Updates a proxy host with a certificate to use, along with hsts_enabled and ssl_forced.
 
-        To apply a new certificate, we get the current state of the proxy host and then apply the certificate with
-        the additional configurations using certificate_id, hsts_enabled and ssl_forced.
+        The host is not fetched first. Whether it should get the certificate is decided by the caller, from the listing
+        it already has, see `Reconciler.apply`.
 
         :param int proxy_host_id: ID of the Proxy Host to be updated
         :param int certificate_id: ID of the certificate to be applied to the proxy host
-        :param bool force: If forced, the mapper will reset the certificate regardless of the state of the proxy host
-        :return:
+        :return: The updated proxy host.
         """
         proxy_host_url = f"{self.uri}/api/nginx/proxy-hosts/{proxy_host_id}"
-        proxy_host = self._get(proxy_host_url)
 
-        if proxy_host.get('certificate_id', None) != 0 and not force:
-            logger.info(f'Recheck of proxy host {proxy_host.get("domain_names", [None])[0]} already has a '
-                        f'certificate assigned. Skipping host...')
-            return
-
-        proxy_host_update = self._put(proxy_host_url, {
+        proxy_host = self._put(proxy_host_url, {
             'certificate_id': certificate_id,
             'hsts_enabled': True,
             'ssl_forced': True
         })
 
-        logger.info(f'Configuration updated successfully!')
+        logger.info(f'Proxy host {proxy_host_id} now uses certificate {certificate_id}.')
 
-        return
+        return proxy_host
@@ -1,33 +1,79 @@
 import logging
-from requests.exceptions import ReadTimeout, ConnectTimeout
+import random
+import time
 
-from .exceptions import GenericNPMError, NotLoggedIn, CommunicationError
+from requests.exceptions import ConnectionError, Timeout
+
+from step_npm_plugin.metrics import NPM_RETRIES, NPM_CIRCUIT_OPEN, endpoint_label
+
+from .exceptions import GenericNPMError, NotLoggedIn, BadRequest, CircuitOpen
 
 
 RETRIES = 3
+# Failed attempts are retried after a random delay of up to BACKOFF_BASE * 2^attempt seconds, capped at BACKOFF_MAX.
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8
 logger = logging.getLogger('console')
 
 
+def backoff_delay(attempt: int) -> float:
+    """
+    Exponential backoff with full jitter, so clients that failed together do not retry together.
+    """
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
 def retry_handler(f):
+    # _get, _get_list, _post, ... are named after the HTTP method they use.
+    method = f.__name__.strip('_').split('_')[0].upper()
+
     def wrapper(*args, **kwargs):
+        client, uri = args[0], args[1]
+        endpoint = endpoint_label(uri)
+        breaker = client.circuit_breaker(method, endpoint)
+
+        if not breaker.allow():
+            raise CircuitOpen(f"Requests to {method} {endpoint} are held back after repeated failures.")
+
+        client.refresh_token()
+
         counter = 0
         data = {}
 
-        while counter < RETRIES:
-            try:
-                data = f(*args, **kwargs)
-            except NotLoggedIn:
-                counter += 1
-                logger.debug('Token expired, attempting to log back in.')
-                args[0].login()
-            except (GenericNPMError, CommunicationError, ReadTimeout, ConnectTimeout):
-                counter += 1
-                logger.debug(f"Failed to access NPM after {counter} tries...")
-            else:
-                break
+        try:
+            while counter < RETRIES:
+                try:
+                    data = f(*args, **kwargs)
+                except NotLoggedIn:
+                    counter += 1
+                    NPM_RETRIES.labels(method, endpoint, 'login').inc()
+                    logger.debug('Token expired, attempting to log back in.')
+                    client.login()
+                except BadRequest:
+                    # NPM answered, the request itself is at fault.
+                    breaker.record_success()
+                    raise
+                except (GenericNPMError, ConnectionError, Timeout) as exc:
+                    counter += 1
+                    NPM_RETRIES.labels(method, endpoint, 'error').inc()
+
+                    if breaker.record_failure():
+                        NPM_CIRCUIT_OPEN.labels(method, endpoint).set(1)
+                        logger.warning(f"Holding back requests to {method} {endpoint} after repeated failures.")
+                        raise CircuitOpen(f"Requests to {method} {endpoint} are failing: {exc}") from exc
+
+                    logger.debug("Failed to access NPM after %s tries...", counter)
+                    if counter < RETRIES:
+                        time.sleep(backoff_delay(counter))
+                else:
+                    breaker.record_success()
+                    NPM_CIRCUIT_OPEN.labels(method, endpoint).set(0)
+                    break
+        finally:
+            breaker.end_trial()
 
         if counter >= RETRIES:
-            raise GenericNPMError(f"Failed to communicate with NPM on URI {args[1]}.")
+            raise GenericNPMError(f"Failed to communicate with NPM on URI {uri}.")
 
         return data
 
@@ -25,3 +25,17 @@ class CommunicationError(GenericNPMError):
     """
     Unable to communicate with the NPM host, or it responded in a way that we cannot handle.
     """
+
+
+class BadRequest(GenericNPMError):
+    """
+    NPM rejected the request as invalid (400). Retrying the same request will not help.
+    """
+    pass
+
+
+class CircuitOpen(CommunicationError):
+    """
+    Requests to an NPM endpoint are being held back after repeated failures.
+    """
+    pass
@@ -0,0 +1,205 @@
+import ipaddress
+
+from .records import Certificate
+
+
+# Second level labels that are commonly part of a country code public suffix, such as `co.uk` or `com.au`.
+SECOND_LEVEL_LABELS = ('ac', 'co', 'com', 'edu', 'gov', 'ltd', 'net', 'nhs', 'org', 'plc', 'sch')
+
+
+def normalise_domain(domain: str) -> str:
+    return domain.strip().rstrip('.').lower() if domain else domain
+
+
+def wildcard_for(domain: str) -> str or None:
+    """
+    Returns the wildcard name that would cover `domain`, e.g. `*.example.com` for `a.example.com`.
+
+    Wildcards only cover a single label, so `*.example.com` does not cover `example.com` or `a.b.example.com`. Empty
+    domains, as on a host without domain names, have no wildcard.
+    """
+    domain = normalise_domain(domain)
+
+    if not domain:
+        return None
+
+    parts = domain.split('.', 1)
+
+    if len(parts) < 2 or not parts[1]:
+        return None
+
+    return f'*.{parts[1]}'
+
+
+def registrable_domain(domain: str) -> str or None:
+    """
+    Returns the registrable domain of `domain`, e.g. `example.co.uk` for `a.b.example.co.uk`.
+
+    This is an approximation of the public suffix list. The last two labels are taken, or the last three where the
+    top level domain is a country code and the second level is in `SECOND_LEVEL_LABELS`. IP addresses and single
+    label names have no registrable domain.
+    """
+    domain = normalise_domain(domain)
+
+    if not domain:
+        return None
+
+    try:
+        ipaddress.ip_address(domain)
+        return None
+    except ValueError:
+        pass
+
+    labels = domain.removeprefix('*.').split('.')
+    size = 3 if len(labels[-1]) == 2 and len(labels) > 2 and labels[-2] in SECOND_LEVEL_LABELS else 2
+
+    if len(labels) < size or not all(labels[-size:]):
+        return None
+
+    return '.'.join(labels[-size:])
+
+
+class CertificateIndex:
+    """
+    Lookup of parsed NPM certificates by every name they cover.
+
+    Certificates are keyed by their primary domain and by each SAN, so finding the certificates for a host is a
+    dictionary lookup on the host's domain and on the wildcard that would cover it, rather than a scan of every
+    certificate.
+    """
+    _by_name: dict = None
+    _by_id: dict = None
+    _by_nice_name: dict = None
+
+    def __init__(self, certs=()):
+        self._by_name = {}
+        self._by_id = {}
+        self._by_nice_name = {}
+
+        for cert in certs:
+            self.add(cert)
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __contains__(self, cert_id: int):
+        return cert_id in self._by_id
+
+    def __iter__(self):
+        return iter(list(self._by_id.values()))
+
+    @staticmethod
+    def names(cert: Certificate) -> list:
+        return [normalise_domain(name) for name in cert.domains if name]
+
+    def add(self, cert: Certificate) -> None:
+        self.remove(cert.id)
+        self._by_id[cert.id] = cert
+
+        for name in self.names(cert):
+            self._by_name.setdefault(name, {})[cert.id] = cert
+
+        if cert.nice_name:
+            self._by_nice_name.setdefault(cert.nice_name, {})[cert.id] = cert
+
+    def remove(self, cert_id: int) -> None:
+        cert = self._by_id.pop(cert_id, None)
+
+        if cert is None:
+            return
+
+        for name in self.names(cert):
+            certs = self._by_name.get(name, {})
+            certs.pop(cert_id, None)
+
+            if not certs:
+                self._by_name.pop(name, None)
+
+        certs = self._by_nice_name.get(cert.nice_name, {})
+        certs.pop(cert_id, None)
+
+        if not certs:
+            self._by_nice_name.pop(cert.nice_name, None)
+
+    def get(self, cert_id: int) -> Certificate or None:
+        return self._by_id.get(cert_id, None)
+
+    def named(self, nice_name: str) -> list:
+        """
+        All certificates with the given NPM nice name.
+        """
+        return list(self._by_nice_name.get(nice_name, {}).values())
+
+    def lookup(self, domain: str) -> list:
+        """
+        All certificates that cover `domain`, either by name or through a wildcard.
+        """
+        domain = normalise_domain(domain)
+
+        if not domain:
+            return []
+
+        certs = dict(self._by_name.get(domain, {}))
+
+        wildcard = wildcard_for(domain)
+        if wildcard:
+            certs.update(self._by_name.get(wildcard, {}))
+
+        return list(certs.values())
+
+    def covers(self, cert: Certificate, domain: str) -> bool:
+        names = self.names(cert)
+        domain = normalise_domain(domain)
+
+        if not domain:
+            return False
+
+        return domain in names or wildcard_for(domain) in names
+
+    def find(self, primary_domain: str, *sans: str) -> Certificate or None:
+        """
+        Finds a certificate that covers the primary domain and every SAN of a host.
+
+        A certificate issued for the same primary domain is preferred over one that only covers the host through a
+        SAN or a wildcard.
+
+        :param str primary_domain: Primary domain of the host.
+        :param str sans: Any additional domains of the host.
+        :return: The covering certificate, or None if there is none.
+        """
+        candidates = [
+            cert for cert in self.lookup(primary_domain) if all(self.covers(cert, san) for san in sans)
+        ]
+
+        if not candidates:
+            return None
+
+        primary_domain = normalise_domain(primary_domain)
+
+        return next(
+            (cert for cert in candidates if normalise_domain(cert.primary_domain) == primary_domain), candidates[0]
+        )
+
+
+class HostIndex:
+    """
+    Lookup of parsed NPM proxy hosts by the certificate attached to them and by primary domain.
+    """
+    _by_certificate: dict = None
+    _by_domain: dict = None
+
+    def __init__(self, hosts=()):
+        self._by_certificate = {}
+        self._by_domain = {}
+
+        for host in hosts:
+            if host.certificate_id:
+                self._by_certificate.setdefault(host.certificate_id, []).append(host)
+            if host.primary_domain:
+                self._by_domain.setdefault(normalise_domain(host.primary_domain), []).append(host)
+
+    def using_certificate(self, cert_id: int) -> list:
+        return self._by_certificate.get(cert_id, [])
+
+    def by_domain(self, domain: str) -> list:
+        return self._by_domain.get(normalise_domain(domain), []) if domain else []
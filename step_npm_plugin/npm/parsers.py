@@ -1,36 +1,192 @@
+import codecs
+import json
 from datetime import datetime, timezone
 
+from .records import ProxyHost, Certificate
 
-def parse_http_hosts(data: list):
-    hosts = []
-    for proxy_host in data:
+
+# Size of the chunks list responses are decoded in.
+CHUNK_SIZE = 64 * 1024
+
+
+class RecordCache:
+    """
+    Parsed records memoised by the `id` and `modified_on` of the raw NPM entry, plus any other fields given.
+
+    NPM bumps `modified_on` on every update, so an entry with the same key as last time parses to the same record, and
+    the record from last time is handed back instead. `modified_on` only has a resolution of a second, so fields that
+    may change within the same second as the entry was created, such as a proxy host's `certificate_id`, should be
+    part of the key as well.
+    """
+    _fields: tuple = None
+    _records: dict = None
+
+    def __init__(self, *fields: str):
+        self._fields = ('modified_on',) + fields
+        self._records = {}
+
+    def __len__(self):
+        return len(self._records)
+
+    def key(self, entry: dict) -> tuple:
+        return tuple(entry.get(field, None) for field in self._fields)
+
+    def parse(self, data, parser) -> list:
+        records = []
+
+        for entry in data:
+            key = self.key(entry)
+            cached = self._records.get(entry.get('id', None), None)
+
+            if cached is not None and key[0] is not None and cached[0] == key:
+                records.append(cached[1])
+                continue
+
+            record = parser(entry)
+            self._records[record.id] = (key, record)
+            records.append(record)
+
+        return records
+
+    def forget(self, ids) -> None:
+        for entry_id in ids:
+            self._records.pop(entry_id, None)
+
+
+def parse_npm_time(value: str) -> datetime:
+    """
+    An NPM timestamp as an aware UTC datetime. NPM stores times in UTC, so ones without an offset are read as UTC.
+    """
+    parsed = datetime.fromisoformat(value)
+
+    return parsed.replace(tzinfo=timezone.utc) if parsed.tzinfo is None else parsed.astimezone(timezone.utc)
+
+
+def parse_http_host(proxy_host: dict) -> ProxyHost:
+    try:
+        created_time = parse_npm_time(proxy_host['created_on'])
+    except (KeyError, TypeError, ValueError):
+        created_time = None
+
+    domain_names = proxy_host.get('domain_names', None) or [None]
+
+    return ProxyHost(
+        id=proxy_host.get('id', None),
+        primary_domain=domain_names[0],
+        sans=tuple(domain_names[1:]),
+        certificate_id=proxy_host.get('certificate_id', 0) or 0,
+        created_on=created_time,
+        modified_on=proxy_host.get('modified_on', None),
+        # Only present when the listing was requested with ?expand=certificate.
+        certificate_provider=(proxy_host.get('certificate', None) or {}).get('provider', None),
+    )
+
+
+def parse_certificate(certificate: dict) -> Certificate:
+    try:
+        expires = datetime.strptime(certificate['expires_on'], '%Y-%m-%dT%H:%M:%S.%fZ').replace(tzinfo=timezone.utc)
+    except (KeyError, TypeError, ValueError):
+        expires = None
+
+    try:
+        issued = parse_npm_time(certificate['modified_on'])
+    except (KeyError, TypeError, ValueError):
+        issued = None
+
+    domain_names = certificate.get('domain_names', None) or [None]
+
+    return Certificate(
+        id=certificate.get('id', None),
+        primary_domain=domain_names[0],
+        sans=tuple(domain_names[1:]),
+        expires=expires,
+        provider=certificate.get('provider', None),
+        modified_on=certificate.get('modified_on', None),
+        nice_name=certificate.get('nice_name', None),
+        issued=issued,
+    )
+
+
+def parse_http_hosts(data: list, cache: RecordCache = None) -> list:
+    if cache is None:
+        return [parse_http_host(proxy_host) for proxy_host in data]
+
+    return cache.parse(data, parse_http_host)
+
+
+def parse_certificates(data: list, cache: RecordCache = None) -> list:
+    if cache is None:
+        return [parse_certificate(certificate) for certificate in data]
+
+    return cache.parse(data, parse_certificate)
+
+
+def iter_json_array(chunks, encoding: str = 'utf-8'):
+    """
+    Decodes a JSON array from an iterable of byte chunks, yielding each element as soon as it is complete.
+
+    Only the element being decoded is held as text, rather than the whole response body as bytes and as text on top
+    of the decoded elements.
+
+    :param chunks: Iterable of bytes, such as `Response.iter_content()`.
+    :param str encoding: Encoding of the bytes.
+    :return: Generator of the decoded elements.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder(encoding)()
+    chunks = iter(chunks)
+    buffer = ''
+    position = 0
+    finished = False
+    started = False
+
+    def more() -> bool:
+        nonlocal buffer, position, finished
+
+        if finished:
+            return False
+
+        chunk = next(chunks, None)
+        if chunk is None:
+            finished = True
+            buffer = buffer[position:] + text_decoder.decode(b'', final=True)
+        else:
+            buffer = buffer[position:] + text_decoder.decode(chunk)
+        position = 0
+
+        return True
+
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+
+        if position >= len(buffer):
+            if more():
+                continue
+            raise ValueError('Unexpected end of JSON array.')
+
+        if not started:
+            if buffer[position] != '[':
+                raise ValueError(f'Expected a JSON array, found {buffer[position]!r}.')
+            started = True
+            position += 1
+            continue
+
+        if buffer[position] == ']':
+            return
 
         try:
-            created_time = datetime.fromisoformat(proxy_host['created_on']).astimezone(timezone.utc)
-        except ValueError:
-            created_time = None
-
-        host = {
-            'id': proxy_host.get('id', None),
-            'primary_domain': proxy_host.get('domain_names', [None])[0],
-            'sans': proxy_host.get('domain_names', [None])[1:],
-            'is_https': False if proxy_host.get('certificate_id', 0) == 0 else True,
-            'created_on': created_time
-        }
-
-        hosts.append(host)
-
-    return hosts
-
-
-def parse_certificates(data: list):
-    certs = []
-    for certificate in data:
-        cert = {
-            'id': certificate.get('id', None),
-            'primary_domain': certificate.get('domain_names', [None])[0],
-            'expires': datetime.strptime(certificate.get('expires_on'), '%Y-%m-%dT%H:%M:%S.%fZ')
-        }
-        certs.append(cert)
-
-    return certs
+            element, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if more():
+                continue
+            raise
+
+        # A number or literal is only complete once something other than itself follows it, otherwise it may carry on
+        # in the next chunk, as `1` of `1.5e3` does.
+        scalar = buffer[position] not in '{["'
+        if scalar and (end == len(buffer) or buffer[end] not in ' \t\r\n,]') and not finished and more():
+            continue
+
+        position = end
+        yield element
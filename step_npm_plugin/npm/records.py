@@ -0,0 +1,47 @@
+import dataclasses
+import datetime
+
+
+@dataclasses.dataclass(slots=True, frozen=True)
+class ProxyHost:
+    """
+    The parts of an NPM proxy host that the plugin works with. `created_on` is an aware UTC datetime.
+    """
+    id: int
+    primary_domain: str
+    sans: tuple
+    certificate_id: int
+    created_on: datetime.datetime or None
+    modified_on: str or None = None
+    certificate_provider: str or None = None
+
+    @property
+    def is_https(self) -> bool:
+        return self.certificate_id != 0
+
+    @property
+    def domains(self) -> tuple:
+        return (self.primary_domain, *self.sans)
+
+
+@dataclasses.dataclass(slots=True, frozen=True)
+class Certificate:
+    """
+    The parts of an NPM certificate that the plugin works with. `expires` is an aware UTC datetime, and None until a
+    certificate has been uploaded.
+
+    NPM does not keep the start of a certificate's validity. `issued` is when the certificate was last modified in NPM,
+    which for an uploaded certificate is when it was uploaded, as an aware UTC datetime.
+    """
+    id: int
+    primary_domain: str
+    sans: tuple
+    expires: datetime.datetime or None
+    provider: str or None = None
+    modified_on: str or None = None
+    nice_name: str or None = None
+    issued: datetime.datetime or None = None
+
+    @property
+    def domains(self) -> tuple:
+        return (self.primary_domain, *self.sans)
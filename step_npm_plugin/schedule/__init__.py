@@ -1 +1,3 @@
-from .timer import Timer
+from .cron import CronExpression
+from .renewal import RenewalQueue, RenewalPolicy
+from .scheduler import Scheduler
@@ -0,0 +1,141 @@
+import datetime
+
+
+ALIASES = {
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *',
+    '@monthly': '0 0 1 * *',
+    '@weekly': '0 0 * * 0',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@hourly': '0 * * * *',
+}
+
+# (name, minimum, maximum) of each field, seconds first. Seconds are optional in the expression.
+FIELDS = (
+    ('second', 0, 59),
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day', 1, 31),
+    ('month', 1, 12),
+    # 7 is Sunday as well as 0.
+    ('weekday', 0, 7),
+)
+
+# Cron expressions will not look further ahead than this for a matching time.
+MAX_YEARS = 5
+
+
+def parse_field(field: str, minimum: int, maximum: int) -> set:
+    """
+    Parses a single cron field such as `*`, `*/5`, `1-10/2` or `1,15,30` in to the set of values it matches.
+    """
+    values = set()
+
+    for part in field.split(','):
+        value_range, _, step = part.partition('/')
+
+        try:
+            step = int(step) if step else 1
+
+            if value_range == '*':
+                start, end = minimum, maximum
+            elif '-' in value_range:
+                start, end = (int(value) for value in value_range.split('-', 1))
+            else:
+                start = int(value_range)
+                end = maximum if step > 1 else start
+        except ValueError:
+            raise ValueError(f'Invalid cron field: {field}')
+
+        if step < 1 or start < minimum or end > maximum or start > end:
+            raise ValueError(f'Cron field {field} is out of range {minimum}-{maximum}.')
+
+        values.update(range(start, end + 1, step))
+
+    return values
+
+
+class CronExpression:
+    """
+    Cron style schedule, with an optional leading seconds field.
+
+    Supports `*`, ranges, steps, lists and the usual `@daily` style aliases. Weekdays run from 0 (Sunday) to 6, and
+    7 is also accepted for Sunday. Like Vixie cron, when both the day of month and the day of week are restricted a
+    day matches if either of them does. Times are evaluated in local time.
+    """
+    expression: str = None
+
+    _seconds: set = None
+    _minutes: set = None
+    _hours: set = None
+    _days: set = None
+    _months: set = None
+    _weekdays: set = None
+    _restricted_day: bool = False
+    _restricted_weekday: bool = False
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        fields = ALIASES.get(expression.strip(), expression).split()
+
+        if len(fields) == 5:
+            fields.insert(0, '0')
+        elif len(fields) != 6:
+            raise ValueError(f'Invalid cron expression {expression}. Expected 5 or 6 fields.')
+
+        for (name, minimum, maximum), field in zip(FIELDS, fields):
+            setattr(self, f'_{name}s', parse_field(field, minimum, maximum))
+
+        # Sunday is allowed as 7 too, so ranges such as `5-7` can end on it.
+        self._weekdays = {weekday % 7 for weekday in self._weekdays}
+
+        self._restricted_day = fields[3] != '*'
+        self._restricted_weekday = fields[5] != '*'
+
+    def _day_matches(self, dt: datetime.datetime) -> bool:
+        day = dt.day in self._days
+        # datetime weeks start on Monday (0), cron weeks on Sunday (0).
+        weekday = (dt.weekday() + 1) % 7 in self._weekdays
+
+        if self._restricted_day and self._restricted_weekday:
+            return day or weekday
+        return day and weekday
+
+    def next_after(self, timestamp: float) -> float:
+        """
+        The first time after `timestamp` that matches the expression.
+
+        :param float timestamp: Unix timestamp to start from.
+        :return: Unix timestamp of the next matching second.
+        """
+        dt = datetime.datetime.fromtimestamp(int(timestamp)) + datetime.timedelta(seconds=1)
+        limit = dt + datetime.timedelta(days=366 * MAX_YEARS)
+
+        while dt < limit:
+            if dt.month not in self._months:
+                dt = (dt.replace(day=1, hour=0, minute=0, second=0) + datetime.timedelta(days=32)).replace(day=1)
+                continue
+
+            if not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0, second=0) + datetime.timedelta(days=1)
+                continue
+
+            if dt.hour not in self._hours:
+                dt = dt.replace(minute=0, second=0) + datetime.timedelta(hours=1)
+                continue
+
+            if dt.minute not in self._minutes:
+                dt = dt.replace(second=0) + datetime.timedelta(minutes=1)
+                continue
+
+            if dt.second not in self._seconds:
+                dt += datetime.timedelta(seconds=1)
+                continue
+
+            return dt.timestamp()
+
+        raise ValueError(f'Cron expression {self.expression} does not match any time in the next {MAX_YEARS} years.')
+
+    def __repr__(self):
+        return f"<CronExpression '{self.expression}'>"
@@ -0,0 +1,181 @@
+import collections
+import datetime
+import heapq
+import itertools
+import random
+
+
+# Certificates with less than this fraction of their lifetime left are renewed straight away, past any rate limit.
+EMERGENCY_FRACTION = 0.1
+# Certificates whose lifetime is not known are renewed this long before they expire.
+UNKNOWN_LIFETIME_MARGIN = datetime.timedelta(hours=1)
+
+
+def check_aware(**times: datetime.datetime or None) -> None:
+    """
+    :raises ValueError: One of `times` is a naive datetime, which could be in any timezone.
+    """
+    for name, when in times.items():
+        if when is not None and when.tzinfo is None:
+            raise ValueError(f'Renewal time {name} at {when} has no timezone.')
+
+
+class RenewalQueue:
+    """
+    Priority queue of certificates ordered by their renewal deadline, as aware UTC datetimes. Naive datetimes are
+    refused.
+
+    Pushing a certificate that is already queued replaces its deadline. Replaced and removed entries are left in the
+    heap and skipped when they reach the top, so every update is O(log n) and popping the due certificates is
+    O(due · log n) no matter how many certificates are queued.
+    """
+    _heap: list = None
+    _deadlines: dict = None
+    _counter: itertools.count = None
+
+    def __init__(self):
+        self._heap = []
+        self._deadlines = {}
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, cert_id: int):
+        return cert_id in self._deadlines
+
+    def push(self, cert_id: int, deadline: datetime.datetime) -> None:
+        """
+        Queues a certificate for renewal, or moves its deadline if it is already queued.
+        """
+        check_aware(deadline=deadline)
+        self._deadlines[cert_id] = deadline
+        heapq.heappush(self._heap, (deadline, next(self._counter), cert_id))
+        self._compact()
+
+    def remove(self, cert_id: int) -> None:
+        self._deadlines.pop(cert_id, None)
+
+    def deadline(self, cert_id: int) -> datetime.datetime or None:
+        return self._deadlines.get(cert_id, None)
+
+    def peek(self) -> datetime.datetime or None:
+        """
+        The earliest renewal deadline in the queue, or None if the queue is empty.
+        """
+        self._discard_stale()
+
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: datetime.datetime) -> list:
+        """
+        Removes and returns the IDs of every certificate whose deadline has passed, earliest first.
+        """
+        check_aware(now=now)
+        due = []
+
+        while True:
+            self._discard_stale()
+
+            if not self._heap or self._heap[0][0] > now:
+                break
+
+            deadline, _, cert_id = heapq.heappop(self._heap)
+            del self._deadlines[cert_id]
+            due.append(cert_id)
+
+        return due
+
+    def _is_stale(self, entry: tuple) -> bool:
+        deadline, _, cert_id = entry
+        return self._deadlines.get(cert_id, None) != deadline
+
+    def _discard_stale(self) -> None:
+        while self._heap and self._is_stale(self._heap[0]):
+            heapq.heappop(self._heap)
+
+    def _compact(self) -> None:
+        # Rebuild once stale entries outnumber live ones, to keep the heap from growing without bound.
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._heap = [entry for entry in self._heap if not self._is_stale(entry)]
+            heapq.heapify(self._heap)
+
+
+class RenewalPolicy:
+    """
+    When certificates fall due for renewal, and how many renewals may start at a time.
+
+    A certificate falls due once `fraction` of its lifetime has passed, plus a random offset of up to `window`, so
+    certificates issued together do not all fall due together. The offset is kept within the first half of the time
+    left after `fraction`, however short the certificate. With a `rate_limit`, at most that many renewals start per
+    minute and the rest wait for a free slot, unless less than `EMERGENCY_FRACTION` of their lifetime is left.
+
+    Times are aware UTC datetimes, as `Certificate.expires` is. Naive datetimes are refused with a ValueError, as they
+    could be in any timezone.
+    """
+    fraction: float = 2 / 3
+    window: datetime.timedelta = None
+    rate_limit: int = 0
+
+    _started: collections.deque = None
+
+    def __init__(self, fraction: float = 2 / 3, window: datetime.timedelta = None, rate_limit: int = 0):
+        if not 0 < fraction < 1 - EMERGENCY_FRACTION:
+            raise ValueError(f'Invalid renewal fraction {fraction}, expected more than 0 and less than '
+                             f'{1 - EMERGENCY_FRACTION:g}.')
+
+        self.fraction = fraction
+        self.window = window or datetime.timedelta(0)
+        self.rate_limit = rate_limit
+        self._started = collections.deque()
+
+    def deadline(self, issued: datetime.datetime or None, expires: datetime.datetime) -> datetime.datetime:
+        """
+        When a certificate issued at `issued` and expiring at `expires` falls due for renewal.
+        """
+        check_aware(issued=issued, expires=expires)
+
+        if issued is None or issued >= expires:
+            return expires - UNKNOWN_LIFETIME_MARGIN
+
+        lifetime = expires - issued
+        window = min(self.window, lifetime * (1 - self.fraction) / 2)
+
+        return issued + lifetime * self.fraction + window * random.random()
+
+    @staticmethod
+    def is_emergency(issued: datetime.datetime or None, expires: datetime.datetime, now: datetime.datetime) -> bool:
+        check_aware(issued=issued, expires=expires, now=now)
+
+        if issued is None or issued >= expires:
+            return expires - now <= UNKNOWN_LIFETIME_MARGIN
+
+        return expires - now <= (expires - issued) * EMERGENCY_FRACTION
+
+    def admit(self, now: datetime.datetime, emergency: bool = False) -> bool:
+        """
+        Takes a slot for a renewal starting at `now`, if one is free within the rate limit.
+
+        Emergency renewals always get a slot, but still use one up.
+        """
+        check_aware(now=now)
+
+        while self._started and self._started[0] <= now - datetime.timedelta(minutes=1):
+            self._started.popleft()
+
+        if self.rate_limit and not emergency and len(self._started) >= self.rate_limit:
+            return False
+
+        self._started.append(now)
+        return True
+
+    def next_slot(self, now: datetime.datetime) -> datetime.datetime:
+        """
+        When the next slot within the rate limit frees up.
+        """
+        check_aware(now=now)
+
+        if not self.rate_limit or len(self._started) < self.rate_limit:
+            return now
+
+        return self._started[-self.rate_limit] + datetime.timedelta(minutes=1)
@@ -0,0 +1,144 @@
+import asyncio
+import datetime
+import logging
+import time
+
+from step_npm_plugin.schedule.cron import CronExpression
+from step_npm_plugin.schedule.parser import parse_time
+
+
+logger = logging.getLogger('console')
+
+
+class Scheduler:
+    """
+    Sleeps until the next deadline rather than polling.
+
+    The regular sync is driven by the schedule, which is either a `parse_time` interval such as `10s` or a cron
+    expression. Other components can register their own named deadlines, such as the next renewal that falls due, and
+    `wait()` returns at whichever deadline comes first, to sub-second precision. `wake()` cuts the sleep short, and
+    is safe to call from other threads or signal handlers.
+    """
+    schedule: str = None
+
+    _interval: float = None
+    _cron: CronExpression = None
+    _next_sync: float = None
+    _deadlines: dict = None
+    _event: asyncio.Event = None
+    _loop: asyncio.AbstractEventLoop = None
+    _runs: int = 0
+    _skipped_runs: int = 0
+
+    def __init__(self, schedule: str, run_immediately: bool = True):
+        self._deadlines = {}
+        self.set_schedule(schedule, run_immediately)
+
+    def set_schedule(self, schedule: str, run_immediately: bool = True) -> None:
+        self.schedule = schedule
+
+        if len(schedule.split()) > 1 or schedule.startswith('@'):
+            self._cron = CronExpression(schedule)
+            self._interval = None
+        else:
+            self._interval = parse_time(schedule)
+            self._cron = None
+
+        now = time.time()
+        self._next_sync = now if run_immediately else self._following_sync(now)
+
+    def _following_sync(self, after: float) -> float:
+        if self._cron:
+            return self._cron.next_after(after)
+
+        if self._next_sync is None:
+            return after + self._interval
+
+        # Keep to the original cadence, skipping any runs that were missed while a cycle overran.
+        missed = int((after - self._next_sync) // self._interval) + 1 if after >= self._next_sync else 0
+        self._skipped_runs += max(missed - 1, 0)
+
+        return self._next_sync + max(missed, 1) * self._interval
+
+    def set_deadline(self, name: str, when: datetime.datetime or float or None) -> None:
+        """
+        Registers, moves or clears (with None) a named deadline.
+
+        :param str name: Name of the deadline, e.g. `renewal`.
+        :param when: Unix timestamp or aware datetime to wake up at.
+        :raises ValueError: `when` is a naive datetime, which could be in any timezone.
+        :return:
+        """
+        if when is None:
+            self._deadlines.pop(name, None)
+            return
+
+        if isinstance(when, datetime.datetime) and when.tzinfo is None:
+            raise ValueError(f'Deadline {name} at {when} has no timezone.')
+
+        self._deadlines[name] = when.timestamp() if isinstance(when, datetime.datetime) else when
+
+    @property
+    def next_deadline(self) -> tuple[float, str]:
+        """
+        The earliest deadline, as a timestamp and the name of the deadline.
+        """
+        return min([(when, name) for name, when in self._deadlines.items()] + [(self._next_sync, 'sync')])
+
+    def wake(self) -> None:
+        """
+        Ends the current `wait()` straight away.
+        """
+        if self._loop is None:
+            return
+
+        self._loop.call_soon_threadsafe(self._event.set)
+
+    async def wait(self) -> str:
+        """
+        Sleeps until the next deadline, or until woken.
+
+        :return: Name of the deadline that was reached, or `wake` if woken early.
+        """
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            self._event = asyncio.Event()
+
+        while True:
+            when, name = self.next_deadline
+            delay = when - time.time()
+
+            if delay <= 0:
+                break
+
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                continue
+
+            self._event.clear()
+            name = 'wake'
+            break
+
+        now = time.time()
+
+        if now >= self._next_sync:
+            self._next_sync = self._following_sync(now)
+
+        for deadline, when in list(self._deadlines.items()):
+            if when <= now:
+                del self._deadlines[deadline]
+
+        self._runs += 1
+        next_sync = datetime.datetime.fromtimestamp(self._next_sync, datetime.timezone.utc)
+        logger.debug('Scheduler woke for %s, next sync at %s.', name, next_sync)
+
+        return name
+
+    @property
+    def runs(self) -> int:
+        return self._runs
+
+    @property
+    def skipped(self) -> int:
+        return self._skipped_runs
@@ -1,3 +1,8 @@
+from .cache import CertificateCache
 from .certificate import StepCertificate
 from .client import StepClient
-from .exceptions import GenericStepError, NotBootstrapped
+from .exceptions import GenericStepError, CAUnavailable, NotBootstrapped, SigningError
+from .health import CAHealth
+from .keys import KeyPool, KEY_TYPES
+from .native import NativeStepClient
+from .pool import IssuancePool, IssuanceJob, IssuanceResult
@@ -0,0 +1,98 @@
+import collections
+import datetime
+import logging
+import threading
+
+from step_npm_plugin.metrics import CERTIFICATE_CACHE
+from step_npm_plugin.step.certificate import StepCertificate
+
+
+logger = logging.getLogger('console')
+
+# Cached certificates are only handed out again while at least this fraction of their lifetime is left, so a reused
+# certificate is not due for renewal straight away.
+MIN_REMAINING_LIFETIME = 0.5
+
+
+def _normalise(name: str) -> str:
+    return name.strip().rstrip('.').lower()
+
+
+class CertificateCache:
+    """
+    Recently issued certificates, by the names they cover and their key type.
+
+    When a certificate is deleted and created again in NPM, or the same names turn up on another host or NPM instance,
+    the certificate issued for them earlier is handed out again rather than asking the CA for another one. Entries are
+    dropped once less than `MIN_REMAINING_LIFETIME` of their lifetime is left, and the least recently used entry is
+    dropped once there are more than `max_entries`.
+
+    Certificates and keys are only kept in memory.
+    """
+    max_entries: int = 256
+    hits: int = 0
+    misses: int = 0
+
+    _entries: collections.OrderedDict = None
+    _lock: threading.Lock = None
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(common_name: str, sans, key_type: str) -> tuple:
+        """
+        Cache key of a certificate, the same for any order or case of the SANs.
+        """
+        common_name = _normalise(common_name)
+        return common_name, tuple(sorted({_normalise(san) for san in sans if san} - {common_name})), key_type
+
+    @staticmethod
+    def _reusable(certificate: StepCertificate, now: datetime.datetime) -> bool:
+        lifetime = certificate.not_after - certificate.not_before
+        return certificate.not_after - now >= lifetime * MIN_REMAINING_LIFETIME
+
+    def get(self, key: tuple) -> StepCertificate or None:
+        """
+        The cached certificate for `key`, if there is one with enough of its lifetime left.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+
+        with self._lock:
+            certificate = self._entries.get(key, None)
+
+            if certificate is not None and not self._reusable(certificate, now):
+                del self._entries[key]
+                certificate = None
+
+            if certificate is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+
+        CERTIFICATE_CACHE.labels('hit' if certificate is not None else 'miss').inc()
+
+        return certificate
+
+    def put(self, key: tuple, certificate: StepCertificate) -> None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+
+        with self._lock:
+            self._entries[key] = certificate
+            self._entries.move_to_end(key)
+
+            # Drop anything past its useful life first, then the least recently used.
+            for stale in [k for k, cached in self._entries.items() if not self._reusable(cached, now)]:
+                del self._entries[stale]
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -1,8 +1,12 @@
+import datetime
+import hashlib
 import logging
 import pathlib
+import ssl
 
 from cryptography import x509
 from cryptography.x509 import Certificate
+from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.serialization import (
     load_pem_private_key, Encoding, PrivateFormat, NoEncryption
 )
@@ -12,61 +16,158 @@ from cryptography.hazmat.primitives.asymmetric.types import PRIVATE_KEY_TYPES
 logger = logging.getLogger('console')
 
 
+PEM_END_CERTIFICATE = b'-----END CERTIFICATE-----'
+
+
+def split_pem_chain(chain: bytes) -> list:
+    """
+    Splits a PEM certificate chain in to the PEM of each certificate, without decoding any of them.
+    """
+    certificates = []
+    start = 0
+
+    while True:
+        end = chain.find(PEM_END_CERTIFICATE, start)
+        if end == -1:
+            break
+
+        end += len(PEM_END_CERTIFICATE)
+        certificates.append(chain[start:end].strip() + b'\n')
+        start = end
+
+    return certificates
+
+
+def root_matches(root_file: pathlib.Path, fingerprint: str) -> bool:
+    """
+    Whether `root_file` holds a PEM certificate with the given SHA-256 fingerprint. Does not need the certificate to be
+    parsed, so it is cheap enough to check on every start.
+    """
+    try:
+        der = ssl.PEM_cert_to_DER_cert(root_file.read_text())
+    except (OSError, ValueError):
+        return False
+
+    return hashlib.sha256(der).hexdigest() == fingerprint.replace(':', '').lower()
+
+
 class StepCertificate:
-    certificate = None
-    intermediate = None
-    private_key = None
+    """
+    An issued certificate, its intermediate chain and its private key.
+
+    The PEM as issued is kept and handed on to NPM as is. The `cryptography` objects are only loaded when something
+    inspects the certificate, such as `fingerprint` or `not_after`, and then only once. Likewise, a certificate created
+    from objects is only serialised to PEM once.
+    """
+    _certificate: Certificate = None
+    _intermediates: list = None
+    _private_key: PRIVATE_KEY_TYPES = None
+    _chain_pem: list = None
+    _key_pem: bytes = None
 
     def __init__(
-            self, certificate: Certificate, certificate_key: PRIVATE_KEY_TYPES or None,
-            intermediates: list[Certificate] = None,
+            self, certificate: Certificate = None, certificate_key: PRIVATE_KEY_TYPES or None = None,
+            intermediates: list[Certificate] = None, chain_pem: bytes = None, key_pem: bytes = None
     ):
-        self.certificate = certificate
-        self.intermediates = intermediates
-        self.private_key = certificate_key
+        self._certificate = certificate
+        self._intermediates = intermediates
+        self._private_key = certificate_key
+        self._chain_pem = split_pem_chain(chain_pem) if chain_pem else None
+        self._key_pem = key_pem
+
+        if self._certificate is None and not self._chain_pem:
+            raise ValueError('A certificate or a PEM certificate chain is required.')
+
+    @classmethod
+    def from_pem(cls, certificate: bytes, certificate_key: bytes or None, private_key: PRIVATE_KEY_TYPES = None):
+        """
+        Creates a certificate instance from a PEM certificate chain and PEM private key. Nothing is decoded until it
+        is needed.
+
+        :param bytes certificate: PEM encoded certificate, optionally followed by its intermediate chain.
+        :param bytes certificate_key: PEM encoded private key.
+        :param private_key: The private key, if already loaded, so it does not have to be decoded again.
+        :return: StepCertificate
+        """
+        return cls(certificate_key=private_key, chain_pem=certificate, key_pem=certificate_key or None)
 
     @classmethod
     def from_file(cls, certificate: pathlib.Path, certificate_key: pathlib.Path):
         with open(certificate, 'rb') as f:
-            cert = []
-            cert_list = []
+            cert_chain = f.read()
+
+        with open(certificate_key, 'rb') as f:
+            private_key = f.read()
 
-            for line in f.readlines():
-                cert.append(line)
-                if line.startswith(b'-----END CERTIFICATE-----'):
-                    cert_list.append(b''.join(cert))
-                    cert.clear()
+        logger.debug('Created certificate instance from %s and %s files.', certificate, certificate_key)
 
-        web_cert = x509.load_pem_x509_certificate(cert_list.pop(0))
-        intermediates = []
+        return cls.from_pem(cert_chain, private_key)
 
-        if len(cert_list) > 0:
-            logger.debug('Certificate contains an intermediate chain - importing...')
-            for cert in cert_list:
-                intermediates.append(x509.load_pem_x509_certificate(cert))
+    @property
+    def certificate(self) -> Certificate:
+        if self._certificate is None:
+            self._certificate = x509.load_pem_x509_certificate(self._chain_pem[0])
+        return self._certificate
 
-        with open(certificate_key, 'rb') as f:
-            private_key = load_pem_private_key(f.read(), None)
+    @property
+    def intermediates(self) -> list[Certificate]:
+        if self._intermediates is None:
+            self._intermediates = [x509.load_pem_x509_certificate(pem) for pem in (self._chain_pem or [])[1:]]
+        return self._intermediates
 
-        logger.debug(f'Created certificate instance from {certificate} and {certificate_key} files.')
+    @property
+    def private_key(self) -> PRIVATE_KEY_TYPES or None:
+        if self._private_key is None and self._key_pem:
+            self._private_key = load_pem_private_key(self._key_pem, None)
+        return self._private_key
 
-        return cls(web_cert, private_key, intermediates=intermediates)
+    @private_key.setter
+    def private_key(self, private_key: PRIVATE_KEY_TYPES or None) -> None:
+        self._private_key = private_key
+        self._key_pem = None
 
     @property
     def is_pair(self):
-        return True if self.certificate and self.private_key else False
+        return True if (self._certificate or self._chain_pem) and (self._private_key or self._key_pem) else False
+
+    @property
+    def fingerprint(self) -> str:
+        return self.certificate.fingerprint(hashes.SHA256()).hex()
+
+    @property
+    def not_before(self) -> datetime.datetime:
+        return self.certificate.not_valid_before.replace(tzinfo=datetime.timezone.utc)
+
+    @property
+    def not_after(self) -> datetime.datetime:
+        return self.certificate.not_valid_after.replace(tzinfo=datetime.timezone.utc)
+
+    def _chain(self) -> list:
+        if self._chain_pem is None:
+            certificates = [self._certificate, *(self._intermediates or [])]
+            self._chain_pem = [certificate.public_bytes(Encoding.PEM) for certificate in certificates]
+        return self._chain_pem
+
+    @property
+    def certificate_bytes(self) -> bytes:
+        return self._chain()[0]
 
     @property
-    def certificate_bytes(self):
-        return self.certificate.public_bytes(Encoding.PEM)
+    def intermediate_bytes(self) -> bytes:
+        return b''.join(self._chain()[1:])
 
     @property
-    def intermediate_bytes(self):
-        return b'\n'.join([intermediate.public_bytes(Encoding.PEM) for intermediate in self.intermediates])
+    def chain_bytes(self) -> bytes:
+        """
+        The certificate followed by its intermediates, as NPM expects it to be uploaded.
+        """
+        return b''.join(self._chain())
 
     @property
-    def private_key_bytes(self):
-        return self.private_key.private_bytes(Encoding.PEM, PrivateFormat.PKCS8, NoEncryption())
+    def private_key_bytes(self) -> bytes or None:
+        if self._key_pem is None and self._private_key is not None:
+            self._key_pem = self._private_key.private_bytes(Encoding.PEM, PrivateFormat.PKCS8, NoEncryption())
+        return self._key_pem
 
     def __repr__(self):
         return f"<StepCertificate {self.certificate.__repr__()}, {self.private_key.__repr__()}>"
@@ -1,12 +1,42 @@
+import atexit
+import json
 import logging
+import os
 import pathlib
+import shlex
+import shutil
 import subprocess
+import tempfile
+import time
 
+from cryptography.hazmat.primitives.serialization import Encoding, load_pem_private_key
+
+from step_npm_plugin.metrics import STEP_SUBPROCESS_SECONDS, STEP_SUBPROCESS_FAILURES
+from step_npm_plugin.step.certificate import StepCertificate, root_matches
 from step_npm_plugin.step.exceptions import GenericStepError, NotBootstrapped, ProcessError
+from step_npm_plugin.step.keys import KeyPool, create_csr
 
 
 logger = logging.getLogger('console')
 
+# Memory backed locations for the files step-cli has to write, tried before the system temp directory.
+WORK_DIR_CANDIDATES = ('/dev/shm',)
+
+
+def private_work_dir() -> pathlib.Path:
+    """
+    Creates a directory that only the current user can access, on tmpfs where available, for step-cli to write
+    certificates and keys to. It is removed when the process exits.
+    """
+    for candidate in (*WORK_DIR_CANDIDATES, tempfile.gettempdir()):
+        if os.path.isdir(candidate) and os.access(candidate, os.W_OK | os.X_OK):
+            break
+
+    path = pathlib.Path(tempfile.mkdtemp(prefix='step-npm-', dir=candidate))
+    atexit.register(shutil.rmtree, path, ignore_errors=True)
+
+    return path
+
 
 class StepClient:
     """
@@ -21,28 +51,102 @@ class StepClient:
     ca_port: int = 9000
     ca_fingerprint: str = None
     provisioner_pass_file: pathlib.Path = None
+    key_pool: KeyPool = None
+    work_dir: pathlib.Path = None
 
     ca_url = None
     _bootstrapped = False
 
     def __init__(self, ca_scheme: str, ca_domain: str, ca_port: int, ca_fingerprint: str,
-                 provisioner_pass_file: pathlib.Path):
+                 provisioner_pass_file: pathlib.Path, key_pool: KeyPool = None, work_dir: pathlib.Path = None):
         self.ca_scheme = ca_scheme
         self.ca_domain = ca_domain
         self.ca_port = ca_port
         self.ca_fingerprint = ca_fingerprint
         self.provisioner_pass_file = provisioner_pass_file
+        self.key_pool = key_pool
+        self.work_dir = work_dir or private_work_dir()
 
         self._build_ca_url()
 
+    @property
+    def key_type(self) -> str:
+        """
+        Type of the keys certificates are issued with, pooled keys or else step-cli's default.
+        """
+        return self.key_pool.key_type if self.key_pool is not None else 'EC-P256'
+
     def _build_ca_url(self):
         self.ca_url = f"{self.ca_scheme}://{self.ca_domain}:{self.ca_port}"
 
-    def bootstrap(self):
+    @staticmethod
+    def _run(commands: list, timeout: float = None) -> subprocess.CompletedProcess:
+        """
+        Runs a step-cli command, recording how long it took and whether it failed.
+
+        :param list commands: The command and its arguments, e.g. `['step', 'ca', 'health']`.
+        :param float timeout: Seconds to wait before the process is killed and `TimeoutExpired` raised.
+        :return: The completed process.
+        """
+        command = " ".join(commands[1:3])
+        started = time.perf_counter()
+
+        try:
+            process = subprocess.run(
+                " ".join(shlex.quote(argument) for argument in commands), stderr=subprocess.PIPE,
+                stdout=subprocess.PIPE, shell=True, timeout=timeout
+            )
+        except subprocess.TimeoutExpired:
+            STEP_SUBPROCESS_FAILURES.labels(command, 'timeout').inc()
+            raise
+        finally:
+            STEP_SUBPROCESS_SECONDS.labels(command).observe(time.perf_counter() - started)
+
+        if process.returncode != 0:
+            STEP_SUBPROCESS_FAILURES.labels(command, 'exit_code').inc()
+
+        return process
+
+    @property
+    def step_path(self) -> pathlib.Path:
+        """
+        Where step-cli keeps its configuration, `$STEPPATH` or else `~/.step`.
+        """
+        return pathlib.Path(os.environ.get('STEPPATH', None) or pathlib.Path.home() / '.step')
+
+    def is_bootstrapped(self) -> bool:
+        """
+        Whether step-cli was already bootstrapped against this CA: its defaults point at the same CA URL and
+        fingerprint, and the root certificate they point at still has that fingerprint.
+        """
+        try:
+            defaults = json.loads((self.step_path / 'config' / 'defaults.json').read_text())
+        except (OSError, ValueError):
+            return False
+
+        if not isinstance(defaults, dict) or defaults.get('ca-url', None) != self.ca_url:
+            return False
+
+        if (defaults.get('fingerprint', None) or '').lower() != self.ca_fingerprint.lower():
+            return False
+
+        return bool(defaults.get('root', None)) and root_matches(pathlib.Path(defaults['root']), self.ca_fingerprint)
+
+    def bootstrap(self, force: bool = False):
+        """
+        Bootstraps step-cli against the CA, unless a previous run already did and `force` is not set.
+
+        :return: The completed `step ca bootstrap` process, or None if it was skipped.
+        """
+        if not force and self.is_bootstrapped():
+            logger.info(f'step-cli is already bootstrapped for {self.ca_url}, skipping bootstrap.')
+            self._bootstrapped = True
+            return None
+
         commands = [
             'step', 'ca', 'bootstrap', '--ca-url', self.ca_url, '--fingerprint', self.ca_fingerprint, '--force'
         ]
-        process = subprocess.run(" ".join(commands), stderr=subprocess.PIPE, stdout=subprocess.PIPE, shell=True)
+        process = self._run(commands)
 
         if not process.returncode == 0:
             raise GenericStepError(process.stderr.decode('utf-8'))
@@ -50,18 +154,38 @@ class StepClient:
         self._bootstrapped = True
         return process
 
-    def get_ca_health(self):
+    def get_ca_health(self, timeout: float = None) -> subprocess.CompletedProcess:
         if not self._bootstrapped:
             raise NotBootstrapped("Client has not yet been bootstrapped.")
 
         commands = ['step', 'ca', 'health']
-        process = subprocess.run(" ".join(commands), stderr=subprocess.PIPE, stdout=subprocess.PIPE, shell=True)
+        process = self._run(commands, timeout=timeout)
 
         return process
 
+    def check_health(self, timeout: float = None) -> bool:
+        """
+        Whether `step ca health` reports the CA as up, see `get_ca_health`.
+        """
+        try:
+            process = self.get_ca_health(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return False
+
+        return process.returncode == 0 and process.stdout.strip() == b'ok'
+
     def create_certificate(
-            self, common_name: str, *sans: str, not_before: str = None, not_after: str = None
+            self, common_name: str, *sans: str, not_before: str = None, not_after: str = None, timeout: float = None,
+            directory: pathlib.Path = None
     ) -> tuple[pathlib.Path, pathlib.Path]:
+        """
+        Has step-cli generate a key and certificate with `step ca certificate`.
+
+        :param pathlib.Path directory: Where step-cli writes the files, defaults to `work_dir`.
+        :return: Paths of the certificate chain and the private key.
+        """
+        directory = directory or self.work_dir
+
         if not self._bootstrapped:
             raise NotBootstrapped("Client has not yet been bootstrapped.")
 
@@ -83,18 +207,162 @@ class StepClient:
         commands.append(self.provisioner_pass_file.absolute().__str__())
         commands.append('--force')
 
+        crt_file = (directory / 'certificate.crt').absolute()
+        key_file = (directory / 'certificate.key').absolute()
+
         commands.append(common_name)
-        commands.append(common_name + '.crt')
-        commands.append(common_name + '.key')
+        commands.append(crt_file.__str__())
+        commands.append(key_file.__str__())
 
-        process = subprocess.run(" ".join(commands), stderr=subprocess.PIPE, stdout=subprocess.PIPE, shell=True)
+        try:
+            process = self._run(commands, timeout)
+        except subprocess.TimeoutExpired:
+            logger.debug('Run for %s timed out after %s seconds.', common_name, timeout)
+            raise ProcessError(f'Run for {common_name} timed out after {timeout} seconds.')
 
-        logger.debug(f'Process run')
+        logger.debug('Process run')
 
         if process.returncode != 0:
-            logger.debug(f'Run failed with error: {process.stderr.decode("utf-8")}')
+            logger.debug('Run failed with error: %s', process.stderr.decode("utf-8"))
             raise ProcessError(f'Run failed with error: {process.stderr.decode("utf-8")}')
 
-        return (
-            pathlib.Path('./' + common_name + '.crt').absolute(), pathlib.Path('./' + common_name + '.key').absolute()
-        )
+        return crt_file, key_file
+
+    def sign_certificate_request(
+            self, csr_file: pathlib.Path, crt_file: pathlib.Path, not_before: str = None, not_after: str = None,
+            timeout: float = None
+    ) -> pathlib.Path:
+        """
+        Has the CA sign an existing CSR with `step ca sign`, the private key never reaches step-cli.
+
+        :param pathlib.Path csr_file: PEM encoded CSR.
+        :param pathlib.Path crt_file: Where step-cli writes the certificate chain.
+        :return: Path of the certificate chain.
+        """
+        if not self._bootstrapped:
+            raise NotBootstrapped("Client has not yet been bootstrapped.")
+
+        commands = ['step', 'ca', 'sign']
+
+        if not_before:
+            commands.append('--not-before')
+            commands.append(not_before)
+
+        if not_after:
+            commands.append('--not-after')
+            commands.append(not_after)
+
+        commands.append('--provisioner-password-file')
+        commands.append(self.provisioner_pass_file.absolute().__str__())
+        commands.append('--force')
+
+        commands.append(csr_file.__str__())
+        commands.append(crt_file.__str__())
+
+        try:
+            process = self._run(commands, timeout)
+        except subprocess.TimeoutExpired:
+            logger.debug('Signing %s timed out after %s seconds.', csr_file, timeout)
+            raise ProcessError(f'Signing {csr_file} timed out after {timeout} seconds.')
+
+        if process.returncode != 0:
+            logger.debug('Run failed with error: %s', process.stderr.decode("utf-8"))
+            raise ProcessError(f'Run failed with error: {process.stderr.decode("utf-8")}')
+
+        return crt_file
+
+    def issue_certificate(self, common_name: str, *sans: str, timeout: float = None) -> StepCertificate:
+        """
+        Creates a certificate and key pair and loads it as a `StepCertificate`.
+
+        With a key pool, the key is taken from the pool and only a CSR is passed to `step ca sign`. Otherwise
+        `step ca certificate` generates the key. Files step-cli needs are kept in a directory of their own under
+        `work_dir`, which is removed as soon as the PEM has been read back.
+
+        :param str common_name: Common name of the certificate.
+        :param str sans: Additional SANs for the certificate.
+        :param float timeout: Seconds to wait for step-cli before giving up.
+        :return: The issued certificate and key.
+        """
+        directory = pathlib.Path(tempfile.mkdtemp(dir=self.work_dir))
+
+        try:
+            if self.key_pool is None:
+                crt_file, key_file = self.create_certificate(
+                    common_name, *sans, timeout=timeout, directory=directory
+                )
+                return StepCertificate.from_pem(crt_file.read_bytes(), key_file.read_bytes())
+
+            key_pem = self.key_pool.get_pem()
+            private_key = load_pem_private_key(key_pem, None)
+            csr = create_csr(common_name, list(dict.fromkeys([common_name, *sans])), private_key)
+
+            csr_file = directory / 'certificate.csr'
+            csr_file.write_bytes(csr.public_bytes(Encoding.PEM))
+
+            crt_file = self.sign_certificate_request(csr_file, directory / 'certificate.crt', timeout=timeout)
+
+            return StepCertificate.from_pem(crt_file.read_bytes(), key_pem, private_key)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def renew_certificate(
+            self, certificate: StepCertificate, reuse_key: bool = False, timeout: float = None
+    ) -> StepCertificate:
+        """
+        Renews a certificate that is still valid, authenticating to the CA with the certificate itself over mTLS rather
+        than with the provisioner password. The renewed certificate covers the same names.
+
+        With `reuse_key`, `step ca renew` keeps the current key, so no key is generated at all. Otherwise
+        `step ca rekey` has it signed for a new key, taken from the key pool if there is one.
+
+        :param StepCertificate certificate: The certificate to renew, with its private key.
+        :param bool reuse_key: Whether the renewed certificate keeps the current key.
+        :param float timeout: Seconds to wait for step-cli before giving up.
+        :return: The renewed certificate and its key.
+        """
+        if not self._bootstrapped:
+            raise NotBootstrapped("Client has not yet been bootstrapped.")
+
+        directory = pathlib.Path(tempfile.mkdtemp(dir=self.work_dir))
+
+        try:
+            crt_file = directory / 'current.crt'
+            key_file = directory / 'current.key'
+            crt_file.write_bytes(certificate.chain_bytes)
+            key_file.write_bytes(certificate.private_key_bytes)
+
+            new_crt_file = directory / 'certificate.crt'
+            new_key_file = directory / 'certificate.key'
+            key_pem = None
+
+            if reuse_key:
+                commands = ['step', 'ca', 'renew', '--out', new_crt_file.__str__()]
+                key_pem = certificate.private_key_bytes
+            else:
+                commands = [
+                    'step', 'ca', 'rekey', '--out-cert', new_crt_file.__str__(), '--out-key', new_key_file.__str__()
+                ]
+
+                if self.key_pool is not None:
+                    key_pem = self.key_pool.get_pem()
+                    (directory / 'pooled.key').write_bytes(key_pem)
+                    commands.append('--private-key')
+                    commands.append((directory / 'pooled.key').__str__())
+
+            commands.append('--force')
+            commands.append(crt_file.__str__())
+            commands.append(key_file.__str__())
+
+            try:
+                process = self._run(commands, timeout)
+            except subprocess.TimeoutExpired:
+                raise ProcessError(f'Renewing {crt_file} timed out after {timeout} seconds.')
+
+            if process.returncode != 0:
+                logger.debug('Run failed with error: %s', process.stderr.decode("utf-8"))
+                raise ProcessError(f'Run failed with error: {process.stderr.decode("utf-8")}')
+
+            return StepCertificate.from_pem(new_crt_file.read_bytes(), key_pem or new_key_file.read_bytes())
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
@@ -19,3 +19,17 @@ class ProcessError(GenericStepError):
     Error with running Step-CLI
     """
     pass
+
+
+class SigningError(GenericStepError):
+    """
+    Step CA refused, or failed, to sign a certificate request.
+    """
+    pass
+
+
+class CAUnavailable(GenericStepError):
+    """
+    Issuance was not attempted, as Step CA is known to be down.
+    """
+    pass
@@ -0,0 +1,134 @@
+import logging
+import threading
+import time
+
+from step_npm_plugin.metrics import STEP_CA_UP
+
+
+logger = logging.getLogger('console')
+
+# Consecutive failed issuances before the CA is probed to tell a CA that is down from names it refuses to sign.
+FAILURE_THRESHOLD = 3
+# Seconds to wait for a health probe.
+PROBE_TIMEOUT = 10
+
+
+class CAHealth:
+    """
+    Cached view of whether Step CA is up, so certificates are not asked for while it is down.
+
+    The view is fed by the outcome of every issuance and by health probes of the client's `check_health`. A probe is
+    only made when the view is out of date: no issuance succeeded and no probe was made for `interval` seconds, or
+    `FAILURE_THRESHOLD` issuances in a row failed. Failures alone never mark the CA as down, since a provisioner policy
+    refusing some names looks the same, only a failed probe does.
+
+    While the CA is down, `available()` is False without asking the CA, and it is probed again after `interval`
+    seconds, doubling after each failed probe up to `max_backoff`. The first probe that succeeds lets issuance resume.
+    """
+    step_client = None
+    interval: float = 60
+    max_backoff: float = 300
+
+    _up: bool = True
+    _checked_at: float = None
+    _failures: int = 0
+    _backoff: float = 0
+    _next_probe: float = 0
+    _probing: bool = False
+    _lock: threading.Lock = None
+    _probed: threading.Condition = None
+
+    def __init__(self, step_client, interval: float = 60, max_backoff: float = 300):
+        self.step_client = step_client
+        self.interval = interval
+        self.max_backoff = max(max_backoff, interval)
+
+        self._up = True
+        self._checked_at = None
+        self._failures = 0
+        self._backoff = interval
+        self._next_probe = 0
+        self._probing = False
+        self._lock = threading.Lock()
+        self._probed = threading.Condition(self._lock)
+
+        STEP_CA_UP.set(1)
+
+    @property
+    def up(self) -> bool:
+        return self._up
+
+    def available(self) -> bool:
+        """
+        Whether certificates can be issued now, probing the CA first if the cached view is out of date.
+
+        Only one caller probes at a time, the others wait for its outcome rather than probing as well. The probe is
+        made without holding the lock, so issuances finishing in the meantime are recorded straight away.
+        """
+        with self._lock:
+            while True:
+                now = time.monotonic()
+
+                if self._up:
+                    fresh = self._checked_at is not None and now - self._checked_at < self.interval
+                    if fresh and self._failures < FAILURE_THRESHOLD:
+                        return True
+                elif now < self._next_probe:
+                    return False
+
+                if not self._probing:
+                    break
+
+                self._probed.wait()
+
+            self._probing = True
+
+        up = False
+        try:
+            up = self.step_client.check_health(timeout=PROBE_TIMEOUT)
+        except Exception as exc:
+            # A probe that cannot be made at all is no better than one that fails.
+            logger.warning(f'Unable to check the health of Step CA: {exc}')
+        finally:
+            with self._lock:
+                self._probing = False
+                up = self._record_probe(up, time.monotonic())
+                self._probed.notify_all()
+
+        return up
+
+    def _record_probe(self, up: bool, now: float) -> bool:
+        if up:
+            if not self._up:
+                logger.info('Step CA is healthy again, resuming issuance.')
+            self._mark_up(now)
+            return True
+
+        if self._up:
+            logger.warning(f'Step CA is unhealthy, holding back issuance for {self._backoff:g} seconds.')
+        else:
+            logger.info(f'Step CA is still unhealthy, next check in {self._backoff:g} seconds.')
+
+        self._up = False
+        self._next_probe = now + self._backoff
+        self._backoff = min(self._backoff * 2, self.max_backoff)
+        STEP_CA_UP.set(0)
+
+        return False
+
+    def _mark_up(self, now: float) -> None:
+        self._up = True
+        self._checked_at = now
+        self._failures = 0
+        self._backoff = self.interval
+        STEP_CA_UP.set(1)
+
+    def record_success(self) -> None:
+        with self._lock:
+            if not self._up:
+                logger.info('Step CA issued a certificate, resuming issuance.')
+            self._mark_up(time.monotonic())
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
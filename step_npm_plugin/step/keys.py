@@ -0,0 +1,156 @@
+import collections
+import ipaddress
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from cryptography.hazmat.primitives.serialization import (
+    load_pem_private_key, Encoding, PrivateFormat, NoEncryption
+)
+
+
+logger = logging.getLogger('console')
+
+KEY_TYPES = ('EC-P256', 'EC-P384', 'RSA-2048', 'RSA-3072', 'RSA-4096', 'ED25519')
+
+
+def generate_key(key_type: str = 'EC-P256'):
+    """
+    Generates a private key of the given type.
+
+    :param str key_type: One of `KEY_TYPES`.
+    :return: Private key.
+    """
+    if key_type == 'EC-P256':
+        return ec.generate_private_key(ec.SECP256R1())
+    elif key_type == 'EC-P384':
+        return ec.generate_private_key(ec.SECP384R1())
+    elif key_type.startswith('RSA-') and key_type in KEY_TYPES:
+        return rsa.generate_private_key(public_exponent=65537, key_size=int(key_type[4:]))
+    elif key_type == 'ED25519':
+        return ed25519.Ed25519PrivateKey.generate()
+
+    raise ValueError(f'Unsupported key type {key_type}. Only support: {", ".join(KEY_TYPES)}')
+
+
+def generate_key_pem(key_type: str) -> bytes:
+    # Runs in the pool's worker process, keys are passed back as PEM.
+    return generate_key(key_type).private_bytes(Encoding.PEM, PrivateFormat.PKCS8, NoEncryption())
+
+
+def create_csr(common_name: str, sans: list, private_key) -> x509.CertificateSigningRequest:
+    """
+    Creates a CSR for the common name, with every entry of `sans` as a DNS or IP address SAN.
+    """
+    names = []
+
+    for san in sans:
+        try:
+            names.append(x509.IPAddress(ipaddress.ip_address(san)))
+        except ValueError:
+            names.append(x509.DNSName(san))
+
+    return x509.CertificateSigningRequestBuilder().subject_name(
+        x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    ).add_extension(
+        x509.SubjectAlternativeName(names), critical=False
+    ).sign(private_key, None if isinstance(private_key, ed25519.Ed25519PrivateKey) else hashes.SHA256())
+
+
+class KeyPool:
+    """
+    Pool of pre-generated private keys of a single key type.
+
+    Keys are generated in a worker process and kept ready, so a burst of issuances does not pay for key generation on
+    the reconcile path. Whenever the pool drops to `low_watermark` keys it is topped back up to `size`. If the pool
+    runs dry, a key is generated inline rather than waiting on the worker.
+    """
+    key_type: str = 'EC-P256'
+    size: int = 10
+    low_watermark: int = 5
+
+    _keys: collections.deque = None
+    _pending: int = 0
+    _lock: threading.Lock = None
+    _executor: ProcessPoolExecutor = None
+
+    def __init__(self, key_type: str = 'EC-P256', size: int = 10, low_watermark: int = None, workers: int = 1):
+        if key_type not in KEY_TYPES:
+            raise ValueError(f'Unsupported key type {key_type}. Only support: {", ".join(KEY_TYPES)}')
+
+        self.key_type = key_type
+        self.size = size
+        self.low_watermark = size // 2 if low_watermark is None else min(low_watermark, size)
+
+        self._keys = collections.deque()
+        self._lock = threading.Lock()
+        # Spawned rather than forked, the plugin is already running threads by the time the pool refills.
+        self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def __len__(self):
+        return len(self._keys)
+
+    def start(self) -> None:
+        """
+        Starts filling the pool in the background.
+        """
+        self._refill()
+
+    def get(self):
+        """
+        Takes a key from the pool, generating one inline if the pool is empty.
+
+        :return: Private key.
+        """
+        return load_pem_private_key(self.get_pem(), None)
+
+    def get_pem(self) -> bytes:
+        """
+        Takes a key from the pool as PEM, generating one inline if the pool is empty.
+
+        :return: PEM encoded PKCS8 private key.
+        """
+        with self._lock:
+            key_pem = self._keys.popleft() if self._keys else None
+
+        self._refill()
+
+        if key_pem is None:
+            logger.debug('Key pool for %s is empty, generating a key inline.', self.key_type)
+            return generate_key_pem(self.key_type)
+
+        return key_pem
+
+    def _refill(self) -> None:
+        with self._lock:
+            if len(self._keys) + self._pending > self.low_watermark:
+                return
+
+            needed = self.size - len(self._keys) - self._pending
+            self._pending += needed
+
+        logger.debug('Refilling key pool for %s with %s keys.', self.key_type, needed)
+
+        for _ in range(needed):
+            self._executor.submit(generate_key_pem, self.key_type).add_done_callback(self._add)
+
+    def _add(self, future) -> None:
+        with self._lock:
+            self._pending -= 1
+
+            if future.cancelled():
+                return
+
+            if future.exception() is not None:
+                logger.error(f'Failed to generate a {self.key_type} key for the pool: {future.exception()}')
+                return
+
+            self._keys.append(future.result())
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
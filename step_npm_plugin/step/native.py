@@ -0,0 +1,394 @@
+import base64
+import hashlib
+import json
+import logging
+import pathlib
+import secrets
+import shutil
+import tempfile
+import time
+import warnings
+
+import requests
+from urllib3.exceptions import InsecureRequestWarning
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.keywrap import aes_key_unwrap
+from cryptography.hazmat.primitives.serialization import Encoding, load_pem_private_key
+
+from step_npm_plugin.core.data_types import SecureString
+from step_npm_plugin.step.certificate import StepCertificate, root_matches
+from step_npm_plugin.step.client import private_work_dir
+from step_npm_plugin.step.exceptions import GenericStepError, NotBootstrapped, SigningError
+from step_npm_plugin.step.keys import KeyPool, generate_key, create_csr
+
+
+logger = logging.getLogger('console')
+
+# One-time tokens are only used straight away, so keep them short-lived.
+TOKEN_LIFETIME = 300
+
+PBES2_ALGORITHMS = {
+    'PBES2-HS256+A128KW': (hashes.SHA256, 16),
+    'PBES2-HS384+A192KW': (hashes.SHA384, 24),
+    'PBES2-HS512+A256KW': (hashes.SHA512, 32),
+}
+
+EC_CURVES = {
+    'P-256': (ec.SECP256R1, hashes.SHA256, 32, 'ES256'),
+    'P-384': (ec.SECP384R1, hashes.SHA384, 48, 'ES384'),
+    'P-521': (ec.SECP521R1, hashes.SHA512, 66, 'ES512'),
+}
+
+
+def b64url_encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def b64url_decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def decrypt_jwe(token: str, password: SecureString) -> bytes:
+    """
+    Decrypts a compact JWE protected with a password, as step-ca stores a JWK provisioner's private key.
+
+    Only the algorithms step uses are supported: PBES2 key wrapping with AES-GCM content encryption.
+
+    :param str token: JWE in compact serialisation.
+    :param SecureString password: Provisioner password.
+    :return: Decrypted payload.
+    """
+    try:
+        protected, encrypted_key, iv, ciphertext, tag = token.split('.')
+    except ValueError:
+        raise GenericStepError('Provisioner key is not a compact JWE.')
+
+    header = json.loads(b64url_decode(protected))
+
+    if header.get('alg') not in PBES2_ALGORITHMS or header.get('enc') not in ('A128GCM', 'A192GCM', 'A256GCM'):
+        raise GenericStepError(f'Unsupported provisioner key encryption: {header.get("alg")}, {header.get("enc")}.')
+
+    algorithm, length = PBES2_ALGORITHMS[header['alg']]
+    salt = header['alg'].encode('utf-8') + b'\x00' + b64url_decode(header['p2s'])
+    kdf = PBKDF2HMAC(algorithm=algorithm(), length=length, salt=salt, iterations=header['p2c'])
+    wrapping_key = kdf.derive(password.to_string().encode('utf-8'))
+
+    try:
+        content_key = aes_key_unwrap(wrapping_key, b64url_decode(encrypted_key))
+        return AESGCM(content_key).decrypt(
+            b64url_decode(iv), b64url_decode(ciphertext) + b64url_decode(tag), protected.encode('ascii')
+        )
+    except Exception:
+        raise GenericStepError('Unable to decrypt the provisioner key, is the provisioner password correct?')
+
+
+class ProvisionerKey:
+    """
+    Private key of a JWK provisioner, used to sign one-time tokens.
+    """
+    name: str = None
+    kid: str = None
+    algorithm: str = None
+
+    _key = None
+    _hash = None
+    _size: int = None
+
+    def __init__(self, name: str, jwk: dict):
+        self.name = name
+        self.kid = jwk.get('kid', None)
+
+        if jwk.get('kty') == 'EC' and jwk.get('crv') in EC_CURVES:
+            curve, self._hash, self._size, self.algorithm = EC_CURVES[jwk['crv']]
+            self._key = ec.derive_private_key(int.from_bytes(b64url_decode(jwk['d']), 'big'), curve())
+        elif jwk.get('kty') == 'OKP' and jwk.get('crv') == 'Ed25519':
+            self.algorithm = 'EdDSA'
+            self._key = ed25519.Ed25519PrivateKey.from_private_bytes(b64url_decode(jwk['d']))
+        else:
+            raise GenericStepError(f'Unsupported provisioner key type: {jwk.get("kty")} {jwk.get("crv")}.')
+
+    def sign(self, data: bytes) -> bytes:
+        if self.algorithm == 'EdDSA':
+            return self._key.sign(data)
+
+        r, s = decode_dss_signature(self._key.sign(data, ec.ECDSA(self._hash())))
+        return r.to_bytes(self._size, 'big') + s.to_bytes(self._size, 'big')
+
+
+class NativeStepClient:
+    """
+    Issues certificates by calling step-ca's API directly, rather than running step-cli.
+
+    The private key and CSR are generated in-process, a one-time token is minted with the JWK provisioner's key, and
+    the CSR is sent to `/1.0/sign`. The certificate comes back as a `StepCertificate` without touching the disk.
+    Bootstrapping fetches the root certificate, checks it against the fingerprint and decrypts the provisioner key, in
+    the same way `step ca bootstrap` and `step ca certificate` would.
+
+    Renewals authenticate with the certificate being renewed instead. Its chain and key are briefly written to a
+    private `work_dir`, as requests only reads client certificates from files.
+    """
+    ca_scheme: str = "https"
+    ca_domain: str = None
+    ca_port: int = 9000
+    ca_fingerprint: str = None
+    provisioner_name: str = None
+    root_file: pathlib.Path = None
+    key_type: str = 'EC-P256'
+    key_pool: KeyPool = None
+    work_dir: pathlib.Path = None
+
+    ca_url = None
+    session: requests.Session = None
+    _verify: str or bool = True
+    _provisioner_password: SecureString = None
+    _provisioner: ProvisionerKey = None
+    _bootstrapped = False
+
+    def __init__(self, ca_scheme: str, ca_domain: str, ca_port: int, ca_fingerprint: str,
+                 provisioner_password: SecureString, provisioner_name: str = None, root_file: pathlib.Path = None,
+                 key_type: str = 'EC-P256', key_pool: KeyPool = None, work_dir: pathlib.Path = None):
+        self.ca_scheme = ca_scheme
+        self.ca_domain = ca_domain
+        self.ca_port = ca_port
+        self.ca_fingerprint = ca_fingerprint.replace(':', '').lower()
+        self.provisioner_name = provisioner_name
+        self.root_file = root_file or pathlib.Path('./root_ca.crt')
+        self.key_type = key_pool.key_type if key_pool else key_type
+        self.key_pool = key_pool
+        self.work_dir = work_dir
+
+        self._provisioner_password = provisioner_password
+        self.session = requests.Session()
+
+        self._build_ca_url()
+
+    def _build_ca_url(self):
+        self.ca_url = f"{self.ca_scheme}://{self.ca_domain}:{self.ca_port}"
+
+    def bootstrap(self, force: bool = False):
+        """
+        Fetches the root certificate, unless one with the right fingerprint was saved by a previous run and `force` is
+        not set, and then the provisioner to sign with.
+        """
+        if self.ca_scheme == 'https':
+            if force or not root_matches(self.root_file, self.ca_fingerprint):
+                self._fetch_root()
+            else:
+                logger.debug('Using the root certificate saved in %s.', self.root_file.absolute())
+            # Passed on each request, as REQUESTS_CA_BUNDLE would take precedence over `session.verify`.
+            self._verify = self.root_file.absolute().__str__()
+
+        self._provisioner = self._load_provisioner()
+        logger.debug('Using JWK provisioner %s (%s).', self._provisioner.name, self._provisioner.kid)
+
+        self._bootstrapped = True
+
+    def _fetch_root(self) -> None:
+        # The root is not trusted yet, it is verified against the fingerprint instead.
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', InsecureRequestWarning)
+            r = self.session.get(f'{self.ca_url}/root/{self.ca_fingerprint}', verify=False, timeout=10)
+
+        if r.status_code != 200:
+            raise GenericStepError(f'Unable to fetch the root certificate from {self.ca_url}: {r.status_code}.')
+
+        root_pem = r.json()['ca'].encode('utf-8')
+        root = x509.load_pem_x509_certificate(root_pem)
+
+        if hashlib.sha256(root.public_bytes(Encoding.DER)).hexdigest() != self.ca_fingerprint:
+            raise GenericStepError('The root certificate served by the CA does not match the fingerprint.')
+
+        self.root_file.parent.mkdir(parents=True, exist_ok=True)
+        self.root_file.write_bytes(root_pem)
+        logger.debug('Root certificate written to %s.', self.root_file.absolute())
+
+    def _load_provisioner(self) -> ProvisionerKey:
+        cursor = ''
+
+        while True:
+            params = {'cursor': cursor} if cursor else None
+            r = self.session.get(f'{self.ca_url}/provisioners', params=params, verify=self._verify, timeout=10)
+
+            if r.status_code != 200:
+                raise GenericStepError(f'Unable to list provisioners on {self.ca_url}: {r.status_code}.')
+
+            data = r.json()
+
+            for provisioner in data.get('provisioners', []):
+                if provisioner.get('type') != 'JWK' or not provisioner.get('encryptedKey'):
+                    continue
+                if self.provisioner_name and provisioner.get('name') != self.provisioner_name:
+                    continue
+
+                jwk = json.loads(decrypt_jwe(provisioner['encryptedKey'], self._provisioner_password))
+                jwk.setdefault('kid', provisioner.get('key', {}).get('kid', None))
+
+                return ProvisionerKey(provisioner['name'], jwk)
+
+            cursor = data.get('nextCursor', '')
+            if not cursor:
+                break
+
+        name = f' named {self.provisioner_name}' if self.provisioner_name else ''
+        raise GenericStepError(f'No JWK provisioner{name} found on {self.ca_url}.')
+
+    def get_ca_health(self, timeout: float = None) -> dict:
+        if not self._bootstrapped:
+            raise NotBootstrapped("Client has not yet been bootstrapped.")
+
+        r = self.session.get(f'{self.ca_url}/health', verify=self._verify, timeout=timeout or 5)
+
+        return r.json() if r.status_code == 200 else {}
+
+    def check_health(self, timeout: float = None) -> bool:
+        """
+        Whether the CA's `/health` endpoint reports it as up, see `get_ca_health`.
+        """
+        try:
+            return self.get_ca_health(timeout=timeout).get('status', None) == 'ok'
+        except (requests.RequestException, ValueError):
+            return False
+
+    def create_token(self, common_name: str, *sans: str) -> str:
+        """
+        Mints a one-time token authorising `/1.0/sign` for the given names, as `step ca token` would.
+
+        :param str common_name: Subject of the certificate.
+        :param str sans: SANs of the certificate, including the subject if it should be one.
+        :return: Signed JWT.
+        """
+        if not self._bootstrapped:
+            raise NotBootstrapped("Client has not yet been bootstrapped.")
+
+        now = int(time.time())
+        header = {'alg': self._provisioner.algorithm, 'kid': self._provisioner.kid, 'typ': 'JWT'}
+        claims = {
+            'iss': self._provisioner.name,
+            'aud': f'{self.ca_url}/1.0/sign',
+            'sub': common_name,
+            'sans': list(sans),
+            'sha': self.ca_fingerprint,
+            'iat': now,
+            'nbf': now,
+            'exp': now + TOKEN_LIFETIME,
+            'jti': secrets.token_hex(32),
+        }
+
+        signing_input = (
+            f'{b64url_encode(json.dumps(header, separators=(",", ":")).encode("utf-8"))}.'
+            f'{b64url_encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))}'
+        )
+
+        return f'{signing_input}.{b64url_encode(self._provisioner.sign(signing_input.encode("ascii")))}'
+
+    def issue_certificate(self, common_name: str, *sans: str, timeout: float = None) -> StepCertificate:
+        """
+        Generates a key and CSR, and has the CA sign it.
+
+        :param str common_name: Common name of the certificate. It is always included as a SAN.
+        :param str sans: Additional SANs for the certificate.
+        :param float timeout: Seconds to wait for the CA before giving up.
+        :return: The issued certificate and key.
+        """
+        if not self._bootstrapped:
+            raise NotBootstrapped("Client has not yet been bootstrapped.")
+
+        names = list(dict.fromkeys([common_name, *sans]))
+
+        # Pooled keys are already PEM, so the upload to NPM does not need to serialise them again.
+        key_pem = self.key_pool.get_pem() if self.key_pool else None
+        private_key = load_pem_private_key(key_pem, None) if key_pem else generate_key(self.key_type)
+        csr = create_csr(common_name, names, private_key)
+
+        try:
+            r = self.session.post(f'{self.ca_url}/1.0/sign', json={
+                'csr': csr.public_bytes(Encoding.PEM).decode('utf-8'),
+                'ott': self.create_token(common_name, *names),
+            }, verify=self._verify, timeout=timeout)
+        except requests.RequestException as exc:
+            raise SigningError(f'Unable to reach the CA to sign {common_name}: {exc}')
+
+        chain = self._signed_chain(r, f'sign {common_name}')
+        logger.debug('Certificate for %s signed by %s.', common_name, self.ca_url)
+
+        # Parsed lazily, only the PEM is needed to hand the certificate to NPM.
+        return StepCertificate.from_pem(chain, key_pem, private_key)
+
+    @staticmethod
+    def _signed_chain(r: requests.Response, action: str) -> bytes:
+        """
+        The PEM certificate chain in a response of `/1.0/sign`, `/renew` or `/rekey`.
+        """
+        if r.status_code not in (200, 201):
+            try:
+                message = r.json().get('message', r.text)
+            except ValueError:
+                message = r.text
+            raise SigningError(f'CA refused to {action} ({r.status_code}): {message}')
+
+        data = r.json()
+        chain = data.get('certChain', None) or [data['crt'], data['ca']]
+
+        return ''.join(chain).encode('utf-8')
+
+    def renew_certificate(
+            self, certificate: StepCertificate, reuse_key: bool = False, timeout: float = None
+    ) -> StepCertificate:
+        """
+        Renews a certificate that is still valid through `/renew`, or `/rekey` for a new key, authenticating to the CA
+        with the certificate itself over mTLS rather than with a one-time token. The renewed certificate covers the
+        same names.
+
+        :param StepCertificate certificate: The certificate to renew, with its private key.
+        :param bool reuse_key: Whether the renewed certificate keeps the current key, so no key is generated.
+        :param float timeout: Seconds to wait for the CA before giving up.
+        :return: The renewed certificate and its key.
+        """
+        if not self._bootstrapped:
+            raise NotBootstrapped("Client has not yet been bootstrapped.")
+
+        if self.work_dir is None:
+            self.work_dir = private_work_dir()
+
+        attributes = certificate.certificate.subject.get_attributes_for_oid(NameOID.COMMON_NAME)
+        name = attributes[0].value if attributes else certificate.certificate.subject.rfc4514_string()
+        body = None
+
+        if reuse_key:
+            key_pem = certificate.private_key_bytes
+            private_key = certificate.private_key
+        else:
+            key_pem = self.key_pool.get_pem() if self.key_pool else None
+            private_key = load_pem_private_key(key_pem, None) if key_pem else generate_key(self.key_type)
+            # The CA renews the names of the current certificate, it only takes the new public key from the CSR.
+            csr = create_csr(name, [name], private_key)
+            body = {'csr': csr.public_bytes(Encoding.PEM).decode('utf-8')}
+
+        # requests only takes the client certificate and key from files.
+        directory = pathlib.Path(tempfile.mkdtemp(dir=self.work_dir))
+
+        try:
+            crt_file = directory / 'current.crt'
+            key_file = directory / 'current.key'
+            crt_file.write_bytes(certificate.chain_bytes)
+            key_file.write_bytes(certificate.private_key_bytes)
+
+            r = self.session.post(
+                f'{self.ca_url}/{"renew" if reuse_key else "rekey"}', json=body,
+                cert=(crt_file.__str__(), key_file.__str__()), verify=self._verify, timeout=timeout
+            )
+        except requests.RequestException as exc:
+            raise SigningError(f'Unable to reach the CA to renew {name}: {exc}')
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+        chain = self._signed_chain(r, f'{"renew" if reuse_key else "rekey"} {name}')
+        logger.debug('Certificate for %s renewed by %s.', name, self.ca_url)
+
+        return StepCertificate.from_pem(chain, key_pem, private_key)
@@ -0,0 +1,238 @@
+import datetime
+import logging
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+
+from step_npm_plugin.metrics import ISSUANCE_SECONDS, STEP_RENEWALS
+from step_npm_plugin.step.cache import CertificateCache
+from step_npm_plugin.step.certificate import StepCertificate
+from step_npm_plugin.step.client import StepClient
+from step_npm_plugin.step.exceptions import CAUnavailable
+from step_npm_plugin.step.health import CAHealth
+
+
+logger = logging.getLogger('console')
+
+# How renewals get their certificate: `rekey` and `reuse-key` renew over mTLS with the current certificate, with a new
+# key or the current one, before falling back to a full issuance. `off` always issues anew.
+RENEW_MODES = ('off', 'rekey', 'reuse-key')
+
+
+class IssuanceJob:
+    """
+    A request for a certificate, with a reference back to whatever asked for it.
+
+    Jobs with `reuse` may be given a recently issued certificate for the same names from the pool's cache. Renewals
+    should not, they need a new certificate. Renewals that hold the certificate they replace, for the same names, pass
+    it as `renews` so the pool can renew it rather than issue a new one.
+    """
+    common_name: str = None
+    sans: tuple = None
+    context = None
+    reuse: bool = True
+    renews: StepCertificate = None
+
+    def __init__(
+            self, common_name: str, *sans: str, context=None, reuse: bool = True, renews: StepCertificate = None
+    ):
+        self.common_name = common_name
+        self.sans = sans
+        self.context = context
+        self.reuse = reuse
+        self.renews = renews
+
+    @property
+    def key(self) -> tuple:
+        """
+        Identifies the certificate the job asks for. Jobs with the same key are satisfied by the same certificate.
+        """
+        return self.common_name, tuple(sorted(set(self.sans) - {self.common_name}))
+
+    def __repr__(self):
+        return f"<IssuanceJob {self.common_name}, sans={list(self.sans)}>"
+
+
+class IssuanceResult:
+    """
+    Outcome of a single `IssuanceJob`. Exactly one of `certificate` and `error` is set.
+    """
+    job: IssuanceJob = None
+    certificate: StepCertificate = None
+    error: Exception = None
+    duration: float = None
+
+    def __init__(self, job: IssuanceJob, certificate: StepCertificate = None, error: Exception = None,
+                 duration: float = None):
+        self.job = job
+        self.certificate = certificate
+        self.error = error
+        self.duration = duration
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class IssuancePool:
+    """
+    Issues certificates through a `StepClient` on a bounded pool of worker threads.
+
+    Each job runs its own step-cli process with a timeout, and failures are returned as results rather than raised,
+    so one bad domain does not hold up the rest of the batch. Jobs asking for the same certificate, by
+    `IssuanceJob.key`, are only run once per batch, and the others in the batch share its outcome.
+
+    With a `CertificateCache`, certificates are kept after they are issued and handed out again to later jobs for the
+    same names and key type, without asking the CA.
+
+    With a `CAHealth`, jobs fail straight away with `CAUnavailable` while the CA is down, rather than each running a
+    step-cli process that is bound to fail. Cached certificates are still handed out.
+
+    Jobs that `renews` a certificate that has not expired yet are renewed with it, as `renew_mode` says, so the CA
+    neither needs the provisioner password nor, with `reuse-key`, a new key. If renewing fails the job falls back to a
+    full issuance.
+    """
+    step_client: StepClient = None
+    max_workers: int = 4
+    timeout: float = None
+    cache: CertificateCache = None
+    health: CAHealth = None
+    renew_mode: str = 'rekey'
+
+    _executor: ThreadPoolExecutor = None
+
+    def __init__(
+            self, step_client: StepClient, max_workers: int = 4, timeout: float = None, cache: CertificateCache = None,
+            health: CAHealth = None, renew_mode: str = 'rekey'
+    ):
+        if renew_mode not in RENEW_MODES:
+            raise ValueError(f'Unknown renew mode {renew_mode}, expected one of {", ".join(RENEW_MODES)}.')
+
+        self.step_client = step_client
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.cache = cache
+        self.health = health
+        self.renew_mode = renew_mode
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='step-issuer')
+
+    def _issue(self, job: IssuanceJob) -> IssuanceResult:
+        started = time.monotonic()
+        key = None
+
+        if self.cache is not None:
+            key = self.cache.key(job.common_name, job.sans, self.step_client.key_type)
+            certificate = self.cache.get(key) if job.reuse else None
+
+            if certificate is not None:
+                logger.debug('Reusing the certificate issued earlier for %s.', job.common_name)
+                return IssuanceResult(job, certificate=certificate, duration=time.monotonic() - started)
+
+        try:
+            if self.health is not None and not self.health.available():
+                return IssuanceResult(job, error=CAUnavailable('Step CA is down, not asking it for a certificate.'))
+
+            certificate = self._renew(job) if job.renews is not None and self.renew_mode != 'off' else None
+
+            if certificate is None:
+                certificate = self.step_client.issue_certificate(job.common_name, *job.sans, timeout=self.timeout)
+
+                if job.renews is not None:
+                    STEP_RENEWALS.labels('issue').inc()
+        except Exception as exc:
+            result = IssuanceResult(job, error=exc)
+        else:
+            result = IssuanceResult(job, certificate=certificate)
+
+            if key is not None:
+                self.cache.put(key, certificate)
+
+        if self.health is not None:
+            if result.ok:
+                self.health.record_success()
+            else:
+                self.health.record_failure()
+
+        result.duration = time.monotonic() - started
+        ISSUANCE_SECONDS.labels('success' if result.ok else 'failure').observe(result.duration)
+
+        return result
+
+    def _renew(self, job: IssuanceJob) -> StepCertificate or None:
+        """
+        Renews the certificate a job replaces, or returns None if it has to be issued anew instead.
+        """
+        if job.renews.not_after <= datetime.datetime.now(datetime.timezone.utc):
+            logger.debug('Certificate for %s has expired, issuing a new one rather than renewing it.', job.common_name)
+            return None
+
+        method = 'renew' if self.renew_mode == 'reuse-key' else 'rekey'
+
+        try:
+            certificate = self.step_client.renew_certificate(
+                job.renews, reuse_key=method == 'renew', timeout=self.timeout
+            )
+        except Exception as exc:
+            logger.warning(f'Unable to {method} the certificate for {job.common_name}, issuing a new one: {exc}')
+            return None
+
+        STEP_RENEWALS.labels(method).inc()
+        return certificate
+
+    def submit(self, jobs: list) -> list:
+        """
+        Starts a batch of jobs on the pool.
+
+        :param list jobs: `IssuanceJob` instances to run.
+        :return: A `concurrent.futures.Future` per job, each resolving to an `IssuanceResult` for that job.
+        """
+        futures = []
+        started = {}
+
+        for job in jobs:
+            future = started.get(job.key, None)
+
+            if future is not None:
+                logger.debug(
+                    'Certificate for %s already being issued in this batch, sharing it with %s.', job.common_name, job
+                )
+                futures.append(self._share(future, job))
+                continue
+
+            future = started[job.key] = self._executor.submit(self._issue, job)
+            futures.append(future)
+
+        return futures
+
+    @staticmethod
+    def _share(future: Future, job: IssuanceJob) -> Future:
+        """
+        A future for `job` that resolves to the outcome of another job's `future`, once that is done.
+        """
+        shared = Future()
+
+        def done(issued: Future) -> None:
+            if issued.cancelled():
+                shared.cancel()
+            elif issued.exception() is not None:
+                shared.set_exception(issued.exception())
+            else:
+                result = issued.result()
+                shared.set_result(IssuanceResult(job, result.certificate, result.error, result.duration))
+
+        future.add_done_callback(done)
+
+        return shared
+
+    def issue(self, jobs: list):
+        """
+        Runs a batch of jobs and yields their results as they finish.
+
+        :param list jobs: `IssuanceJob` instances to run.
+        :return: Generator of `IssuanceResult`, in order of completion.
+        """
+        for future in as_completed(self.submit(jobs)):
+            yield future.result()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,116 @@
+import datetime
+import time
+
+import pytest
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.serialization import Encoding, PrivateFormat, NoEncryption
+
+from benchmarks.fake_npm import FakeNPM, serve
+from step_npm_plugin.core import args, settings
+from step_npm_plugin.core.data_types import SecureString
+from step_npm_plugin.npm import AsyncNginxProxyManagerClient, decorators
+from step_npm_plugin.step import StepCertificate
+
+
+def make_certificate(common_name: str, *sans: str, days: float = 1) -> StepCertificate:
+    """
+    A self-signed certificate for `common_name`, valid from now for `days`.
+    """
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+
+    certificate = x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(
+        key.public_key()
+    ).serial_number(x509.random_serial_number()).not_valid_before(
+        now - datetime.timedelta(minutes=1)
+    ).not_valid_after(now + datetime.timedelta(days=days)).add_extension(
+        x509.SubjectAlternativeName([x509.DNSName(domain) for domain in (common_name, *sans)]), critical=False
+    ).sign(key, hashes.SHA256())
+
+    return StepCertificate.from_pem(
+        certificate.public_bytes(Encoding.PEM), key.private_bytes(Encoding.PEM, PrivateFormat.PKCS8, NoEncryption())
+    )
+
+
+def make_config(*argv: str, **overrides) -> settings.AppConfig:
+    """
+    Configuration with the required settings filled in, followed by `argv`, and then `overrides` set as is.
+    """
+    config = settings.AppConfig(args.parser.parse_args([
+        '--step-ca-domain', 'ca.example.com', '--step-ca-fingerprint', 'ab' * 32,
+        '--step-ca-provisioner-pass', 'secret', '--npm-host', '127.0.0.1', '--npm-user', 'admin@example.com',
+        '--npm-pass', 'secret', *argv
+    ]))
+
+    for key, value in overrides.items():
+        setattr(config, key, value)
+
+    return config
+
+
+class FakeStepClient:
+    """
+    Stands in for `StepClient`, issuing self-signed certificates and recording the names asked for.
+    """
+    key_type = 'EC-P256'
+
+    def __init__(self, days: float = 1):
+        self.days = days
+        self.issued = []
+        self.renewed = []
+
+    def issue_certificate(self, common_name: str, *sans: str, timeout: float = None) -> StepCertificate:
+        self.issued.append((common_name, *sans))
+        return make_certificate(common_name, *sans, days=self.days)
+
+    def renew_certificate(
+            self, certificate: StepCertificate, reuse_key: bool = False, timeout: float = None
+    ) -> StepCertificate:
+        common_name = certificate.certificate.subject.get_attributes_for_oid(NameOID.COMMON_NAME)[0].value
+        self.renewed.append(common_name)
+        return make_certificate(common_name, days=self.days)
+
+    def check_health(self, timeout: float = None) -> bool:
+        return True
+
+
+@pytest.fixture
+def local_timezone(monkeypatch):
+    """
+    Runs the test with local time well behind UTC, so anything that mixes local and UTC times is hours out.
+    """
+    monkeypatch.setenv('TZ', 'Etc/GMT+10')
+    time.tzset()
+
+    yield
+
+    monkeypatch.undo()
+    time.tzset()
+
+
+@pytest.fixture
+def fake_npm():
+    npm = FakeNPM()
+    server = serve(npm)
+    npm.port = server.server_address[1]
+
+    yield npm
+
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def npm_client(fake_npm, monkeypatch):
+    # Failed requests are retried straight away rather than after a backoff.
+    monkeypatch.setattr(decorators, 'BACKOFF_BASE', 0)
+
+    client = AsyncNginxProxyManagerClient('127.0.0.1', fake_npm.port, ('admin@example.com', SecureString('secret')))
+
+    yield client
+
+    client.close()
@@ -0,0 +1,229 @@
+"""
+Stand-in for the parts of the step-ca API used by `NativeStepClient`: `/root`, `/provisioners`, `/health` and
+`/1.0/sign`, served over HTTPS with a certificate issued by its own root.
+"""
+import datetime
+import hashlib
+import ipaddress
+import json
+import os
+import pathlib
+import ssl
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.keywrap import aes_key_wrap
+from cryptography.hazmat.primitives.serialization import Encoding, PrivateFormat, NoEncryption
+
+from step_npm_plugin.step.native import PBES2_ALGORITHMS, b64url_encode, b64url_decode
+
+
+def encrypt_jwe(payload: bytes, password: str, alg: str = 'PBES2-HS256+A128KW', enc: str = 'A256GCM') -> str:
+    """
+    Encrypts `payload` as a compact JWE with a password, as step-ca stores a JWK provisioner's private key.
+    """
+    algorithm, length = PBES2_ALGORITHMS[alg]
+    header = {'alg': alg, 'enc': enc, 'p2c': 1000, 'p2s': b64url_encode(os.urandom(16)), 'cty': 'jwk+json'}
+    protected = b64url_encode(json.dumps(header).encode('utf-8'))
+
+    salt = alg.encode('utf-8') + b'\x00' + b64url_decode(header['p2s'])
+    wrapping_key = PBKDF2HMAC(algorithm(), length, salt, header['p2c']).derive(password.encode('utf-8'))
+    content_key = os.urandom({'A128GCM': 16, 'A192GCM': 24, 'A256GCM': 32}[enc])
+    iv = os.urandom(12)
+    sealed = AESGCM(content_key).encrypt(iv, payload, protected.encode('ascii'))
+
+    return '.'.join((
+        protected, b64url_encode(aes_key_wrap(wrapping_key, content_key)), b64url_encode(iv),
+        b64url_encode(sealed[:-16]), b64url_encode(sealed[-16:])
+    ))
+
+
+def ec_jwk(key: ec.EllipticCurvePrivateKey, kid: str) -> dict:
+    numbers = key.private_numbers()
+    size = (key.curve.key_size + 7) // 8
+
+    return {
+        'kty': 'EC', 'crv': f'P-{key.curve.key_size}', 'kid': kid,
+        'x': b64url_encode(numbers.public_numbers.x.to_bytes(size, 'big')),
+        'y': b64url_encode(numbers.public_numbers.y.to_bytes(size, 'big')),
+        'd': b64url_encode(numbers.private_value.to_bytes(size, 'big')),
+    }
+
+
+def _issue(subject: x509.Name, public_key, issuer: x509.Name, issuer_key, validity: datetime.timedelta,
+           ca: bool = False, sans: list = None) -> x509.Certificate:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    builder = x509.CertificateBuilder().subject_name(subject).issuer_name(issuer).public_key(
+        public_key
+    ).serial_number(x509.random_serial_number()).not_valid_before(
+        now - datetime.timedelta(minutes=1)
+    ).not_valid_after(now + validity)
+
+    if ca:
+        builder = builder.add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+    if sans:
+        builder = builder.add_extension(x509.SubjectAlternativeName(sans), critical=False)
+
+    return builder.sign(issuer_key, hashes.SHA256())
+
+
+def _name(common_name: str) -> x509.Name:
+    return x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+
+
+def _pem(certificate: x509.Certificate) -> str:
+    return certificate.public_bytes(Encoding.PEM).decode('utf-8')
+
+
+class MockCA:
+    """
+    A CA with a root, an intermediate and a single JWK provisioner named `admin`, protected by `password`.
+
+    Every one-time token sent to `/1.0/sign` is checked against the provisioner's key and kept in `tokens`. Provisioners
+    are listed over two pages, with an ACME provisioner first, as a CA with several provisioners would.
+    """
+    password: str = None
+    validity: datetime.timedelta = datetime.timedelta(hours=24)
+    fingerprint: str = None
+    port: int = None
+    refuse: bool = False
+    tokens: list = None
+
+    def __init__(self, password: str = 'secret'):
+        self.password = password
+        self.tokens = []
+
+        self.root_key = ec.generate_private_key(ec.SECP256R1())
+        self.root = _issue(_name('Mock Root'), self.root_key.public_key(), _name('Mock Root'), self.root_key,
+                           datetime.timedelta(days=3650), ca=True)
+        self.intermediate_key = ec.generate_private_key(ec.SECP256R1())
+        self.intermediate = _issue(_name('Mock Intermediate'), self.intermediate_key.public_key(), self.root.subject,
+                                   self.root_key, datetime.timedelta(days=3650), ca=True)
+        self.fingerprint = hashlib.sha256(self.root.public_bytes(Encoding.DER)).hexdigest()
+
+        self.provisioner_key = ec.generate_private_key(ec.SECP256R1())
+        self.encrypted_key = encrypt_jwe(json.dumps(ec_jwk(self.provisioner_key, 'mock-kid')).encode(), password)
+
+        self._server = None
+        self._directory = None
+
+    @property
+    def url(self) -> str:
+        return f'https://127.0.0.1:{self.port}'
+
+    def start(self) -> None:
+        server_key = ec.generate_private_key(ec.SECP256R1())
+        server = _issue(_name('127.0.0.1'), server_key.public_key(), self.intermediate.subject,
+                        self.intermediate_key, datetime.timedelta(days=1),
+                        sans=[x509.IPAddress(ipaddress.ip_address('127.0.0.1'))])
+
+        self._directory = pathlib.Path(tempfile.mkdtemp())
+        (self._directory / 'server.crt').write_text(_pem(server) + _pem(self.intermediate))
+        (self._directory / 'server.key').write_bytes(
+            server_key.private_bytes(Encoding.PEM, PrivateFormat.PKCS8, NoEncryption())
+        )
+
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(self._directory / 'server.crt', self._directory / 'server.key')
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(self))
+        self._server.daemon_threads = True
+        self._server.socket = context.wrap_socket(self._server.socket, server_side=True)
+        self.port = self._server.server_address[1]
+
+        threading.Thread(target=self._server.serve_forever, args=(0.05,), name='mock-ca', daemon=True).start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+        for path in self._directory.iterdir():
+            path.unlink()
+        self._directory.rmdir()
+
+    def provisioners(self, cursor: str) -> dict:
+        if not cursor:
+            return {'provisioners': [{'type': 'ACME', 'name': 'acme'}], 'nextCursor': 'page-2'}
+
+        return {
+            'provisioners': [
+                {'type': 'JWK', 'name': 'admin', 'key': {'kid': 'mock-kid'}, 'encryptedKey': self.encrypted_key}
+            ],
+            'nextCursor': '',
+        }
+
+    def verify_token(self, token: str) -> dict:
+        """
+        Checks the signature of a one-time token, and returns its header and claims.
+        """
+        header, claims, signature = token.split('.')
+        raw = b64url_decode(signature)
+        self.provisioner_key.public_key().verify(
+            encode_dss_signature(int.from_bytes(raw[:32], 'big'), int.from_bytes(raw[32:], 'big')),
+            f'{header}.{claims}'.encode('ascii'), ec.ECDSA(hashes.SHA256())
+        )
+
+        return {'header': json.loads(b64url_decode(header)), **json.loads(b64url_decode(claims))}
+
+    def sign(self, body: dict) -> tuple[int, dict]:
+        if self.refuse:
+            return 403, {'message': 'The request was forbidden by the certificate authority.'}
+
+        self.tokens.append(self.verify_token(body['ott']))
+        csr = x509.load_pem_x509_csr(body['csr'].encode('utf-8'))
+        sans = csr.extensions.get_extension_for_class(x509.SubjectAlternativeName).value
+
+        certificate = _issue(csr.subject, csr.public_key(), self.intermediate.subject, self.intermediate_key,
+                             self.validity, sans=list(sans))
+
+        return 201, {
+            'crt': _pem(certificate), 'ca': _pem(self.intermediate),
+            'certChain': [_pem(certificate), _pem(self.intermediate)],
+        }
+
+
+def make_handler(ca: MockCA):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status: int, body: dict) -> None:
+            data = json.dumps(body).encode()
+
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            path, _, query = self.path.partition('?')
+
+            if path == f'/root/{ca.fingerprint}':
+                return self._send(200, {'ca': _pem(ca.root)})
+            if path == '/provisioners':
+                return self._send(200, ca.provisioners(query.removeprefix('cursor=')))
+            if path == '/health':
+                return self._send(200, {'status': 'ok'})
+
+            return self._send(404, {'message': 'Not Found'})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+
+            if self.path == '/1.0/sign':
+                return self._send(*ca.sign(body))
+
+            return self._send(404, {'message': 'Not Found'})
+
+    return Handler
@@ -0,0 +1,53 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from step_npm_plugin.core import app
+from step_npm_plugin.core.coordination import Lease
+
+from .conftest import FakeStepClient, make_config
+
+
+def test_run_async_shuts_down_on_cancel(fake_npm, npm_client, monkeypatch, tmp_path):
+    step_client = FakeStepClient()
+    step_client.key_pool = None
+    stores = []
+
+    async def setup(config):
+        await npm_client.login()
+        return step_client, [npm_client]
+
+    class StateStore(app.StateStore):
+        def __init__(self, *args):
+            super().__init__(*args)
+            stores.append(self)
+
+    monkeypatch.setattr(app, 'setup', setup)
+    monkeypatch.setattr(app, 'StateStore', StateStore)
+
+    config = make_config(
+        '--schedule', '1h', '--state-file', str(tmp_path / 'state.db'), '--lease-file', str(tmp_path / 'lease.db'),
+        '--npm-port', str(fake_npm.port)
+    )
+
+    async def main():
+        task = asyncio.create_task(app.run_async(config))
+
+        while not fake_npm.calls.get('GET /api/nginx/certificates'):
+            await asyncio.sleep(0.01)
+
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+
+    assert npm_client._executor._shutdown
+    with pytest.raises(sqlite3.ProgrammingError):
+        stores[0]._connection.execute('SELECT 1')
+
+    # The lease was released, so another replica takes it straight away.
+    other = Lease(tmp_path / 'lease.db', app.Shard.from_config(config).name, 'other')
+    assert other.acquire()
+    other.close()
@@ -0,0 +1,156 @@
+import asyncio
+import datetime
+import time
+
+import pytest
+
+from step_npm_plugin.npm import BadRequest, CommunicationError, GenericNPMError
+
+from .conftest import make_certificate
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def logged_in(client):
+    await client.login()
+    return client
+
+
+def test_listings_run_concurrently(fake_npm, npm_client):
+    fake_npm.add_host(['a.example.com'])
+    fake_npm.add_cert(['b.example.com'], datetime.datetime.utcnow() + datetime.timedelta(days=1))
+    run(logged_in(npm_client))
+    fake_npm.latency = 0.3
+
+    async def both():
+        return await asyncio.gather(npm_client.get_proxy_hosts(), npm_client.get_certificates())
+
+    started = time.monotonic()
+    hosts, certs = run(both())
+
+    assert time.monotonic() - started < 0.55
+    assert [host['domain_names'] for host in hosts] == [['a.example.com']]
+    assert [cert['domain_names'] for cert in certs] == [['b.example.com']]
+
+
+def test_proxy_hosts_only_keep_the_certificate_provider(fake_npm, npm_client):
+    cert = fake_npm.add_cert(['a.example.com'], datetime.datetime.utcnow() + datetime.timedelta(days=1))
+    fake_npm.add_host(['a.example.com'], cert['id'])
+    run(logged_in(npm_client))
+
+    hosts = run(npm_client.get_proxy_hosts())
+
+    assert hosts[0]['certificate'] == {'provider': 'other'}
+
+
+def test_create_certificate_creates_and_uploads(fake_npm, npm_client):
+    run(logged_in(npm_client))
+
+    cert_id = run(npm_client.create_certificate(make_certificate('a.example.com'), 'a.example.com'))
+
+    assert fake_npm.certs[cert_id]['nice_name'] == 'a.example.com'
+    assert fake_npm.certs[cert_id]['domain_names'] == ['a.example.com']
+    assert fake_npm.certs[cert_id]['expires_on'] is not None
+    assert fake_npm.calls['POST /api/nginx/certificates'] == 1
+    assert fake_npm.calls['POST /api/nginx/certificates/{id}/upload'] == 1
+
+
+def test_update_proxy_host_certificates_returns_each_outcome(fake_npm, npm_client):
+    first = fake_npm.add_host(['a.example.com'])['id']
+    second = fake_npm.add_host(['b.example.com'])['id']
+    run(logged_in(npm_client))
+
+    outcomes = run(npm_client.update_proxy_host_certificates([
+        {'proxy_host': first, 'certificate': 10},
+        {'proxy_host': 999, 'certificate': 11},
+        {'proxy_host': second, 'certificate': 12},
+    ]))
+
+    assert outcomes[0]['certificate_id'] == 10 and outcomes[0]['ssl_forced'] is True
+    # NPM answers 404 for a host that is gone, which is not an error the client raises for.
+    assert outcomes[1] == {}
+    assert outcomes[2]['certificate_id'] == 12
+    assert fake_npm.hosts[second]['hsts_enabled'] is True
+
+
+def test_update_proxy_host_certificates_does_not_fail_the_batch(fake_npm, npm_client):
+    first = fake_npm.add_host(['a.example.com'])['id']
+    second = fake_npm.add_host(['b.example.com'])['id']
+    run(logged_in(npm_client))
+    fake_npm.fail('PUT /api/nginx/proxy-hosts/{id}', 400)
+
+    outcomes = run(npm_client.update_proxy_host_certificates([
+        {'proxy_host': first, 'certificate': 10}, {'proxy_host': second, 'certificate': 11},
+    ]))
+
+    assert sum(isinstance(outcome, BadRequest) for outcome in outcomes) == 1
+    assert sum(isinstance(outcome, dict) for outcome in outcomes) == 1
+
+
+def test_delete_certificates(fake_npm, npm_client):
+    expires = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+    cert_ids = [fake_npm.add_cert([f'{name}.example.com'], expires)['id'] for name in 'abc']
+    run(logged_in(npm_client))
+    fake_npm.fail('DELETE /api/nginx/certificates/{id}', 400)
+
+    outcomes = run(npm_client.delete_certificates(cert_ids))
+
+    assert sum(isinstance(outcome, BadRequest) for outcome in outcomes) == 1
+    assert outcomes.count(None) == 2
+    assert len(fake_npm.certs) == 1
+
+
+def test_bad_request_is_not_retried(fake_npm, npm_client):
+    run(logged_in(npm_client))
+    fake_npm.fail('GET /api/nginx/certificates', 400)
+
+    with pytest.raises(BadRequest):
+        run(npm_client.get_certificates())
+
+    assert fake_npm.calls['GET /api/nginx/certificates'] == 1
+
+
+def test_server_error_is_a_communication_error(fake_npm, npm_client):
+    run(logged_in(npm_client))
+    fake_npm.fail('GET /api/nginx/certificates', 502)
+    client = npm_client.client
+
+    with pytest.raises(CommunicationError):
+        client._response_parse(client._request('GET', f'{client.uri}/api/nginx/certificates'))
+
+
+def test_server_errors_are_retried(fake_npm, npm_client):
+    run(logged_in(npm_client))
+    fake_npm.fail('GET /api/nginx/certificates', 503)
+
+    assert run(npm_client.get_certificates()) == []
+    assert fake_npm.calls['GET /api/nginx/certificates'] == 2
+
+    fake_npm.fail('GET /api/nginx/certificates', 500, times=3)
+
+    with pytest.raises(GenericNPMError):
+        run(npm_client.get_certificates())
+
+
+def test_logs_in_again_when_the_token_is_refused(fake_npm, npm_client):
+    run(logged_in(npm_client))
+    fake_npm.fail('GET /api/nginx/certificates', 401)
+
+    assert run(npm_client.get_certificates()) == []
+    assert fake_npm.calls['POST /api/tokens'] == 2
+
+
+def test_token_is_refreshed_before_it_expires(fake_npm, npm_client):
+    # Within the refresh margin from the start, so the next request refreshes it first.
+    fake_npm.token_lifetime = datetime.timedelta(minutes=2)
+    run(logged_in(npm_client))
+    fake_npm.token_lifetime = datetime.timedelta(days=1)
+
+    run(npm_client.get_certificates())
+    run(npm_client.get_certificates())
+
+    assert fake_npm.calls['GET /api/tokens'] == 1
+    assert fake_npm.calls['POST /api/tokens'] == 1
+    assert fake_npm.calls['GET /api/nginx/certificates'] == 2
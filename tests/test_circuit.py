@@ -0,0 +1,218 @@
+import pytest
+from requests.exceptions import ConnectionError
+
+from step_npm_plugin.npm import circuit, decorators
+from step_npm_plugin.npm import CircuitBreaker, GenericNPMError, NotLoggedIn, BadRequest, CircuitOpen
+
+
+class Clock:
+    """
+    Stands in for the `time` module. Sleeping moves the clock on rather than waiting.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit, 'time', clock)
+    monkeypatch.setattr(decorators, 'time', clock)
+    # The longest delay allowed, rather than a random one.
+    monkeypatch.setattr(decorators.random, 'uniform', lambda low, high: high)
+
+    return clock
+
+
+def open_breaker(breaker: CircuitBreaker) -> None:
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker('GET /api/test')
+
+    for _ in range(circuit.FAILURE_THRESHOLD - 1):
+        assert breaker.record_failure() is False
+        assert breaker.allow()
+
+    assert breaker.record_failure() is True
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker('GET /api/test')
+
+    for _ in range(circuit.FAILURE_THRESHOLD - 1):
+        breaker.record_failure()
+    breaker.record_success()
+    for _ in range(circuit.FAILURE_THRESHOLD - 1):
+        breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_one_trial_request_after_the_reset_timeout(clock):
+    breaker = CircuitBreaker('GET /api/test')
+    open_breaker(breaker)
+
+    clock.now += circuit.RESET_TIMEOUT - 0.1
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    clock.now += 0.1
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_successful_trial_closes_the_circuit(clock):
+    breaker = CircuitBreaker('GET /api/test')
+    open_breaker(breaker)
+    clock.now += circuit.RESET_TIMEOUT
+    breaker.allow()
+
+    breaker.record_success()
+
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_failed_trial_opens_the_circuit_again(clock):
+    breaker = CircuitBreaker('GET /api/test')
+    open_breaker(breaker)
+    clock.now += circuit.RESET_TIMEOUT
+    breaker.allow()
+
+    # A single failure is enough, and the reset timeout starts over.
+    assert breaker.record_failure() is True
+    clock.now += circuit.RESET_TIMEOUT - 0.1
+    assert not breaker.allow()
+    clock.now += 0.1
+    assert breaker.allow()
+
+
+def test_trial_without_an_outcome_lets_another_through(clock):
+    breaker = CircuitBreaker('GET /api/test')
+    open_breaker(breaker)
+    clock.now += circuit.RESET_TIMEOUT
+    breaker.allow()
+
+    breaker.end_trial()
+
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_backoff_doubles_up_to_the_limit(clock):
+    assert [decorators.backoff_delay(attempt) for attempt in range(1, 7)] == [1, 2, 4, 8, 8, 8]
+
+
+def test_backoff_is_jittered():
+    delays = [decorators.backoff_delay(2) for _ in range(100)]
+
+    assert all(0 <= delay <= 2 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+class FakeClient:
+    """
+    Answers each request with the next of `answers`, raising it if it is an exception.
+    """
+
+    def __init__(self, *answers, failure_threshold: int = circuit.FAILURE_THRESHOLD):
+        self.answers = list(answers)
+        self.calls = 0
+        self.logins = 0
+        self.breaker = CircuitBreaker('GET /api/test', failure_threshold)
+
+    def circuit_breaker(self, method: str, endpoint: str) -> CircuitBreaker:
+        return self.breaker
+
+    def refresh_token(self) -> None:
+        pass
+
+    def login(self) -> None:
+        self.logins += 1
+
+    @decorators.retry_handler
+    def _get(self, uri: str):
+        self.calls += 1
+        answer = self.answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+def test_errors_are_retried_with_backoff(clock):
+    client = FakeClient(GenericNPMError(), ConnectionError(), {'id': 1})
+
+    assert client._get('/api/test') == {'id': 1}
+    assert client.calls == 3
+    assert clock.sleeps == [1, 2]
+    assert client.breaker._failures == 0
+
+
+def test_gives_up_after_the_retries(clock):
+    client = FakeClient(*[GenericNPMError()] * decorators.RETRIES)
+
+    with pytest.raises(GenericNPMError):
+        client._get('/api/test')
+
+    assert client.calls == decorators.RETRIES
+    # No wait after the last attempt.
+    assert len(clock.sleeps) == decorators.RETRIES - 1
+
+
+def test_bad_requests_are_not_retried(clock):
+    client = FakeClient(BadRequest())
+    client.breaker.record_failure()
+
+    with pytest.raises(BadRequest):
+        client._get('/api/test')
+
+    assert client.calls == 1
+    assert clock.sleeps == []
+    # NPM answered, so the endpoint is not failing.
+    assert client.breaker._failures == 0
+
+
+def test_expired_tokens_log_in_again_without_backoff(clock):
+    client = FakeClient(NotLoggedIn(), {'id': 1})
+
+    assert client._get('/api/test') == {'id': 1}
+    assert client.logins == 1
+    assert clock.sleeps == []
+
+
+def test_retries_stop_when_the_circuit_opens(clock):
+    client = FakeClient(*[GenericNPMError()] * decorators.RETRIES, failure_threshold=2)
+
+    with pytest.raises(CircuitOpen):
+        client._get('/api/test')
+    assert client.calls == 2
+
+    # Held back without a request while the circuit is open.
+    with pytest.raises(CircuitOpen):
+        client._get('/api/test')
+    assert client.calls == 2
+
+
+def test_trial_request_closes_the_circuit(clock):
+    client = FakeClient({'id': 1}, failure_threshold=1)
+    client.breaker.record_failure()
+
+    clock.now += circuit.RESET_TIMEOUT
+    assert client._get('/api/test') == {'id': 1}
+
+    assert client.breaker.state == CircuitBreaker.CLOSED
@@ -0,0 +1,213 @@
+import shlex
+import subprocess
+
+import pytest
+
+from step_npm_plugin.step import StepClient, StepCertificate, NotBootstrapped, IssuancePool, IssuanceJob
+from step_npm_plugin.step.exceptions import ProcessError
+
+from .conftest import make_certificate
+
+
+class FakeStep:
+    """
+    Stands in for `subprocess.run`, answering each step-cli command with the next of `answers` and recording the
+    commands run.
+    """
+
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.commands = []
+
+    def __call__(self, command: str, **kwargs):
+        self.commands.append(command)
+        answer = self.answers.pop(0)
+
+        if isinstance(answer, BaseException):
+            raise answer
+
+        if callable(answer):
+            answer = answer(command)
+
+        returncode, stdout = answer
+        return subprocess.CompletedProcess(command, returncode, stdout, b'' if returncode == 0 else b'failed')
+
+
+@pytest.fixture
+def step_client(tmp_path):
+    client = StepClient('https', 'ca.example.com', 9000, 'ab' * 32, tmp_path / 'pass', work_dir=tmp_path / 'work')
+    client.work_dir.mkdir()
+    client._bootstrapped = True
+    return client
+
+
+def run_with(monkeypatch, *answers) -> FakeStep:
+    fake = FakeStep(*answers)
+    monkeypatch.setattr(subprocess, 'run', fake)
+    return fake
+
+
+def test_get_ca_health_runs_step_ca_health(step_client, monkeypatch):
+    fake = run_with(monkeypatch, (0, b'ok\n'))
+
+    assert step_client.get_ca_health().stdout == b'ok\n'
+    assert fake.commands == ['step ca health']
+
+
+def test_get_ca_health_needs_a_bootstrap(step_client):
+    step_client._bootstrapped = False
+
+    with pytest.raises(NotBootstrapped):
+        step_client.get_ca_health()
+
+
+def test_check_health(step_client, monkeypatch):
+    run_with(monkeypatch, (0, b'ok\n'), (1, b''), subprocess.TimeoutExpired('step ca health', 1))
+
+    assert step_client.check_health()
+    assert not step_client.check_health()
+    assert not step_client.check_health(timeout=1)
+
+
+def step_output(certificate: StepCertificate, seen: dict = None):
+    """
+    An answer that writes `certificate` and its key where a step-cli command asks for them, keeping what the command
+    was given as the current certificate and key in `seen`.
+    """
+    def answer(command: str):
+        args = shlex.split(command)
+
+        if '--out' in args:
+            crt_file, key_file = args[args.index('--out') + 1], None
+        elif '--out-cert' in args:
+            crt_file, key_file = args[args.index('--out-cert') + 1], args[args.index('--out-key') + 1]
+        else:
+            crt_file, key_file = args[-2], args[-1]
+
+        if seen is not None and args[:3] != ['step', 'ca', 'certificate']:
+            seen['certificate'] = open(args[-2], 'rb').read()
+            seen['key'] = open(args[-1], 'rb').read()
+            if '--private-key' in args:
+                seen['private_key'] = open(args[args.index('--private-key') + 1], 'rb').read()
+
+        with open(crt_file, 'wb') as f:
+            f.write(certificate.chain_bytes)
+        if key_file is not None:
+            with open(key_file, 'wb') as f:
+                f.write(certificate.private_key_bytes)
+
+        return 0, b''
+
+    return answer
+
+
+def test_renew_keeps_the_key(step_client, monkeypatch):
+    current, renewed = make_certificate('a.example.com'), make_certificate('a.example.com')
+    seen = {}
+    fake = run_with(monkeypatch, step_output(renewed, seen))
+
+    certificate = step_client.renew_certificate(current, reuse_key=True)
+
+    assert fake.commands[0].startswith('step ca renew --out ')
+    assert '--force' in fake.commands[0]
+    # Authenticated with the current certificate and key.
+    assert seen == {'certificate': current.chain_bytes, 'key': current.private_key_bytes}
+    assert certificate.fingerprint == renewed.fingerprint
+    assert certificate.private_key_bytes == current.private_key_bytes
+    assert list(step_client.work_dir.iterdir()) == []
+
+
+def test_rekey_takes_the_new_key(step_client, monkeypatch):
+    current, rekeyed = make_certificate('a.example.com'), make_certificate('a.example.com')
+    fake = run_with(monkeypatch, step_output(rekeyed))
+
+    certificate = step_client.renew_certificate(current)
+
+    assert fake.commands[0].startswith('step ca rekey --out-cert ')
+    assert '--private-key' not in fake.commands[0]
+    assert certificate.fingerprint == rekeyed.fingerprint
+    assert certificate.private_key_bytes == rekeyed.private_key_bytes
+    assert list(step_client.work_dir.iterdir()) == []
+
+
+class FakeKeyPool:
+    def __init__(self, key_pem: bytes):
+        self.key_pem = key_pem
+
+    def get_pem(self) -> bytes:
+        return self.key_pem
+
+
+def test_rekey_with_a_pooled_key(step_client, monkeypatch):
+    current, rekeyed = make_certificate('a.example.com'), make_certificate('a.example.com')
+    step_client.key_pool = FakeKeyPool(rekeyed.private_key_bytes)
+    seen = {}
+    run_with(monkeypatch, step_output(rekeyed, seen))
+
+    certificate = step_client.renew_certificate(current)
+
+    assert seen['private_key'] == rekeyed.private_key_bytes
+    assert certificate.private_key_bytes == rekeyed.private_key_bytes
+    assert list(step_client.work_dir.iterdir()) == []
+
+
+@pytest.mark.parametrize('answer', [(1, b''), subprocess.TimeoutExpired('step ca rekey', 1)])
+def test_failed_renewals_clean_up(step_client, monkeypatch, answer):
+    run_with(monkeypatch, answer)
+
+    with pytest.raises(ProcessError):
+        step_client.renew_certificate(make_certificate('a.example.com'), timeout=1)
+
+    assert list(step_client.work_dir.iterdir()) == []
+
+
+def test_renew_needs_a_bootstrap(step_client):
+    step_client._bootstrapped = False
+
+    with pytest.raises(NotBootstrapped):
+        step_client.renew_certificate(make_certificate('a.example.com'))
+
+
+def issue(step_client: StepClient, job: IssuanceJob, renew_mode: str = 'rekey'):
+    pool = IssuancePool(step_client, max_workers=1, renew_mode=renew_mode)
+
+    try:
+        return list(pool.issue([job]))[0]
+    finally:
+        pool.shutdown()
+
+
+def test_pool_renews_before_issuing(step_client, monkeypatch):
+    renewed = make_certificate('a.example.com')
+    fake = run_with(monkeypatch, step_output(renewed))
+
+    result = issue(step_client, IssuanceJob('a.example.com', renews=make_certificate('a.example.com')))
+
+    assert result.certificate.fingerprint == renewed.fingerprint
+    assert [command.split()[:3] for command in fake.commands] == [['step', 'ca', 'rekey']]
+
+
+def test_pool_issues_anew_when_renewal_fails(step_client, monkeypatch):
+    issued = make_certificate('a.example.com')
+    fake = run_with(monkeypatch, (1, b''), step_output(issued))
+
+    result = issue(step_client, IssuanceJob('a.example.com', renews=make_certificate('a.example.com')), 'reuse-key')
+
+    assert result.ok
+    assert result.certificate.fingerprint == issued.fingerprint
+    assert [command.split()[:3] for command in fake.commands] == [
+        ['step', 'ca', 'renew'], ['step', 'ca', 'certificate']
+    ]
+    assert list(step_client.work_dir.iterdir()) == []
+
+
+# Expired a moment ago, or renewal switched off.
+@pytest.mark.parametrize('days, renew_mode', [(-0.0002, 'rekey'), (1, 'off')])
+def test_pool_issues_anew_without_renewing(step_client, monkeypatch, days, renew_mode):
+    fake = run_with(monkeypatch, step_output(make_certificate('a.example.com')))
+    current = make_certificate('a.example.com', days=days)
+
+    result = issue(step_client, IssuanceJob('a.example.com', renews=current), renew_mode)
+
+    assert result.ok
+    assert [command.split()[:3] for command in fake.commands] == [['step', 'ca', 'certificate']]
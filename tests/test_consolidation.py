@@ -0,0 +1,185 @@
+import pytest
+
+from benchmarks.fake_npm import SEED_CREATED_ON
+from step_npm_plugin.core.consolidation import Consolidator, parse_groups
+from step_npm_plugin.core.reconciler import Reconciler
+from step_npm_plugin.npm import Certificate, ProxyHost
+
+from .conftest import FakeStepClient, make_config
+from .test_reconciler import reconcile
+
+
+def host(*domains: str) -> ProxyHost:
+    return ProxyHost(id=1, primary_domain=domains[0], sans=domains[1:], certificate_id=0, created_on=None)
+
+
+def certificate(nice_name: str or None) -> Certificate:
+    return Certificate(id=1, primary_domain='a.example.com', sans=(), expires=None, nice_name=nice_name)
+
+
+def test_groups_are_parsed_in_order():
+    assert parse_groups('media=Plex.Example.com,*.media.example.com; lab=*.lab.example.net') == [
+        ('media', ['plex.example.com', '*.media.example.com']), ('lab', ['*.lab.example.net'])
+    ]
+    assert parse_groups(None) == []
+
+
+@pytest.mark.parametrize('value', ['media', '=a.example.com', 'media='])
+def test_invalid_groups_are_refused(value):
+    with pytest.raises(ValueError):
+        parse_groups(value)
+
+
+def test_unknown_modes_are_refused():
+    with pytest.raises(ValueError):
+        Consolidator('everything')
+
+
+def test_hosts_are_grouped_by_registrable_domain():
+    consolidator = Consolidator('domain', parse_groups('lab=*.lab.example.com'))
+
+    assert consolidator.group_of(host('a.example.com')) == 'example.com'
+    assert consolidator.group_of(host('a.b.example.co.uk')) == 'example.co.uk'
+    # Explicit groups come first.
+    assert consolidator.group_of(host('x.lab.example.com')) == 'lab'
+    assert consolidator.group_of(host('10.0.0.1')) is None
+
+
+def test_only_explicit_groups_in_groups_mode():
+    consolidator = Consolidator('groups', parse_groups('lab=*.lab.example.com'))
+
+    assert consolidator.group_of(host('X.Lab.example.com')) == 'lab'
+    assert consolidator.group_of(host('a.example.com')) is None
+    assert Consolidator().group_of(host('x.lab.example.com')) is None
+
+
+def test_names_without_wildcards():
+    consolidator = Consolidator('domain')
+
+    assert consolidator.names(['b.example.com', 'A.example.com.', 'a.example.com', None]) == [
+        'a.example.com', 'b.example.com'
+    ]
+    # Wildcards already given are kept, and cover their names.
+    assert consolidator.names(['a.example.com', '*.example.com', 'a.b.example.com']) == [
+        '*.example.com', 'a.b.example.com'
+    ]
+
+
+def test_siblings_are_covered_by_a_wildcard():
+    consolidator = Consolidator('domain', wildcard=True)
+
+    assert consolidator.names(['a.lab.example.com', 'b.lab.example.com', 'c.example.com']) == [
+        '*.lab.example.com', 'c.example.com'
+    ]
+    assert consolidator.names(['a.lab.example.com', 'b.lab.example.com', 'lab.example.com', 'c.example.com']) == [
+        '*.example.com', '*.lab.example.com'
+    ]
+
+
+def test_public_suffixes_are_never_wildcarded():
+    consolidator = Consolidator('domain', wildcard=True)
+
+    assert consolidator.names(['example.co.uk', 'other.co.uk']) == ['example.co.uk', 'other.co.uk']
+    assert consolidator.names(['a.example.co.uk', 'b.example.co.uk']) == ['*.example.co.uk']
+
+
+@pytest.mark.parametrize('nice_name, group', [
+    ('step-npm-group:lab', 'lab'),
+    ('step-npm-group:example.com', 'example.com'),
+    ('a.example.com', None),
+    ('', None),
+    (None, None),
+])
+def test_group_certificates_are_found_by_nice_name(nice_name, group):
+    consolidator = Consolidator('domain')
+
+    assert consolidator.is_group_certificate(certificate(nice_name)) is (group is not None)
+    assert consolidator.group_of_certificate(certificate(nice_name)) == group
+
+
+@pytest.fixture
+def step_client():
+    return FakeStepClient()
+
+
+@pytest.fixture
+def make_reconciler(npm_client, step_client):
+    reconcilers = []
+
+    def make(*argv: str) -> Reconciler:
+        reconcilers.append(Reconciler(make_config('--consolidate', 'domain', *argv), step_client, npm_client))
+        return reconcilers[-1]
+
+    yield make
+
+    for reconciler in reconcilers:
+        reconciler.issuance_pool.shutdown()
+
+
+def add_hosts(fake_npm, *domains: str) -> list:
+    return [fake_npm.add_host([domain], 0, SEED_CREATED_ON)['id'] for domain in domains]
+
+
+def certificate_of(fake_npm, host_id: int) -> int:
+    return fake_npm.hosts[host_id]['certificate_id']
+
+
+def test_hosts_share_a_certificate(fake_npm, make_reconciler, step_client):
+    hosts = add_hosts(fake_npm, 'a.example.com', 'b.example.com', 'c.example.net')
+
+    reconcile(make_reconciler())
+
+    assert sorted(step_client.issued) == [('a.example.com', 'b.example.com'), ('c.example.net',)]
+    assert certificate_of(fake_npm, hosts[0]) == certificate_of(fake_npm, hosts[1]) != 0
+    assert fake_npm.certs[certificate_of(fake_npm, hosts[0])]['nice_name'] == 'step-npm-group:example.com'
+
+
+def test_new_hosts_join_the_group(fake_npm, make_reconciler, step_client):
+    reconciler = make_reconciler()
+    hosts = add_hosts(fake_npm, 'a.example.com', 'b.example.com')
+    reconcile(reconciler)
+    old = certificate_of(fake_npm, hosts[0])
+
+    hosts += add_hosts(fake_npm, 'c.example.com')
+    reconcile(reconciler)
+
+    assert step_client.issued[-1] == ('a.example.com', 'b.example.com', 'c.example.com')
+    assert len({certificate_of(fake_npm, host_id) for host_id in hosts}) == 1
+    # The certificate it replaced on every host is deleted.
+    assert old not in fake_npm.certs
+
+
+def test_full_groups_give_new_hosts_a_certificate_of_their_own(fake_npm, make_reconciler, step_client):
+    hosts = add_hosts(fake_npm, 'a.example.com', 'b.example.com', 'c.example.com')
+
+    reconcile(make_reconciler('--consolidate-max-names', '2'))
+
+    assert sorted(step_client.issued) == [('a.example.com', 'b.example.com'), ('c.example.com',)]
+    assert certificate_of(fake_npm, hosts[0]) == certificate_of(fake_npm, hosts[1]) != certificate_of(
+        fake_npm, hosts[2]
+    )
+
+
+def test_hosts_that_left_make_room_in_the_group(fake_npm, make_reconciler, step_client):
+    reconciler = make_reconciler('--consolidate-max-names', '2')
+    hosts = add_hosts(fake_npm, 'a.example.com', 'b.example.com')
+    reconcile(reconciler)
+
+    del fake_npm.hosts[hosts[0]]
+    hosts = [hosts[1], *add_hosts(fake_npm, 'c.example.com')]
+    reconcile(reconciler)
+
+    assert step_client.issued[-1] == ('b.example.com', 'c.example.com')
+    assert certificate_of(fake_npm, hosts[0]) == certificate_of(fake_npm, hosts[1])
+
+
+def test_wildcards_cover_further_hosts_without_reissue(fake_npm, make_reconciler, step_client):
+    reconciler = make_reconciler('--consolidate-wildcard', '1')
+    hosts = add_hosts(fake_npm, 'a.lab.example.com', 'b.lab.example.com')
+    reconcile(reconciler)
+
+    hosts += add_hosts(fake_npm, 'c.lab.example.com')
+    reconcile(reconciler)
+
+    assert step_client.issued == [('*.lab.example.com',)]
+    assert len({certificate_of(fake_npm, host_id) for host_id in hosts}) == 1
@@ -0,0 +1,166 @@
+import sqlite3
+import threading
+
+import pytest
+
+from step_npm_plugin.core import coordination
+from step_npm_plugin.core.coordination import Lease, Shard
+
+
+class Clock:
+    """
+    Stands in for the `time` module, so leases expire without waiting.
+    """
+
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(coordination, 'time', clock)
+
+    return clock
+
+
+@pytest.fixture
+def leases(tmp_path):
+    """
+    Makes leases of the same name in one SQLite file, as replicas sharing a volume would.
+    """
+    made = []
+
+    def make(holder: str, ttl: float = 30) -> Lease:
+        made.append(Lease(tmp_path / 'lease.db', 'shard-0-of-1', holder, ttl))
+        return made[-1]
+
+    yield make
+
+    for lease in made:
+        lease.close()
+
+
+def test_only_one_holder_at_a_time(clock, leases):
+    first, second = leases('first'), leases('second')
+
+    assert first.acquire()
+    assert not second.acquire()
+    assert first.held and not second.held
+
+
+def test_renewing_keeps_the_lease(clock, leases):
+    first, second = leases('first'), leases('second')
+    first.acquire()
+
+    clock.now += 20
+    assert first.acquire()
+    clock.now += 20
+
+    # Past the first expiry, but not the renewed one.
+    assert first.held
+    assert not second.acquire()
+
+
+def test_expired_leases_are_taken_over(clock, leases):
+    first, second = leases('first'), leases('second')
+    first.acquire()
+
+    clock.now += 30
+
+    assert not first.held
+    assert second.acquire()
+    # The old holder cannot take it back while the new one renews.
+    assert not first.acquire()
+
+
+def test_released_leases_are_free_straight_away(clock, leases):
+    first, second = leases('first'), leases('second')
+    first.acquire()
+
+    first.release()
+
+    assert not first.held
+    assert second.acquire()
+
+
+def test_releasing_a_lease_held_by_another_replica_leaves_it(clock, leases):
+    first, second = leases('first'), leases('second')
+    first.acquire()
+
+    second.release()
+
+    assert not second.acquire()
+    assert first.acquire()
+
+
+def test_concurrent_replicas_take_the_lease_once(leases):
+    contenders = [leases(f'replica-{i}') for i in range(8)]
+    start = threading.Barrier(len(contenders))
+    results = {}
+
+    def contend(lease: Lease) -> None:
+        start.wait()
+        results[lease.holder] = lease.acquire()
+
+    threads = [threading.Thread(target=contend, args=(lease,)) for lease in contenders]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert sorted(results.values()) == [False] * 7 + [True]
+
+
+def test_locked_files_leave_the_lease_unheld(tmp_path, leases):
+    lease = leases('first', ttl=0.3)
+    lease.acquire()
+    other = sqlite3.connect(tmp_path / 'lease.db', isolation_level=None)
+    other.execute('BEGIN IMMEDIATE')
+
+    try:
+        assert not lease.acquire()
+        assert not lease.held
+    finally:
+        other.execute('ROLLBACK')
+        other.close()
+
+
+@pytest.mark.parametrize('key, index', [
+    ('a.example.com', 1),
+    ('c.example.com', 3),
+    ('d.example.com', 0),
+    ('e.example.com', 2),
+    ('example.com', 1),
+    ('media', 1),
+])
+def test_shards_are_stable(key, index):
+    # Pinned, as replicas of different versions must agree on who owns what.
+    assert [shard for shard in range(4) if Shard(shard, 4).owns(key)] == [index]
+
+
+def test_shards_use_the_normalised_domain():
+    for shard in range(4):
+        assert Shard(shard, 4).owns('C.Example.com.') == Shard(shard, 4).owns('c.example.com')
+
+
+def test_shards_split_domains_evenly():
+    domains = [f'host{i}.example.com' for i in range(4000)]
+    counts = [sum(Shard(shard, 4).owns(domain) for domain in domains) for shard in range(4)]
+
+    assert sum(counts) == len(domains)
+    assert all(900 < count < 1100 for count in counts)
+
+
+def test_a_single_shard_owns_everything():
+    assert Shard().owns('a.example.com')
+    assert Shard().owns(None)
+
+
+@pytest.mark.parametrize('index, count', [(1, 1), (-1, 2), (0, 0)])
+def test_invalid_shards_are_refused(index, count):
+    with pytest.raises(ValueError):
+        Shard(index, count)
@@ -0,0 +1,95 @@
+import datetime
+
+import pytest
+
+from step_npm_plugin.schedule import CronExpression
+from step_npm_plugin.schedule.cron import parse_field
+
+
+def next_after(expression: str, after: datetime.datetime) -> datetime.datetime:
+    """
+    The next match of `expression` after `after`, both in local time as cron works in.
+    """
+    return datetime.datetime.fromtimestamp(CronExpression(expression).next_after(after.timestamp()))
+
+
+@pytest.mark.parametrize('field, expected', [
+    ('*', set(range(0, 60))),
+    ('5', {5}),
+    ('10-12', {10, 11, 12}),
+    ('*/15', {0, 15, 30, 45}),
+    ('1-10/3', {1, 4, 7, 10}),
+    ('5/20', {5, 25, 45}),
+    ('5,10-12,50', {5, 10, 11, 12, 50}),
+])
+def test_fields(field, expected):
+    assert parse_field(field, 0, 59) == expected
+
+
+@pytest.mark.parametrize('field', ['60', '10-5', '*/0', 'a', '1-', '5/x'])
+def test_invalid_fields_are_refused(field):
+    with pytest.raises(ValueError):
+        parse_field(field, 0, 59)
+
+
+def test_expressions_need_five_or_six_fields():
+    with pytest.raises(ValueError):
+        CronExpression('* * * *')
+
+
+@pytest.mark.parametrize('weekday, expected', [
+    ('7', {0}),
+    ('0', {0}),
+    ('5-7', {5, 6, 0}),
+    ('1,7', {1, 0}),
+    ('*', set(range(0, 7))),
+])
+def test_sunday_is_0_or_7(weekday, expected):
+    assert CronExpression(f'0 0 * * {weekday}')._weekdays == expected
+
+
+def test_weekday_range_ending_on_sunday():
+    # Saturday 2024-06-01, so the next Friday to Sunday is straight after.
+    assert next_after('0 9 * * 5-7', datetime.datetime(2024, 6, 1, 10, 0)) == datetime.datetime(2024, 6, 2, 9, 0)
+
+
+@pytest.mark.parametrize('alias, expected', [
+    ('@hourly', datetime.datetime(2024, 1, 31, 11, 0)),
+    ('@daily', datetime.datetime(2024, 2, 1, 0, 0)),
+    ('@midnight', datetime.datetime(2024, 2, 1, 0, 0)),
+    ('@weekly', datetime.datetime(2024, 2, 4, 0, 0)),
+    ('@monthly', datetime.datetime(2024, 2, 1, 0, 0)),
+    ('@yearly', datetime.datetime(2025, 1, 1, 0, 0)),
+])
+def test_aliases(alias, expected):
+    assert next_after(alias, datetime.datetime(2024, 1, 31, 10, 30)) == expected
+
+
+def test_day_of_month_or_day_of_week_when_both_are_restricted():
+    # Sunday 2024-09-01. The 13th, or any Friday, whichever comes first.
+    assert next_after('0 0 13 * 5', datetime.datetime(2024, 9, 1)) == datetime.datetime(2024, 9, 6)
+    assert next_after('0 0 13 * 5', datetime.datetime(2024, 9, 10)) == datetime.datetime(2024, 9, 13)
+
+
+def test_day_of_month_and_day_of_week_when_only_one_is_restricted():
+    assert next_after('0 0 13 * *', datetime.datetime(2024, 9, 1)) == datetime.datetime(2024, 9, 13)
+    assert next_after('0 0 * * 5', datetime.datetime(2024, 9, 1)) == datetime.datetime(2024, 9, 6)
+
+
+def test_next_crosses_month_and_year_boundaries():
+    assert next_after('0 0 31 * *', datetime.datetime(2024, 4, 1)) == datetime.datetime(2024, 5, 31)
+    assert next_after('30 23 * * *', datetime.datetime(2024, 12, 31, 23, 45)) == datetime.datetime(2025, 1, 1, 23, 30)
+    assert next_after('0 0 29 2 *', datetime.datetime(2024, 3, 1)) == datetime.datetime(2028, 2, 29)
+
+
+def test_seconds_field():
+    assert next_after('*/20 * * * * *', datetime.datetime(2024, 1, 1, 0, 0, 41)) == datetime.datetime(
+        2024, 1, 1, 0, 1, 0
+    )
+    # A match is always after the time given, never at it.
+    assert next_after('0 * * * * *', datetime.datetime(2024, 1, 1, 0, 1, 0)) == datetime.datetime(2024, 1, 1, 0, 2, 0)
+
+
+def test_impossible_expressions_are_refused():
+    with pytest.raises(ValueError):
+        next_after('0 0 31 2 *', datetime.datetime(2024, 1, 1))
@@ -0,0 +1,82 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from step_npm_plugin.step import CAHealth, CAUnavailable, IssuancePool, IssuanceJob
+
+from .conftest import FakeStepClient
+
+
+class ProbedStepClient:
+    """
+    Holds every health probe until `release` is set, answering with `up`.
+    """
+
+    def __init__(self, up: bool = True):
+        self.up = up
+        self.probes = 0
+        self.probing = threading.Event()
+        self.release = threading.Event()
+
+    def check_health(self, timeout: float = None) -> bool:
+        self.probes += 1
+        self.probing.set()
+        self.release.wait(5)
+        return self.up
+
+
+def test_concurrent_callers_share_one_probe():
+    step = ProbedStepClient()
+    health = CAHealth(step)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = [executor.submit(health.available) for _ in range(4)]
+        step.probing.wait(5)
+        step.release.set()
+
+        assert all(result.result(5) for result in results)
+
+    assert step.probes == 1
+
+
+def test_issuances_are_recorded_while_probing():
+    step = ProbedStepClient(up=False)
+    health = CAHealth(step)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        probe = executor.submit(health.available)
+        step.probing.wait(5)
+
+        recorded = threading.Thread(target=health.record_success)
+        recorded.start()
+        recorded.join(1)
+
+        # The lock is not held while probing, so the outcome of an issuance does not wait for the probe.
+        assert not recorded.is_alive()
+
+        step.release.set()
+        assert probe.result(5) is False
+
+    assert not health.up
+
+
+class BrokenProbeStepClient(FakeStepClient):
+    def check_health(self, timeout: float = None) -> bool:
+        raise RuntimeError('probe failed')
+
+
+def test_probe_errors_count_as_unavailable():
+    health = CAHealth(BrokenProbeStepClient())
+
+    assert health.available() is False
+    assert not health.up
+
+
+def test_probe_errors_do_not_fail_the_job():
+    step = BrokenProbeStepClient()
+    pool = IssuancePool(step, health=CAHealth(step))
+
+    results = list(pool.issue([IssuanceJob('a.example.com')]))
+    pool.shutdown()
+
+    assert isinstance(results[0].error, CAUnavailable)
+    assert step.issued == []
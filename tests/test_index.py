@@ -0,0 +1,42 @@
+import datetime
+
+from step_npm_plugin.npm import CertificateIndex, HostIndex, ProxyHost, Certificate, wildcard_for
+
+
+def host(host_id: int, *domains: str, certificate_id: int = 0) -> ProxyHost:
+    return ProxyHost(host_id, domains[0] if domains else None, domains[1:], certificate_id, None)
+
+
+def certificate(cert_id: int, *domains: str) -> Certificate:
+    return Certificate(cert_id, domains[0], domains[1:], datetime.datetime(2030, 1, 1))
+
+
+def test_wildcard_for():
+    assert wildcard_for('a.example.com') == '*.example.com'
+    assert wildcard_for('A.Example.com.') == '*.example.com'
+    assert wildcard_for('localhost') is None
+
+
+def test_wildcard_for_empty_domain():
+    assert wildcard_for(None) is None
+    assert wildcard_for('') is None
+
+
+def test_certificate_index_finds_by_name_and_wildcard():
+    index = CertificateIndex([certificate(1, 'a.example.com'), certificate(2, '*.example.com')])
+
+    assert index.find('a.example.com').id == 1
+    assert index.find('b.example.com').id == 2
+    assert index.find('b.example.com', 'a.example.com').id == 2
+    assert index.find('a.b.example.com') is None
+
+
+def test_indexes_ignore_hosts_without_domains():
+    index = CertificateIndex([certificate(1, 'a.example.com')])
+    hosts = HostIndex([host(1), host(2, 'a.example.com', certificate_id=1)])
+
+    assert index.find(None) is None
+    assert index.lookup('') == []
+    assert hosts.by_domain(None) == []
+    assert [found.id for found in hosts.by_domain('a.example.com')] == [2]
+    assert [found.id for found in hosts.using_certificate(1)] == [2]
@@ -0,0 +1,151 @@
+import json
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature
+from cryptography.hazmat.primitives.serialization import Encoding
+
+from step_npm_plugin.core.data_types import SecureString
+from step_npm_plugin.step import NativeStepClient, GenericStepError, NotBootstrapped, SigningError
+from step_npm_plugin.step.native import (
+    PBES2_ALGORITHMS, TOKEN_LIFETIME, ProvisionerKey, b64url_encode, decrypt_jwe
+)
+
+from .mock_ca import MockCA, ec_jwk, encrypt_jwe
+
+
+@pytest.fixture
+def mock_ca():
+    ca = MockCA()
+    ca.start()
+
+    yield ca
+
+    ca.stop()
+
+
+@pytest.fixture
+def native_client(mock_ca, tmp_path):
+    return NativeStepClient(
+        'https', '127.0.0.1', mock_ca.port, mock_ca.fingerprint, SecureString(mock_ca.password),
+        root_file=tmp_path / 'root_ca.crt'
+    )
+
+
+def verify_es(key: ec.EllipticCurvePrivateKey, signature: bytes, data: bytes, algorithm) -> None:
+    size = len(signature) // 2
+    key.public_key().verify(
+        encode_dss_signature(int.from_bytes(signature[:size], 'big'), int.from_bytes(signature[size:], 'big')),
+        data, ec.ECDSA(algorithm)
+    )
+
+
+@pytest.mark.parametrize('alg', sorted(PBES2_ALGORITHMS))
+@pytest.mark.parametrize('enc', ['A128GCM', 'A256GCM'])
+def test_decrypt_jwe_round_trip(alg, enc):
+    token = encrypt_jwe(b'{"kty": "EC"}', 'secret', alg, enc)
+
+    assert decrypt_jwe(token, SecureString('secret')) == b'{"kty": "EC"}'
+
+
+def test_decrypt_jwe_wrong_password():
+    with pytest.raises(GenericStepError, match='password'):
+        decrypt_jwe(encrypt_jwe(b'{}', 'secret'), SecureString('wrong'))
+
+
+def test_decrypt_jwe_unsupported():
+    header = b64url_encode(json.dumps({'alg': 'RSA-OAEP', 'enc': 'A256GCM'}).encode())
+
+    with pytest.raises(GenericStepError, match='Unsupported'):
+        decrypt_jwe(f'{header}.a.b.c.d', SecureString('secret'))
+
+    with pytest.raises(GenericStepError, match='compact'):
+        decrypt_jwe('not-a-jwe', SecureString('secret'))
+
+
+@pytest.mark.parametrize('curve, algorithm, name', [
+    (ec.SECP256R1, hashes.SHA256, 'ES256'), (ec.SECP384R1, hashes.SHA384, 'ES384'),
+])
+def test_provisioner_key_signs_ec(curve, algorithm, name):
+    key = ec.generate_private_key(curve())
+    provisioner = ProvisionerKey('admin', ec_jwk(key, 'kid'))
+
+    assert provisioner.algorithm == name and provisioner.kid == 'kid'
+    verify_es(key, provisioner.sign(b'data'), b'data', algorithm())
+
+
+def test_provisioner_key_signs_ed25519():
+    key = ed25519.Ed25519PrivateKey.generate()
+    private_bytes = key.private_bytes_raw()
+    provisioner = ProvisionerKey('admin', {'kty': 'OKP', 'crv': 'Ed25519', 'd': b64url_encode(private_bytes)})
+
+    assert provisioner.algorithm == 'EdDSA'
+    key.public_key().verify(provisioner.sign(b'data'), b'data')
+
+
+def test_provisioner_key_unsupported():
+    with pytest.raises(GenericStepError):
+        ProvisionerKey('admin', {'kty': 'RSA'})
+
+
+def test_requires_bootstrap(native_client):
+    with pytest.raises(NotBootstrapped):
+        native_client.issue_certificate('a.example.com')
+
+
+def test_bootstrap_fetches_and_keeps_the_root(native_client, mock_ca):
+    native_client.bootstrap()
+
+    assert native_client.root_file.read_bytes() == mock_ca.root.public_bytes(Encoding.PEM)
+    assert native_client._provisioner.name == 'admin'
+    assert native_client._provisioner.kid == 'mock-kid'
+    assert native_client.get_ca_health() == {'status': 'ok'}
+    assert native_client.check_health()
+
+
+def test_bootstrap_checks_the_fingerprint(native_client, mock_ca):
+    native_client.ca_fingerprint = 'ab' * 32
+
+    with pytest.raises(GenericStepError):
+        native_client.bootstrap()
+
+    assert not native_client.root_file.exists()
+
+
+def test_create_token_claims(native_client, mock_ca):
+    native_client.bootstrap()
+
+    claims = mock_ca.verify_token(native_client.create_token('a.example.com', 'a.example.com', 'b.example.com'))
+
+    assert claims['header'] == {'alg': 'ES256', 'kid': 'mock-kid', 'typ': 'JWT'}
+    assert claims['aud'] == f'{mock_ca.url}/1.0/sign'
+    assert claims['sha'] == mock_ca.fingerprint
+    assert claims['sub'] == 'a.example.com'
+    assert claims['sans'] == ['a.example.com', 'b.example.com']
+    assert claims['iss'] == 'admin'
+    assert claims['exp'] - claims['nbf'] == TOKEN_LIFETIME
+    assert len(claims['jti']) == 64
+
+
+def test_issue_certificate(native_client, mock_ca):
+    native_client.bootstrap()
+
+    certificate = native_client.issue_certificate('a.example.com', 'b.example.com')
+
+    sans = certificate.certificate.extensions.get_extension_for_class(x509.SubjectAlternativeName).value
+    assert sans.get_values_for_type(x509.DNSName) == ['a.example.com', 'b.example.com']
+    assert certificate.certificate.issuer == mock_ca.intermediate.subject
+    assert certificate.intermediates[0].subject == mock_ca.intermediate.subject
+    public_key = certificate.certificate.public_key()
+    assert public_key.public_numbers() == certificate.private_key.public_key().public_numbers()
+    assert mock_ca.tokens[0]['sans'] == ['a.example.com', 'b.example.com']
+
+
+def test_issue_certificate_refused(native_client, mock_ca):
+    native_client.bootstrap()
+    mock_ca.refuse = True
+
+    with pytest.raises(SigningError, match='403'):
+        native_client.issue_certificate('a.example.com')
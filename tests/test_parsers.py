@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+from step_npm_plugin.npm import RecordCache, iter_json_array, parse_http_host, parse_http_hosts
+
+
+def chunked(data: bytes, size: int) -> list:
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 64 * 1024])
+@pytest.mark.parametrize('document', [
+    '[1.5e3]',
+    '[0, -12, 3.25, 1E-2, 12345678901234567890]',
+    '[true, false, null]',
+    '["plain", "escaped \\"quote\\"", "back\\\\slash", "bracket ] and comma ,", "\\u00e9t\\u00e9"]',
+    '[{"id": 1, "domain_names": ["a.example.com"], "meta": {"nested": [1, {"deep": "]"}]}}, {"id": 2}]',
+    '[]',
+    ' [ 1 , "two" , {"three": 3} ] ',
+])
+def test_decodes_whatever_the_chunk_size(document, size):
+    assert list(iter_json_array(chunked(document.encode(), size))) == json.loads(document)
+
+
+@pytest.mark.parametrize('size', [1, 2, 5])
+def test_multibyte_characters_split_across_chunks(size):
+    document = json.dumps([{'nice_name': 'ünïcødé ✓'}], ensure_ascii=False)
+
+    assert list(iter_json_array(chunked(document.encode(), size))) == [{'nice_name': 'ünïcødé ✓'}]
+
+
+def test_elements_are_yielded_as_they_complete():
+    chunks = iter([b'[{"id": 1}, ', b'{"id": 2'])
+    elements = iter_json_array(chunks)
+
+    assert next(elements) == {'id': 1}
+    with pytest.raises(json.JSONDecodeError):
+        next(elements)
+
+
+@pytest.mark.parametrize('document', [b'{"id": 1}', b'[1, 2', b'[1.5e'])
+def test_invalid_documents_are_refused(document):
+    with pytest.raises(ValueError):
+        list(iter_json_array(chunked(document, 1)))
+
+
+def host(host_id: int, modified_on: str, certificate_id: int = 0) -> dict:
+    return {
+        'id': host_id, 'domain_names': [f'host{host_id}.example.com'], 'certificate_id': certificate_id,
+        'created_on': '2022-01-01 00:00:00', 'modified_on': modified_on,
+    }
+
+
+def test_unchanged_entries_reuse_their_record():
+    cache = RecordCache('certificate_id')
+    first = parse_http_hosts([host(1, '2022-01-01 00:00:00'), host(2, '2022-01-01 00:00:00')], cache)
+
+    second = parse_http_hosts([host(1, '2022-01-01 00:00:00'), host(2, '2022-01-02 00:00:00')], cache)
+
+    assert second[0] is first[0]
+    assert second[1] is not first[1]
+    assert second[1] == parse_http_host(host(2, '2022-01-02 00:00:00'))
+
+
+def test_extra_key_fields_are_compared():
+    cache = RecordCache('certificate_id')
+    first = parse_http_hosts([host(1, '2022-01-01 00:00:00')], cache)
+
+    # Given a certificate within the same second, so only `certificate_id` tells the entries apart.
+    second = parse_http_hosts([host(1, '2022-01-01 00:00:00', certificate_id=5)], cache)
+
+    assert second[0] is not first[0]
+    assert second[0].certificate_id == 5
+
+
+def test_forgotten_and_unversioned_entries_are_parsed_again():
+    cache = RecordCache()
+    first = parse_http_hosts([host(1, '2022-01-01 00:00:00'), host(2, None)], cache)
+
+    cache.forget([1])
+    second = parse_http_hosts([host(1, '2022-01-01 00:00:00'), host(2, None)], cache)
+
+    assert second[0] is not first[0] and second[0] == first[0]
+    assert second[1] is not first[1]
+    assert len(cache) == 2
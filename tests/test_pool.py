@@ -0,0 +1,60 @@
+import threading
+
+from step_npm_plugin.step import IssuancePool, IssuanceJob
+
+from .conftest import FakeStepClient
+
+
+class SlowStepClient(FakeStepClient):
+    """
+    Holds every issuance until `release` is set, so jobs are still in flight when the next ones are submitted.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def issue_certificate(self, common_name: str, *sans: str, timeout: float = None):
+        self.release.wait(5)
+        return super().issue_certificate(common_name, *sans, timeout=timeout)
+
+
+def test_every_job_gets_a_result():
+    pool = IssuancePool(FakeStepClient(), max_workers=2)
+    jobs = [IssuanceJob(f'{name}.example.com') for name in 'abc']
+
+    results = list(pool.issue(jobs))
+    pool.shutdown()
+
+    assert sorted(result.job.common_name for result in results) == ['a.example.com', 'b.example.com', 'c.example.com']
+    assert all(result.ok for result in results)
+
+
+def test_jobs_for_the_same_certificate_share_one_issuance():
+    step = SlowStepClient()
+    pool = IssuancePool(step, max_workers=2)
+    first = IssuanceJob('a.example.com', 'b.example.com', context='first', reuse=False)
+    second = IssuanceJob('a.example.com', 'b.example.com', 'a.example.com', context='second', reuse=False)
+
+    futures = pool.submit([first, second])
+    step.release.set()
+    results = [future.result(5) for future in futures]
+    pool.shutdown()
+
+    assert len(step.issued) == 1
+    assert [result.job.context for result in results] == ['first', 'second']
+    assert results[0].certificate is results[1].certificate
+
+
+def test_shared_jobs_share_failures():
+    class FailingStepClient(FakeStepClient):
+        def issue_certificate(self, common_name: str, *sans: str, timeout: float = None):
+            raise RuntimeError('refused')
+
+    pool = IssuancePool(FailingStepClient(), max_workers=1)
+
+    results = list(pool.issue([IssuanceJob('a.example.com'), IssuanceJob('a.example.com')]))
+    pool.shutdown()
+
+    assert len(results) == 2
+    assert all(isinstance(result.error, RuntimeError) for result in results)
@@ -0,0 +1,171 @@
+import asyncio
+import datetime
+
+import pytest
+
+from benchmarks.fake_npm import SEED_CREATED_ON, SEED_LIFETIME, npm_time
+from step_npm_plugin.core import reconciler as reconciler_module
+from step_npm_plugin.core.fleet import Fleet
+from step_npm_plugin.core.reconciler import Reconciler
+from step_npm_plugin.npm import GenericNPMError
+
+from .conftest import FakeStepClient, make_config
+
+
+def reconcile(reconciler: Reconciler, cycles: int = 1) -> None:
+    async def run():
+        await reconciler.npm_client.login()
+        for _ in range(cycles):
+            await reconciler.reconcile()
+
+    asyncio.run(run())
+
+
+@pytest.fixture
+def step_client():
+    return FakeStepClient()
+
+
+@pytest.fixture
+def reconciler(npm_client, step_client):
+    reconciler = Reconciler(make_config(), step_client, npm_client)
+
+    yield reconciler
+
+    reconciler.issuance_pool.shutdown()
+
+
+def add_certificate(fake_npm, domain_names: list, expires: datetime.datetime) -> int:
+    return fake_npm.add_cert(domain_names, expires, npm_time(expires - SEED_LIFETIME))['id']
+
+
+def test_issues_certificates_for_http_only_hosts(fake_npm, reconciler, step_client):
+    host_id = fake_npm.add_host(['a.example.com', 'www.a.example.com'], 0, SEED_CREATED_ON)['id']
+
+    reconcile(reconciler)
+
+    assert step_client.issued == [('a.example.com', 'www.a.example.com')]
+    assert fake_npm.hosts[host_id]['certificate_id'] in fake_npm.certs
+
+
+def test_renews_every_due_certificate_for_the_same_names(fake_npm, reconciler, step_client):
+    expired = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+    first = add_certificate(fake_npm, ['a.example.com'], expired)
+    second = add_certificate(fake_npm, ['a.example.com'], expired)
+    first_host = fake_npm.add_host(['a.example.com'], first, SEED_CREATED_ON)['id']
+    second_host = fake_npm.add_host(['a.example.com'], second, SEED_CREATED_ON)['id']
+
+    reconcile(reconciler)
+
+    assert len(step_client.issued) == 1
+    assert first not in fake_npm.certs and second not in fake_npm.certs
+    assert fake_npm.hosts[first_host]['certificate_id'] in fake_npm.certs
+    assert fake_npm.hosts[second_host]['certificate_id'] in fake_npm.certs
+
+
+def test_fleet_renews_every_due_certificate_for_the_same_names(fake_npm, reconciler, step_client):
+    expired = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+    certs = [add_certificate(fake_npm, ['a.example.com'], expired) for _ in range(2)]
+    hosts = [fake_npm.add_host(['a.example.com'], cert_id, SEED_CREATED_ON)['id'] for cert_id in certs]
+    fleet = Fleet([reconciler], reconciler.issuance_pool)
+
+    async def run():
+        await reconciler.npm_client.login()
+        await fleet.reconcile()
+
+    asyncio.run(run())
+
+    assert len(step_client.issued) == 1
+    assert not any(cert_id in fake_npm.certs for cert_id in certs)
+    assert all(fake_npm.hosts[host_id]['certificate_id'] in fake_npm.certs for host_id in hosts)
+
+
+def test_hosts_are_updated_without_fetching_them_again(fake_npm, reconciler):
+    host_id = fake_npm.add_host(['a.example.com'], 0, SEED_CREATED_ON)['id']
+
+    reconcile(reconciler)
+
+    assert fake_npm.hosts[host_id]['certificate_id'] != 0
+    assert fake_npm.calls['GET /api/nginx/proxy-hosts'] == 1
+    assert 'GET /api/nginx/proxy-hosts/{id}' not in fake_npm.calls
+
+
+def test_leaves_hosts_changed_while_their_certificate_was_issued(fake_npm, reconciler, step_client, monkeypatch):
+    # Issuing always takes the plan past its age, so the hosts are listed again before they are updated.
+    monkeypatch.setattr(reconciler_module, 'PLAN_MAX_AGE', 0)
+    expired = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+    old = add_certificate(fake_npm, ['a.example.com'], expired)
+    other = add_certificate(fake_npm, ['a.example.com'], expired + datetime.timedelta(days=365))
+    host_id = fake_npm.add_host(['a.example.com'], old, SEED_CREATED_ON)['id']
+    issue = step_client.issue_certificate
+
+    def issue_certificate(*args, **kwargs):
+        # Someone moves the host on to another certificate while ours is being issued.
+        fake_npm.hosts[host_id].update({'certificate_id': other, 'modified_on': '2099-01-01 00:00:00'})
+        return issue(*args, **kwargs)
+
+    step_client.issue_certificate = issue_certificate
+
+    reconcile(reconciler)
+
+    assert len(step_client.issued) == 1
+    assert fake_npm.hosts[host_id]['certificate_id'] == other
+    assert fake_npm.calls['GET /api/nginx/proxy-hosts'] == 2
+    assert 'GET /api/nginx/proxy-hosts/{id}' not in fake_npm.calls
+    # The certificate being replaced is kept, as the host never moved off it through us, and its renewal is retried.
+    assert old in fake_npm.certs
+    assert old in reconciler._renewal_queue
+    # The certificate uploaded for it is not left unused in NPM.
+    assert list(fake_npm.certs) == [old, other]
+
+
+def test_clock_is_utc_whatever_the_local_timezone(local_timezone, fake_npm, reconciler, step_client):
+    now = datetime.datetime.utcnow()
+    # Past its grace period and due for renewal an hour ago, both going by UTC.
+    new_host = fake_npm.add_host(['a.example.com'], 0, npm_time(now - datetime.timedelta(minutes=1)))['id']
+    due = add_certificate(fake_npm, ['b.example.com'], now + datetime.timedelta(hours=1))
+    fake_npm.add_host(['b.example.com'], due, SEED_CREATED_ON)
+    later = add_certificate(fake_npm, ['c.example.com'], now + datetime.timedelta(days=60))
+    fake_npm.add_host(['c.example.com'], later, SEED_CREATED_ON)
+
+    reconcile(reconciler)
+
+    assert sorted(step_client.issued) == [('a.example.com',), ('b.example.com',)]
+    assert fake_npm.hosts[new_host]['certificate_id'] != 0
+    assert due not in fake_npm.certs
+    # Two thirds of the way through the 90 days of the certificate that is not due, plus up to an hour.
+    next_renewal = reconciler.next_renewal - datetime.datetime.now(datetime.timezone.utc)
+    assert datetime.timedelta(days=30, minutes=-1) < next_renewal < datetime.timedelta(days=30, hours=1)
+
+
+def test_failed_update_keeps_the_renewal_queued(fake_npm, reconciler, step_client, monkeypatch):
+    monkeypatch.setattr(reconciler_module, 'RENEWAL_RETRY_DELAY', datetime.timedelta(0))
+    old = add_certificate(fake_npm, ['a.example.com'], datetime.datetime.utcnow() - datetime.timedelta(hours=1))
+    host_id = fake_npm.add_host(['a.example.com'], old, SEED_CREATED_ON)['id']
+    # Every attempt at the update fails, retries included.
+    fake_npm.fail('PUT /api/nginx/proxy-hosts/{id}', 500, times=3)
+
+    with pytest.raises(GenericNPMError):
+        reconcile(reconciler)
+
+    assert fake_npm.hosts[host_id]['certificate_id'] == old
+    assert old in reconciler._renewal_queue
+    # The certificate uploaded for it was deleted again rather than left unused.
+    assert list(fake_npm.certs) == [old]
+
+    reconcile(reconciler)
+
+    assert len(step_client.issued) == 2
+    assert fake_npm.hosts[host_id]['certificate_id'] != old
+    assert list(fake_npm.certs) == [fake_npm.hosts[host_id]['certificate_id']]
+
+
+def test_failed_upload_keeps_the_renewal_queued(fake_npm, reconciler, monkeypatch):
+    old = add_certificate(fake_npm, ['a.example.com'], datetime.datetime.utcnow() - datetime.timedelta(hours=1))
+    fake_npm.add_host(['a.example.com'], old, SEED_CREATED_ON)
+    fake_npm.fail('POST /api/nginx/certificates', 400)
+
+    with pytest.raises(GenericNPMError):
+        reconcile(reconciler)
+
+    assert old in reconciler._renewal_queue
@@ -0,0 +1,171 @@
+import datetime
+
+import pytest
+
+from step_npm_plugin.schedule import renewal
+from step_npm_plugin.schedule import RenewalPolicy, RenewalQueue
+
+
+UTC = datetime.timezone.utc
+ISSUED = datetime.datetime(2024, 1, 1, tzinfo=UTC)
+EXPIRES = ISSUED + datetime.timedelta(days=90)
+DAY = datetime.timedelta(days=1)
+
+
+@pytest.fixture
+def offset(monkeypatch):
+    """
+    Sets the random offset within the renewal window, as a fraction of it.
+    """
+    def set_offset(value: float) -> None:
+        monkeypatch.setattr(renewal.random, 'random', lambda: value)
+
+    return set_offset
+
+
+def test_due_once_the_fraction_of_the_lifetime_has_passed():
+    assert RenewalPolicy(2 / 3).deadline(ISSUED, EXPIRES) == ISSUED + 60 * DAY
+    assert RenewalPolicy(0.5).deadline(ISSUED, EXPIRES) == ISSUED + 45 * DAY
+
+
+def test_due_within_the_window(offset):
+    policy = RenewalPolicy(2 / 3, window=DAY)
+
+    offset(0)
+    assert policy.deadline(ISSUED, EXPIRES) == ISSUED + 60 * DAY
+    offset(0.5)
+    assert policy.deadline(ISSUED, EXPIRES) == ISSUED + 60.5 * DAY
+    offset(1)
+    assert policy.deadline(ISSUED, EXPIRES) == ISSUED + 61 * DAY
+
+
+def test_window_is_kept_within_half_the_time_left(offset):
+    offset(1)
+
+    # 30 days are left after two thirds of the lifetime, so the window is cut down to 15.
+    assert RenewalPolicy(2 / 3, window=60 * DAY).deadline(ISSUED, EXPIRES) == ISSUED + 75 * DAY
+
+
+def test_deadlines_are_spread_over_the_window():
+    policy = RenewalPolicy(2 / 3, window=DAY)
+    deadlines = {policy.deadline(ISSUED, EXPIRES) for _ in range(50)}
+
+    assert len(deadlines) > 1
+    assert all(ISSUED + 60 * DAY <= deadline <= ISSUED + 61 * DAY for deadline in deadlines)
+
+
+@pytest.mark.parametrize('issued', [None, EXPIRES, EXPIRES + DAY])
+def test_unknown_lifetimes_are_due_shortly_before_expiry(issued):
+    assert RenewalPolicy().deadline(issued, EXPIRES) == EXPIRES - renewal.UNKNOWN_LIFETIME_MARGIN
+
+
+def test_any_timezone_gives_the_same_instant():
+    brisbane = datetime.timezone(datetime.timedelta(hours=10))
+
+    deadline = RenewalPolicy(2 / 3).deadline(ISSUED.astimezone(brisbane), EXPIRES.astimezone(brisbane))
+
+    assert deadline == ISSUED + 60 * DAY
+
+
+@pytest.mark.parametrize('fraction', [0, 0.9, 1, -0.5])
+def test_invalid_fractions_are_refused(fraction):
+    with pytest.raises(ValueError):
+        RenewalPolicy(fraction)
+
+
+@pytest.mark.parametrize('issued, left, emergency', [
+    (ISSUED, 9 * DAY, True),
+    (ISSUED, 10 * DAY, False),
+    (None, datetime.timedelta(minutes=30), True),
+    (None, 2 * renewal.UNKNOWN_LIFETIME_MARGIN, False),
+])
+def test_emergencies(issued, left, emergency):
+    assert RenewalPolicy.is_emergency(issued, EXPIRES, EXPIRES - left) is emergency
+
+
+def test_renewals_are_rate_limited():
+    policy = RenewalPolicy(rate_limit=2)
+    now = ISSUED
+
+    assert policy.admit(now) and policy.admit(now + datetime.timedelta(seconds=10))
+    assert not policy.admit(now + datetime.timedelta(seconds=20))
+    assert policy.next_slot(now + datetime.timedelta(seconds=20)) == now + datetime.timedelta(minutes=1)
+
+    assert policy.admit(now + datetime.timedelta(minutes=1))
+    assert not policy.admit(now + datetime.timedelta(minutes=1))
+
+
+def test_emergencies_skip_the_rate_limit_but_use_a_slot():
+    policy = RenewalPolicy(rate_limit=1)
+    now = ISSUED
+
+    assert policy.admit(now, emergency=True)
+    assert policy.admit(now, emergency=True)
+    assert not policy.admit(now)
+    assert policy.next_slot(now) == now + datetime.timedelta(minutes=1)
+
+
+def test_no_rate_limit():
+    policy = RenewalPolicy()
+
+    assert all(policy.admit(ISSUED) for _ in range(100))
+    assert policy.next_slot(ISSUED) == ISSUED
+
+
+@pytest.mark.parametrize('call', [
+    lambda policy: policy.deadline(ISSUED.replace(tzinfo=None), EXPIRES),
+    lambda policy: policy.deadline(None, EXPIRES.replace(tzinfo=None)),
+    lambda policy: policy.is_emergency(ISSUED, EXPIRES, datetime.datetime.now()),
+    lambda policy: policy.admit(datetime.datetime.now()),
+    lambda policy: policy.next_slot(datetime.datetime.now()),
+], ids=['issued', 'expires', 'is_emergency', 'admit', 'next_slot'])
+def test_policy_refuses_naive_times(call):
+    with pytest.raises(ValueError):
+        call(RenewalPolicy(rate_limit=1))
+
+
+def test_queue_refuses_naive_times():
+    queue = RenewalQueue()
+
+    with pytest.raises(ValueError):
+        queue.push(1, datetime.datetime.now())
+    with pytest.raises(ValueError):
+        queue.pop_due(datetime.datetime.now())
+
+    assert len(queue) == 0
+
+
+def test_queue_pops_due_certificates_earliest_first():
+    queue = RenewalQueue()
+    queue.push(1, ISSUED + 2 * DAY)
+    queue.push(2, ISSUED + DAY)
+    queue.push(3, ISSUED + 3 * DAY)
+
+    assert queue.peek() == ISSUED + DAY
+    assert queue.pop_due(ISSUED + 2 * DAY) == [2, 1]
+    assert list(queue._deadlines) == [3]
+
+
+def test_queue_moves_and_removes_deadlines():
+    queue = RenewalQueue()
+    queue.push(1, ISSUED + DAY)
+    queue.push(2, ISSUED + 2 * DAY)
+
+    queue.push(1, ISSUED + 3 * DAY)
+    queue.remove(2)
+
+    assert queue.deadline(1) == ISSUED + 3 * DAY
+    assert 2 not in queue
+    assert queue.peek() == ISSUED + 3 * DAY
+    assert queue.pop_due(ISSUED + 2 * DAY) == []
+
+
+def test_queue_stays_small_when_deadlines_move():
+    queue = RenewalQueue()
+
+    for minutes in range(1000):
+        queue.push(1, ISSUED + datetime.timedelta(minutes=minutes))
+
+    assert len(queue) == 1
+    assert len(queue._heap) < 100
+    assert queue.pop_due(EXPIRES) == [1]
@@ -0,0 +1,27 @@
+import asyncio
+import datetime
+import time
+
+import pytest
+
+from step_npm_plugin.schedule import Scheduler
+
+
+def test_deadlines_are_the_same_instant_in_any_timezone(local_timezone):
+    scheduler = Scheduler('1h')
+    # The first sync is straight away.
+    asyncio.run(scheduler.wait())
+    deadline = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=5)
+
+    scheduler.set_deadline('renewal', deadline)
+
+    when, name = scheduler.next_deadline
+    assert name == 'renewal'
+    assert when == pytest.approx(time.time() + 300, abs=1)
+
+
+def test_naive_deadlines_are_refused():
+    scheduler = Scheduler('1h')
+
+    with pytest.raises(ValueError):
+        scheduler.set_deadline('renewal', datetime.datetime.now())
@@ -0,0 +1,23 @@
+from .conftest import make_config
+
+
+def test_zero_on_the_command_line_overrides_the_environment(monkeypatch):
+    monkeypatch.setenv('STEP_CACHE_SIZE', '64')
+    monkeypatch.setenv('RENEWAL_RATE_LIMIT', '5')
+
+    config = make_config('--step-cache-size', '0', '--renewal-rate-limit', '0')
+
+    assert config.STEP_CACHE_SIZE == 0
+    assert config.RENEWAL_RATE_LIMIT == 0
+
+
+def test_environment_used_when_not_on_the_command_line(monkeypatch):
+    monkeypatch.setenv('STEP_CACHE_SIZE', '64')
+
+    assert make_config().STEP_CACHE_SIZE == 64
+
+
+def test_certificate_cache_off_by_default(monkeypatch):
+    monkeypatch.delenv('STEP_CACHE_SIZE', raising=False)
+
+    assert make_config().STEP_CACHE_SIZE == 0
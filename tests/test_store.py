@@ -0,0 +1,54 @@
+import datetime
+import sqlite3
+
+from step_npm_plugin.core.store import StateStore
+from step_npm_plugin.npm import ChangeSet
+
+
+def test_entries_survive_a_restart(tmp_path):
+    store = StateStore(tmp_path / 'state.db', 'npm:81')
+    store.save_changes('proxy_host', ChangeSet(added=[{'id': 1, 'domain_names': ['a.example.com']}]))
+    store.close()
+
+    store = StateStore(tmp_path / 'state.db', 'npm:81')
+
+    assert store.load_entries('proxy_host') == [{'id': 1, 'domain_names': ['a.example.com']}]
+    store.close()
+
+
+def test_renewal_deadlines_survive_a_restart(local_timezone, tmp_path):
+    deadline = datetime.datetime(2030, 1, 1, 12, tzinfo=datetime.timezone.utc)
+    store = StateStore(tmp_path / 'state.db', 'npm:81')
+    store.save_changes('certificate', ChangeSet(added=[{'id': 1}]), renewals={1: deadline})
+    store.close()
+
+    store = StateStore(tmp_path / 'state.db', 'npm:81')
+
+    assert store.load_renewals() == {1: deadline}
+    assert store.load_renewals()[1].tzinfo is not None
+    store.close()
+
+
+def test_state_of_another_instance_is_discarded(tmp_path):
+    store = StateStore(tmp_path / 'state.db', 'npm:81')
+    store.save_changes('proxy_host', ChangeSet(added=[{'id': 1}]))
+    store.close()
+
+    store = StateStore(tmp_path / 'state.db', 'other:81')
+
+    assert store.load_entries('proxy_host') == []
+    store.close()
+
+
+def test_old_issued_table_is_dropped(tmp_path):
+    connection = sqlite3.connect(tmp_path / 'state.db')
+    connection.execute('CREATE TABLE issued (cert_id INTEGER PRIMARY KEY)')
+    connection.close()
+
+    StateStore(tmp_path / 'state.db', 'npm:81').close()
+
+    connection = sqlite3.connect(tmp_path / 'state.db')
+    tables = {name for name, in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    connection.close()
+
+    assert 'issued' not in tables and 'renewals' in tables